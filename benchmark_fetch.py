@@ -0,0 +1,264 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+fetch_manga_data のベンチマーク
+ローカルの代替サーバー（stub_servers.py）や合成データで計測するため、実際のAPIは呼び出さない
+
+使い方:
+  python benchmark_fetch.py fetch [レスポンス遅延秒数]  逐次取得と並列取得の比較
+  python benchmark_fetch.py merge [件数 ...]            content_id統合処理の比較
+  python benchmark_fetch.py stream [取得上限件数 ...]   ページング取得時のメモリ使用量の比較
+"""
+
+import contextlib
+import io
+import random
+import sys
+import os
+import tempfile
+import time
+import tracemalloc
+
+import fetch_manga_data
+import rate_limiter
+import stub_servers
+
+# 代替サーバーが1リクエストごとに待機する秒数
+DEFAULT_DELAY = 0.3
+
+# 統合処理ベンチマークのデフォルト件数
+DEFAULT_MERGE_SIZES = [10000, 50000, 100000]
+
+# 旧方式（線形探索による統合）を計測する上限件数（これを超えると時間がかかりすぎる）
+LEGACY_MERGE_LIMIT = 20000
+
+# 代替サーバーが1クエリあたりに返す総件数
+STUB_TOTAL_COUNT = 100000
+
+# ページング取得ベンチマークのデフォルト取得上限件数
+DEFAULT_STREAM_SIZES = [100, 1000, 5000]
+
+
+def start_stub_server(delay):
+    """代替サーバーを起動し、fetch_manga_dataの呼び出し先を差し替える"""
+    server, base_url = stub_servers.start(
+        stub_servers.StubConfig(latency=delay, catalog_size=STUB_TOTAL_COUNT, seed=0)
+    )
+    fetch_manga_data.ITEM_LIST_URL = f"{base_url}/affiliate/v3/ItemList"
+
+    # 代替サーバーはレート制限の対象外にする（通信時間だけを比較するため）
+    rate_limiter.configure(server.server_address[0], 1000.0, 1000)
+    return server
+
+
+def run_fetch(max_workers):
+    """fetch_itemsを1回実行し、(所要秒数, 結果)を返す"""
+    start = time.perf_counter()
+    items = fetch_manga_data.fetch_items(
+        "dummy_api_id",
+        "dummy_affiliate_id",
+        "FANZA",
+        "ebook",
+        "comic",
+        "2025-01-01",
+        max_workers=max_workers,
+    )
+    return time.perf_counter() - start, items
+
+
+def benchmark_fetch(args):
+    """代替サーバーに対して逐次取得と並列取得の所要時間を比較する"""
+    delay = float(args[0]) if args else DEFAULT_DELAY
+    server = start_stub_server(delay)
+
+    try:
+        sequential_time, sequential_items = run_fetch(max_workers=1)
+        concurrent_time, concurrent_items = run_fetch(
+            max_workers=fetch_manga_data.DEFAULT_FETCH_WORKERS
+        )
+    finally:
+        server.shutdown()
+
+    print("\n===== fetch_items ベンチマーク結果 =====")
+    print(f"代替サーバーの応答遅延: {delay:.2f}秒/リクエスト")
+    print(f"逐次取得: {sequential_time:.3f}秒 ({len(sequential_items)}件)")
+    print(f"並列取得: {concurrent_time:.3f}秒 ({len(concurrent_items)}件)")
+    if concurrent_time > 0:
+        print(f"高速化率: {sequential_time / concurrent_time:.2f}倍")
+
+    # ランキング情報・新着フラグが逐次実行と一致することを確認
+    if sequential_items == concurrent_items:
+        print("結果の一致: OK（ranking_info・is_newを含め逐次取得と同一）")
+        return True
+    print("結果の一致: NG（逐次取得と並列取得で結果が異なります）")
+    return False
+
+
+def make_merge_sources(total, seed=0):
+    """
+    統合処理用の合成データを作成する
+    5つのクエリに相当するリストを返し、content_idの一部が互いに重複するようにする
+    """
+    rng = random.Random(seed)
+    per_query = total // 5
+    id_space = int(per_query * 2.5)
+
+    queries = fetch_manga_data.build_item_queries({}, "2025-01-01")
+    sources = []
+    for _, kind, _ in queries:
+        ids = rng.sample(range(id_space), per_query)
+        query_items = [
+            {
+                "content_id": f"cid{number:07d}",
+                "title": f"合成作品{number}",
+                "rank": rank + 1,
+                "prices": {"price": "500", "list_price": "700"},
+            }
+            for rank, number in enumerate(ids)
+        ]
+        sources.append((kind, query_items))
+    return sources
+
+
+def legacy_merge(sources):
+    """旧方式: 統合のたびにリスト全体を線形探索する（O(n²)）"""
+    items = []
+    for kind, query_items in sources:
+        for item in query_items:
+            content_id = item.get("content_id")
+            existing = next(
+                (x for x in items if x.get("content_id") == content_id), None
+            )
+            if kind == "daily_rank":
+                item["ranking_info"] = {"daily_rank": item.get("rank", 0)}
+                items.append(item)
+            elif kind in ("weekly_rank", "monthly_rank"):
+                if existing:
+                    existing["ranking_info"][kind] = item.get("rank", 0)
+                else:
+                    item["ranking_info"] = {kind: item.get("rank", 0)}
+                    items.append(item)
+            elif kind == "new":
+                if existing:
+                    existing["is_new"] = True
+                else:
+                    item["is_new"] = True
+                    item["ranking_info"] = {}
+                    items.append(item)
+            elif not existing:
+                if "ranking_info" not in item:
+                    item["ranking_info"] = {}
+                items.append(item)
+    return items
+
+
+def indexed_merge(sources):
+    """新方式: ItemIndexによる統合（O(n)）"""
+    index = fetch_manga_data.ItemIndex()
+    # 件数表示などのログは計測対象外にする
+    with contextlib.redirect_stdout(io.StringIO()):
+        for kind, query_items in sources:
+            fetch_manga_data.merge_query_items(index, kind, kind, query_items)
+    return index.items()
+
+
+def benchmark_merge(args):
+    """合成データで線形探索とインデックスによる統合の所要時間を比較する"""
+    sizes = [int(arg) for arg in args] if args else DEFAULT_MERGE_SIZES
+
+    print("\n===== content_id 統合ベンチマーク結果 =====")
+    ok = True
+    for size in sizes:
+        sources = make_merge_sources(size)
+        start = time.perf_counter()
+        indexed_items = indexed_merge(sources)
+        indexed_time = time.perf_counter() - start
+
+        if size > LEGACY_MERGE_LIMIT:
+            print(
+                f"{size}件: インデックス {indexed_time:.3f}秒 / "
+                f"線形探索 スキップ（{LEGACY_MERGE_LIMIT}件超）"
+            )
+            continue
+
+        sources = make_merge_sources(size)
+        start = time.perf_counter()
+        legacy_items = legacy_merge(sources)
+        legacy_time = time.perf_counter() - start
+
+        same = legacy_items == indexed_items
+        ok = ok and same
+        print(
+            f"{size}件: インデックス {indexed_time:.3f}秒 / 線形探索 {legacy_time:.3f}秒 "
+            f"({legacy_time / max(indexed_time, 1e-9):.1f}倍) 結果一致: {'OK' if same else 'NG'}"
+        )
+    return ok
+
+
+def measure_peak_memory(func):
+    """funcを実行し、(戻り値, 所要秒数, ピークメモリ[MB])を返す"""
+    tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            result = func()
+        elapsed = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return result, elapsed, peak / (1024 * 1024)
+
+
+def benchmark_stream(args):
+    """ページング取得時のメモリ使用量を、一括保持とJSON Lines逐次書き出しで比較する"""
+    sizes = [int(arg) for arg in args] if args else DEFAULT_STREAM_SIZES
+    server = start_stub_server(0)
+
+    print("\n===== ページング取得ベンチマーク結果 =====")
+    ok = True
+    try:
+        with tempfile.TemporaryDirectory() as work_dir:
+            output_path = os.path.join(work_dir, "manga_data_raw.jsonl")
+            fetch_args = ("dummy", "dummy", "FANZA", "ebook", "comic", "2025-01-01")
+
+            for size in sizes:
+                items, list_time, list_peak = measure_peak_memory(
+                    lambda: fetch_manga_data.fetch_items(*fetch_args, max_items=size)
+                )
+                count, stream_time, stream_peak = measure_peak_memory(
+                    lambda: fetch_manga_data.fetch_items_to_jsonl(
+                        *fetch_args, output_path, max_items=size
+                    )
+                )
+
+                same = items == list(fetch_manga_data.iter_jsonl(output_path))
+                ok = ok and same
+                print(
+                    f"上限{size}件/クエリ ({count}作品): "
+                    f"一括保持 {list_peak:.1f}MB {list_time:.2f}秒 / "
+                    f"JSON Lines {stream_peak:.1f}MB {stream_time:.2f}秒 "
+                    f"結果一致: {'OK' if same else 'NG'}"
+                )
+    finally:
+        server.shutdown()
+    return ok
+
+
+def main():
+    command = sys.argv[1] if len(sys.argv) > 1 else "fetch"
+    args = sys.argv[2:]
+
+    if command == "fetch":
+        return benchmark_fetch(args)
+    if command == "merge":
+        return benchmark_merge(args)
+    if command == "stream":
+        return benchmark_stream(args)
+
+    print(f"不明なコマンドです: {command}")
+    print(__doc__)
+    return False
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
@@ -0,0 +1,1188 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+process_manga_data の選定処理のベンチマーク
+fixtures/dmm_items.jsonl をもとに合成したデータで、行ごとのapplyによる旧方式・
+列単位（ベクトル化）のpandas版・pandasを使わない通常の経路の所要時間と起動時間を比較し、
+選定結果と投稿用テキストが一致することを確認する
+
+使い方:
+  python benchmark_process.py select [件数 ...]      選定処理の所要時間の比較
+  python benchmark_process.py startup [試行回数]     起動時間（-X importtime / 実時間）の比較
+  python benchmark_process.py stream [リライト件数]   通常とストリーミングのリライトの比較
+  python benchmark_process.py hedge [リライト件数]    ヘッジリクエストの有無によるリライト所要時間の分布の比較
+  python benchmark_process.py extract [繰り返し回数]  AI応答からの投稿テキスト抽出の比較
+  python benchmark_process.py hashtags [辞書件数 ...] ハッシュタグ辞書の照合（線形探索 / オートマトン）の比較
+  python benchmark_process.py history [年数 ...]      投稿履歴の追記と直近7日間の確認の比較
+  python benchmark_process.py similar [索引件数 ...]  似た投稿テキストの確認（総当たり / MinHash）の比較
+  python benchmark_process.py images [作品数]         表紙画像の取得（なし / 直列 / 並行）による処理時間の比較
+"""
+
+import contextlib
+import io
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+# process_manga_dataは読み込み時に必須環境変数をチェックするため、ダミー値を設定しておく
+for name in (
+    "AFFILIATE_ID",
+    "AFFILIATE_SITE",
+    "AFFILIATE_CHANNEL",
+    "AFFILIATE_POST_SITE",
+    "AFFILIATE_POST_CHANNEL",
+    "AFFILIATE_POST_CHANNEL_ID",
+    "OPENROUTER_API_KEY",
+    "OPENROUTER_MODEL",
+    "OPENROUTER_SYSTEM_PROMPT",
+    "OPENROUTER_USER_PROMPT_TEMPLATE",
+):
+    os.environ.setdefault(name, "benchmark")
+
+import pandas as pd
+
+import post_history
+import process_manga_data
+import rate_limiter
+from keyword_matcher import KeywordMatcher
+import stub_servers
+import text_similarity
+
+# 選定処理ベンチマークのデフォルト件数
+DEFAULT_SELECT_SIZES = [1000, 10000, 100000]
+
+# 起動時間ベンチマークのデフォルト試行回数
+DEFAULT_STARTUP_RUNS = 5
+
+# ストリーミングベンチマークのデフォルトのリライト件数
+DEFAULT_STREAM_RUNS = 30
+
+# ストリーミングベンチマークで代替サーバーが応答の生成時間として数文字ごとに待機する秒数
+STREAM_TOKEN_DELAY = 0.02
+
+# ヘッジリクエストのベンチマークのデフォルトのリライト件数
+DEFAULT_HEDGE_RUNS = 100
+
+# ヘッジリクエストのベンチマークで代替サーバーが極端に遅い応答を返す割合と、その遅延（秒）
+HEDGE_TAIL_RATE = 0.05
+HEDGE_TAIL_LATENCY = 3.0
+
+# ヘッジリクエストのベンチマークで予備として使うモデル
+HEDGE_SECONDARY_MODEL = "stub/secondary-model"
+
+# 抽出処理のベンチマークでAI応答のコーパス全体を処理する回数
+DEFAULT_EXTRACT_REPEAT = 20
+
+# 抽出処理のベンチマークに使う記録済みのAI応答
+FIXTURE_RESPONSES_FILE = os.path.join("fixtures", "openrouter_responses.json")
+
+# ハッシュタグ辞書のベンチマークで比較する辞書の件数と、選ぶハッシュタグの最大数
+DEFAULT_HASHTAG_SIZES = [100, 1000, 10000, 100000]
+HASHTAG_BENCHMARK_MAX_TAGS = 3
+
+# ハッシュタグ辞書のベンチマークでタイトルの一部から作るキーワードの数（残りはタイトルと無関係な語）
+HASHTAG_TITLE_KEYWORDS = 50
+
+# 投稿履歴のベンチマークで比較する履歴の年数と、1日あたりの投稿数・計測の繰り返し回数
+DEFAULT_HISTORY_YEARS = [1, 5, 20]
+HISTORY_POSTS_PER_DAY = 3
+HISTORY_BENCHMARK_RUNS = 20
+
+# 類似テキストのベンチマークで比較する索引の件数と、計測の繰り返し回数
+DEFAULT_SIMILAR_SIZES = [100, 1000, 10000]
+SIMILAR_BENCHMARK_RUNS = 50
+
+# 表紙画像のベンチマークでリライトする作品数と、代替サーバーの応答遅延（秒）
+DEFAULT_IMAGE_POSTS = 5
+IMAGE_BENCHMARK_LATENCY = 0.2
+
+# 合成データの元にするフィクスチャ
+FIXTURE_ITEMS_FILE = os.path.join("fixtures", "dmm_items.jsonl")
+
+
+def load_fixture_items():
+    """合成データの元になる作品データを読み込む"""
+    with open(FIXTURE_ITEMS_FILE, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def make_items(count, seed=0):
+    """
+    fetch_manga_data.pyの出力と同じ形の作品データを指定件数だけ合成する
+    新着・予約・単話・ノベル・低価格・ランキングの組み合わせがまんべんなく出るようにする
+    """
+    rng = random.Random(seed)
+    base_items = load_fixture_items()
+    today = datetime.now()
+
+    items = []
+    for i in range(count):
+        item = dict(base_items[i % len(base_items)])
+        item["content_id"] = f"{item['content_id']}_{i}"
+
+        suffix = rng.choice(["", "", "", "【単話】", " ノベル版"])
+        item["title"] = f"{item['title']}{suffix}"
+
+        if rng.random() < 0.1:
+            item["URL"] = item["URL"] + "?exclusive=1"
+
+        # 1割は予約商品（未来の日付）にする
+        offset = rng.randint(-10, -1) if rng.random() > 0.1 else rng.randint(1, 30)
+        item["date"] = (today + timedelta(days=offset)).strftime("%Y-%m-%d %H:%M:%S")
+
+        price = rng.choice([110, 330, 440, 550, 770, 1100])
+        item["prices"] = {"price": f"{price}~", "list_price": str(price + 110)}
+
+        ranking_info = {}
+        for key in ("daily_rank", "weekly_rank", "monthly_rank"):
+            if rng.random() < 0.4:
+                ranking_info[key] = rng.randint(1, 300)
+        item["ranking_info"] = ranking_info
+
+        if rng.random() < 0.6:
+            item["is_new"] = True
+
+        items.append(item)
+    return items
+
+
+def legacy_select_manga(manga_data):
+    """旧方式: 行ごとのapplyで判定・整形する（比較用に変更前の処理をそのまま残したもの）"""
+    df = pd.DataFrame(manga_data)
+
+    df["is_fanza_exclusive"] = df["URL"].apply(
+        lambda x: "exclusive" in x or "独占" in str(x) if pd.notna(x) else False
+    )
+
+    today = datetime.now().strftime("%Y-%m-%d")
+
+    def is_reservation(row):
+        if "date" in row and pd.notna(row["date"]):
+            try:
+                release_date = str(row["date"]).split(" ")[0]
+                return release_date > today
+            except:
+                return False
+        return False
+
+    df["is_reservation"] = df.apply(is_reservation, axis=1)
+
+    def extract_price(row):
+        if (
+            "prices" in row
+            and isinstance(row["prices"], dict)
+            and "price" in row["prices"]
+        ):
+            try:
+                price_str = str(row["prices"]["price"])
+                price_num = int("".join(filter(str.isdigit, price_str)))
+                return price_num
+            except:
+                return None
+        return None
+
+    df["price_value"] = df.apply(extract_price, axis=1)
+
+    df["is_new"] = df.get("is_new", False)
+    df["is_exclusive"] = df["is_fanza_exclusive"]
+    df["is_tankowa"] = df["title"].apply(
+        lambda x: "単話" in str(x) if pd.notna(x) else False
+    )
+    df["is_novel"] = df["title"].apply(
+        lambda x: "ノベル" in str(x) if pd.notna(x) else False
+    )
+
+    df = df[~df["is_reservation"]]
+
+    selected_manga = df[
+        (df["is_new"] == True)
+        & ((df["price_value"].isnull()) | (df["price_value"] >= 400))
+        & (~df["is_tankowa"])
+        & (~df["is_novel"])
+    ].copy()
+
+    def format_ranking(row):
+        if "ranking_info" not in row:
+            return ""
+
+        ranking_info = row["ranking_info"]
+        ranking_text = []
+
+        if "daily_rank" in ranking_info and ranking_info["daily_rank"] <= 50:
+            ranking_text.append(f"日間{ranking_info['daily_rank']}位")
+
+        if "weekly_rank" in ranking_info and ranking_info["weekly_rank"] <= 100:
+            ranking_text.append(f"週間{ranking_info['weekly_rank']}位")
+
+        if "monthly_rank" in ranking_info and ranking_info["monthly_rank"] <= 200:
+            ranking_text.append(f"月間{ranking_info['monthly_rank']}位")
+
+        return "・".join(ranking_text)
+
+    selected_manga["ranking_text"] = selected_manga.apply(format_ranking, axis=1)
+
+    def create_post_text(row):
+        post_parts = []
+
+        title = row.get("title", "")
+        post_parts.append(f"『{title}』")
+
+        if "author" in row:
+            author = row["author"]
+            if author:
+                post_parts.append(f"作者: {author}")
+        elif "artistName" in row:
+            author = row["artistName"]
+            if author:
+                post_parts.append(f"作者: {author}")
+
+        features = []
+        if row["is_new"]:
+            features.append("🆕新着")
+        if row["is_exclusive"]:
+            features.append("🔒FANZA限定")
+
+        if features:
+            post_parts.append("【" + "・".join(features) + "】")
+
+        if row["ranking_text"]:
+            post_parts.append(f"📊ランキング: {row['ranking_text']}")
+
+        if (
+            "prices" in row
+            and isinstance(row["prices"], dict)
+            and "price" in row["prices"]
+        ):
+            price = row["prices"]["price"]
+            post_parts.append(f"💴価格: {price}円")
+
+        post_parts.append("#PR")
+
+        return "\n".join(post_parts)
+
+    selected_manga["post_text"] = selected_manga.apply(create_post_text, axis=1)
+    return selected_manga
+
+
+def legacy_extract_rewritten_text(text, original_text=None):
+    """
+    旧方式: 呼び出しごとに正規表現とハッシュタグの表を作り直して抽出する
+    （比較用に変更前のextract_rewritten_textをそのまま残したもの）
+    """
+    import re
+    import random
+
+    # ログ出力（デバッグ用）
+    print(f"元のAI応答テキスト:\n{text}")
+
+    # マークダウン形式のヘッダーを削除 (# や ## で始まる行)
+    text = re.sub(r"^#+ .*$", "", text, flags=re.MULTILINE)
+
+    # マークダウンの強調表示を削除 (**text** や *text*)
+    text = re.sub(r"\*\*(.*?)\*\*", r"\1", text)
+    text = re.sub(r"\*(.*?)\*", r"\1", text)
+
+    # マークダウン形式のリスト（数字や記号で始まる行）を検出して除去
+    text = re.sub(r"^\d+\.\s.*$", "", text, flags=re.MULTILINE)  # 数字リスト
+    text = re.sub(r"^[•*\-]\s.*$", "", text, flags=re.MULTILINE)  # 記号リスト
+
+    # コード部分やマークダウンブロックを除去
+    text = re.sub(r"```.*?```", "", text, flags=re.DOTALL)
+
+    # 金額に関する表現を削除（例：100円、1,000円、¥500など）
+    text = re.sub(r"\d{1,3}(,\d{3})*円", "", text)
+    text = re.sub(r"¥\d{1,3}(,\d{3})*", "", text)
+    text = re.sub(r"\d+(円|万円|千円)", "", text)
+
+    # 金額を含む文章パターンを削除（「〜円で」などの表現）
+    text = re.sub(r"[\d,.]+円[でにはが]", "", text)
+    text = re.sub(r"コスパ[がは]?[良最高]", "", text)
+
+    # 価格に関連する表現を削除
+    text = re.sub(r"(お買い得|格安|安い|高い|値段|料金|価格)", "", text)
+
+    # ハッシュタグ候補を用意
+    hashtag_candidates = [
+        "#官能",
+        "#ファンタジー",
+        "#背徳感",
+        "#ドキドキ",
+        "#興奮",
+        "#ハーレム",
+        "#アダルト",
+        "#エロマンガ",
+        "#成人向け",
+        "#エロ漫画",
+        "#おすすめ",
+        "#人気",
+        "#新刊",
+        "#BL",
+        "#GL",
+        "#TL",
+        "#マンガ",
+        "#漫画",
+        "#コミック",
+        "#妄想",
+        "#大人の時間",
+        "#フェチ",
+        "#ギャル",
+        "#美少女",
+        "#エッチ",
+        "#読書",
+        "#電子書籍",
+        "#濡れる",
+        "#おうち時間",
+        "#熱い",
+    ]
+
+    # タイトルから適切なハッシュタグを選ぶ
+    title_keywords = {
+        "ハーレム": "#ハーレム",
+        "孕ませ": "#大人の時間",
+        "絶頂": "#エッチ",
+        "搾": "#フェチ",
+        "魔物": "#ファンタジー",
+        "触手": "#フェチ",
+        "女子校生": "#美少女",
+        "JK": "#美少女",
+        "妹": "#背徳感",
+        "姉": "#背徳感",
+        "先生": "#背徳感",
+        "義理": "#背徳感",
+        "学園": "#青春",
+        "ファンタジー": "#ファンタジー",
+        "ダンジョン": "#ファンタジー",
+        "メイド": "#美少女",
+        "巨乳": "#おっぱい",
+        "爆乳": "#おっぱい",
+        "BL": "#BL",
+        "GL": "#GL",
+        "TL": "#TL",
+    }
+
+    # 原文からタイトルを抽出（後で使用）
+    title = ""
+    if original_text:
+        title_match = re.search(r"『(.+?)』", original_text)
+        if title_match:
+            title = title_match.group(1)
+
+    # タイトルからハッシュタグを選定
+    selected_hashtag = None
+    if title:
+        for keyword, tag in title_keywords.items():
+            if keyword in title:
+                selected_hashtag = tag
+                break
+
+    # タイトルから選べなかった場合は適切なカテゴリまたはランダム選択
+    if not selected_hashtag:
+        if "BL" in text:
+            selected_hashtag = "#BL"
+        elif "百合" in text or "GL" in text:
+            selected_hashtag = "#GL"
+        elif "TL" in text:
+            selected_hashtag = "#TL"
+        else:
+            selected_hashtag = random.choice(hashtag_candidates)
+
+    # AIのテキストから投稿用の文章を選択するロジック
+    # 明示的な指示や例の部分を取り除く
+    filtered_text = re.sub(
+        r"^(例:|例：|ツイート例|投稿例|以下のような).*$", "", text, flags=re.MULTILINE
+    )
+
+    # 日本語テキスト部分を抽出
+    japanese_lines = []
+    for line in filtered_text.split("\n"):
+        # 空行やマークダウン記号のみの行をスキップ
+        if not line.strip() or line.strip() in ["---", "***", "___"]:
+            continue
+        # 明らかな解説や指示は除外
+        if re.match(r"^(これは|ここで|このツイート|この投稿|解説：)", line):
+            continue
+        # 日本語を含む行を抽出
+        if re.search(r"[ぁ-んァ-ン一-龥]", line):
+            japanese_lines.append(line.strip())
+
+    # 日本語テキストが見つからなかった場合のフォールバック
+    if not japanese_lines:
+        fallback_texts = [
+            "これマジでヤバい内容…見た瞬間興奮が止まらない😳",
+            "背徳感すごいのに目が離せない…こんなの反則だろ🔥",
+            "見てるだけで羨ましすぎる…最高かよ😍",
+            "こんな展開待ってた！超興奮する内容でヤバい😳",
+            "私の理性が崩壊しそう…こんな濃厚な展開ヤバすぎ💦",
+            "これ見た瞬間に我慢できなくなって即買いしたわw🔥",
+            "急にこんなシチュエーションになるとか反則すぎる…💦",
+        ]
+        final_text = random.choice(fallback_texts) + "…！"
+    else:
+        # 変更点: カジュアルさを優先しつつも、テキストがより残るようにする
+        # 一旦全ての日本語テキストを連結（最大3行まで）
+        main_text = " ".join(japanese_lines[:3])
+
+        # 長すぎる場合は調整（最大120文字）- 以前の60文字から拡大
+        if len(main_text) > 120:
+            main_text = main_text[:120] + "…"
+
+        # 最終的に金額情報が含まれていないか再チェック
+        main_text = re.sub(r"\d{1,3}(,\d{3})*円", "", main_text)
+        main_text = re.sub(r"¥\d{1,3}(,\d{3})*", "", main_text)
+        main_text = re.sub(r"[\d,.]+円[でにはが]", "", main_text)
+
+        final_text = main_text
+
+    # 絵文字がなければ追加
+    if not re.search(r"[😍😳🔥💦❤️]", final_text):
+        emoji_options = ["😳", "😍", "🔥", "💦", "❤️"]
+        final_text += random.choice(emoji_options)
+
+    # PRタグとハッシュタグを追加
+    final_text = final_text.strip() + "\n\n" + selected_hashtag + " #PR"
+
+    # 最終チェック - 空の投稿や絵文字だけの投稿にならないようにする
+    text_content = re.sub(r"[😍😳🔥💦❤️\s]", "", final_text)
+    if len(text_content) < 5:  # 実質的な内容が少なすぎる場合
+        fallback = (
+            "これヤバすぎる内容…興奮が止まらない😳\n\n" + selected_hashtag + " #PR"
+        )
+        print(
+            f"テキスト内容が不足しているため、フォールバックテキストを使用します: {fallback}"
+        )
+        return fallback
+
+    print(f"最終的に抽出されたテキスト: {final_text}")
+    return final_text
+
+
+def run_quietly(func, *args):
+    """標準出力を捨てて関数を1回実行し、(所要秒数, 結果)を返す"""
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        result = func(*args)
+        elapsed = time.perf_counter() - start
+    return elapsed, result
+
+
+def summarize(selected_manga):
+    """比較用に選定結果を(タイトル, ランキング表示, 投稿用テキスト)のリストにする"""
+    if isinstance(selected_manga, list):
+        return [
+            (item["title"], item["ranking_text"], item["post_text"])
+            for item in selected_manga
+        ]
+    return list(
+        zip(
+            selected_manga["title"].tolist(),
+            selected_manga["ranking_text"].tolist(),
+            selected_manga["post_text"].tolist(),
+        )
+    )
+
+
+def benchmark_select(args):
+    """旧方式・ベクトル化・pandasなしの選定処理の所要時間を件数ごとに比較する"""
+    sizes = [int(arg) for arg in args] or DEFAULT_SELECT_SIZES
+
+    print(
+        f"{'件数':>8} {'選定数':>8} {'旧方式(秒)':>12} {'ベクトル化(秒)':>14} "
+        f"{'pandasなし(秒)':>14}"
+    )
+    for size in sizes:
+        items = make_items(size)
+
+        legacy_time, legacy_selected = run_quietly(legacy_select_manga, items)
+        vectorized_time, vectorized_selected = run_quietly(
+            process_manga_data.select_manga, items
+        )
+        records_time, records_selected = run_quietly(
+            process_manga_data.select_manga_records, items
+        )
+
+        expected = summarize(legacy_selected)
+        if summarize(vectorized_selected) != expected:
+            print(f"エラー: {size}件で旧方式とベクトル化の選定結果が一致しません")
+            return False
+        if summarize(records_selected) != expected:
+            print(f"エラー: {size}件で旧方式とpandasなしの選定結果が一致しません")
+            return False
+
+        print(
+            f"{size:>8} {len(records_selected):>8} {legacy_time:>12.3f} "
+            f"{vectorized_time:>14.3f} {records_time:>14.3f}"
+        )
+
+    print("すべての件数で選定結果と投稿用テキストが一致しました")
+    return True
+
+
+def run_startup(code, importtime=False):
+    """
+    新しいPythonプロセスでコードを実行し、(所要秒数, 標準エラー出力)を返す
+    importtime=Trueの場合は -X importtime を付けて各モジュールの読み込み時間を出力させる
+    """
+    command = [sys.executable]
+    if importtime:
+        command += ["-X", "importtime"]
+    command += ["-c", code]
+
+    start = time.perf_counter()
+    result = subprocess.run(
+        command, capture_output=True, text=True, env=os.environ.copy(), check=True
+    )
+    return time.perf_counter() - start, result.stderr
+
+
+def parse_importtime(stderr):
+    """
+    -X importtime の出力から、トップレベルの読み込み時間の合計（秒）と
+    pandasが読み込まれたかどうかを返す
+    """
+    total_us = 0
+    loaded_pandas = False
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:") :].split("|")
+        if name.strip() == "pandas":
+            loaded_pandas = True
+        # 入れ子の読み込みは名前の前に空白が付く（トップレベルのcumulativeは子を含む）
+        if not name[1:].startswith(" "):
+            total_us += int(cumulative)
+    return total_us / 1_000_000, loaded_pandas
+
+
+def benchmark_startup(args):
+    """
+    process_manga_dataを読み込んで選定処理を1回行うまでの起動時間を、
+    通常の経路（pandasなし）と分析モード（pandasを読み込む）で比較する
+    """
+    runs = int(args[0]) if args else DEFAULT_STARTUP_RUNS
+    load_items = (
+        "import json\n"
+        f"items = [json.loads(line) for line in open({FIXTURE_ITEMS_FILE!r}, "
+        "encoding='utf-8') if line.strip()]\n"
+        "import contextlib, io\n"
+        "with contextlib.redirect_stdout(io.StringIO()):\n"
+        "    import process_manga_data\n"
+    )
+    paths = [
+        (
+            "pandasなし",
+            load_items + "    process_manga_data.select_manga_records(items)\n",
+        ),
+        ("分析モード", load_items + "    process_manga_data.select_manga(items)\n"),
+    ]
+
+    print(
+        f"{'経路':<10} {'起動+選定 中央値(秒)':>20} {'importtime合計(秒)':>18} "
+        f"{'pandas読み込み':>14}"
+    )
+    for label, code in paths:
+        wall_times = sorted(run_startup(code)[0] for _ in range(runs))
+        _, stderr = run_startup(code, importtime=True)
+        import_seconds, loaded_pandas = parse_importtime(stderr)
+        print(
+            f"{label:<10} {wall_times[len(wall_times) // 2]:>20.3f} "
+            f"{import_seconds:>18.3f} {'あり' if loaded_pandas else 'なし':>14}"
+        )
+    return True
+
+
+def rewrite_each(texts):
+    """投稿テキストを1件ずつリライトする"""
+    return [process_manga_data.rewrite_text_with_ai(text) for text in texts]
+
+
+def benchmark_stream(args):
+    """
+    代替サーバーに対して、通常のリライトとストリーミング（途中打ち切りあり）のリライトの
+    所要時間と、受信した応答の文字数（出力トークンに相当）を比較する
+    """
+    runs = int(args[0]) if args else DEFAULT_STREAM_RUNS
+    with contextlib.redirect_stdout(io.StringIO()):
+        selected = process_manga_data.select_manga_records(make_items(runs * 10))
+    texts = [item["post_text"] for item in selected[:runs]]
+
+    # キャッシュは使わず、毎回APIを呼び出す
+    process_manga_data.rewrite_cache = None
+
+    print(
+        f"{'方式':<10} {'件数':>6} {'合計(秒)':>10} {'1件あたり(秒)':>14} {'受信文字数':>10}"
+    )
+    for label, streaming in (("通常", False), ("ストリーミング", True)):
+        # 両方式で同じ順番の応答が返るよう、毎回同じシードで代替サーバーを起動する
+        server, base_url = stub_servers.start(
+            stub_servers.StubConfig(latency=0.2, token_delay=STREAM_TOKEN_DELAY, seed=0)
+        )
+        rate_limiter.configure(server.server_address[0], 1000.0, 1000)
+        process_manga_data.OPENROUTER_API_BASE = f"{base_url}/api/v1"
+        process_manga_data.STREAM_REWRITES = streaming
+        try:
+            elapsed, _ = run_quietly(rewrite_each, texts)
+        finally:
+            server.shutdown()
+
+        counts = server.state.counts
+        chars = counts[
+            "chat/completions:stream_chars" if streaming else "chat/completions:chars"
+        ]
+        print(
+            f"{label:<10} {len(texts):>6} {elapsed:>10.2f} "
+            f"{elapsed / len(texts):>14.3f} {chars:>10,}"
+        )
+    return True
+
+
+def percentile(values, percent):
+    """最近接順位法でパーセンタイル値を求める"""
+    values = sorted(values)
+    rank = max(1, -(-len(values) * percent // 100))
+    return values[min(len(values), int(rank)) - 1]
+
+
+def benchmark_hedge(args):
+    """
+    一部のリクエストが極端に遅くなる代替サーバーに対して、通常のリライトと
+    ヘッジリクエスト（予備のモデルにも送って先に届いた応答を採用）の所要時間の分布を比較する
+    """
+    runs = int(args[0]) if args else DEFAULT_HEDGE_RUNS
+    with contextlib.redirect_stdout(io.StringIO()):
+        selected = process_manga_data.select_manga_records(make_items(runs * 10))
+    texts = [item["post_text"] for item in selected[:runs]]
+
+    # キャッシュは使わず、毎回APIを呼び出す
+    process_manga_data.rewrite_cache = None
+    process_manga_data.STREAM_REWRITES = False
+
+    print(
+        f"{'方式':<10} {'件数':>6} {'p50(秒)':>9} {'p95(秒)':>9} {'p99(秒)':>9} "
+        f"{'最大(秒)':>9} {'リクエスト数':>12}"
+    )
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for label, hedge_models in (
+            ("通常", []),
+            ("ヘッジ", [HEDGE_SECONDARY_MODEL]),
+        ):
+            server, base_url = stub_servers.start(
+                stub_servers.StubConfig(
+                    latency=0.2,
+                    jitter=0.1,
+                    tail_rate=HEDGE_TAIL_RATE,
+                    tail_latency=HEDGE_TAIL_LATENCY,
+                    seed=0,
+                )
+            )
+            rate_limiter.configure(server.server_address[0], 1000.0, 1000)
+            process_manga_data.OPENROUTER_API_BASE = f"{base_url}/api/v1"
+            process_manga_data.HEDGE_MODELS = hedge_models
+            process_manga_data.REWRITE_LATENCY_FILE = os.path.join(
+                tmp_dir, f"{label}.jsonl"
+            )
+            process_manga_data.rewrite_latencies = None
+
+            latencies = []
+            try:
+                for text in texts:
+                    elapsed, _ = run_quietly(
+                        process_manga_data.rewrite_text_with_ai, text
+                    )
+                    latencies.append(elapsed)
+            finally:
+                server.shutdown()
+
+            print(
+                f"{label:<10} {len(texts):>6} {percentile(latencies, 50):>9.2f} "
+                f"{percentile(latencies, 95):>9.2f} {percentile(latencies, 99):>9.2f} "
+                f"{max(latencies):>9.2f} {server.state.counts['chat/completions']:>12}"
+            )
+
+            if hedge_models:
+                with open(
+                    process_manga_data.REWRITE_LATENCY_FILE, "r", encoding="utf-8"
+                ) as f:
+                    records = [json.loads(line) for line in f]
+                hedged = sum(1 for record in records if len(record["models"]) > 1)
+                secondary_wins = sum(
+                    1 for record in records if record["winner"] == HEDGE_SECONDARY_MODEL
+                )
+                print(
+                    f"  予備のモデルを起動: {hedged}件 / 予備のモデルを採用: {secondary_wins}件"
+                )
+    return True
+
+
+def load_extract_corpus():
+    """
+    記録済みのAI応答と元の投稿テキストの組を返す
+    タイトルからハッシュタグを選べない場合や空の応答（フォールバック）も含める
+    """
+    with open(FIXTURE_RESPONSES_FILE, "r", encoding="utf-8") as f:
+        responses = json.load(f) + [""]
+    with contextlib.redirect_stdout(io.StringIO()):
+        selected = process_manga_data.select_manga_records(
+            make_items(len(responses) * 10)
+        )
+    post_texts = [item["post_text"] for item in selected]
+    return [
+        (response, post_texts[i % len(post_texts)] if i % 4 else None)
+        for i, response in enumerate(responses)
+    ]
+
+
+def extract_corpus(extract, corpus, repeat=1):
+    """コーパス全体を抽出する（乱数は応答ごとに同じシードで初期化する）"""
+    results = []
+    for _ in range(repeat):
+        results = []
+        for seed, (response, original_text) in enumerate(corpus):
+            random.seed(seed)
+            results.append((extract(response, original_text), random.random()))
+    return results
+
+
+def benchmark_extract(args):
+    """
+    記録済みのAI応答に対して、旧方式と事前コンパイル版のextract_rewritten_textの所要時間を比較し、
+    同じシードで同じ投稿テキストになる（乱数の消費も同じ）ことを確認する
+    """
+    repeat = int(args[0]) if args else DEFAULT_EXTRACT_REPEAT
+    corpus = load_extract_corpus()
+
+    _, expected = run_quietly(extract_corpus, legacy_extract_rewritten_text, corpus)
+    _, actual = run_quietly(
+        extract_corpus, process_manga_data.extract_rewritten_text, corpus
+    )
+    for (response, _), expected_result, actual_result in zip(corpus, expected, actual):
+        if expected_result != actual_result:
+            print("エラー: 旧方式と抽出結果が一致しません")
+            print(f"AI応答: {response!r}")
+            print(f"旧方式: {expected_result!r}")
+            print(f"新方式: {actual_result!r}")
+            return False
+
+    legacy_time, _ = run_quietly(
+        extract_corpus, legacy_extract_rewritten_text, corpus, repeat
+    )
+    compiled_time, _ = run_quietly(
+        extract_corpus, process_manga_data.extract_rewritten_text, corpus, repeat
+    )
+    calls = len(corpus) * repeat
+    print(
+        f"{'方式':<12} {'呼び出し数':>10} {'合計(秒)':>10} {'1件あたり(マイクロ秒)':>22}"
+    )
+    for label, elapsed in (("旧方式", legacy_time), ("事前コンパイル", compiled_time)):
+        print(
+            f"{label:<12} {calls:>10} {elapsed:>10.3f} {elapsed / calls * 1e6:>22.1f}"
+        )
+    print(f"{len(corpus)}件のAI応答すべてで抽出結果が一致しました")
+    return True
+
+
+def make_hashtag_entries(size, titles, seed=0):
+    """
+    hashtag_keywords.jsonの辞書に、タイトルの一部（一定数）と無関係な語を加えてsize件の辞書を作る
+    （辞書が大きくなっても、1つのタイトルに含まれるキーワードの数はほぼ変わらない）
+    戻り値: (キーワード, ハッシュタグ, 優先度)のリスト
+    """
+    rng = random.Random(seed)
+    with open(process_manga_data.HASHTAG_KEYWORDS_FILE, "r", encoding="utf-8") as f:
+        entries = [
+            (entry["keyword"], entry["hashtag"], entry.get("priority", 0))
+            for entry in json.load(f)
+        ]
+
+    katakana = [chr(code) for code in range(ord("ァ"), ord("ン") + 1)]
+    for index in range(size - len(entries)):
+        if index < HASHTAG_TITLE_KEYWORDS:
+            length = rng.randint(2, 4)
+            title = rng.choice(titles)
+            start = rng.randrange(max(1, len(title) - length + 1))
+            keyword = title[start : start + length]
+        else:
+            keyword = "".join(rng.choice(katakana) for _ in range(rng.randint(3, 6)))
+        entries.append((keyword, f"#タグ{rng.randrange(size)}", rng.randint(0, 9)))
+    return entries[:size]
+
+
+def linear_select(entries, title, limit):
+    """旧方式: 優先順に並べた辞書を1件ずつ調べる（比較用）"""
+    selected = []
+    for keyword, tag, _ in entries:
+        if keyword in title and tag not in selected:
+            selected.append(tag)
+            if len(selected) >= limit:
+                break
+    return selected
+
+
+def benchmark_hashtags(args):
+    """
+    辞書の件数ごとに、線形探索とオートマトンによるハッシュタグ選定の所要時間を比較し、
+    同じハッシュタグが選ばれることを確認する
+    """
+    sizes = [int(arg) for arg in args] or DEFAULT_HASHTAG_SIZES
+    titles = [item["title"] for item in load_fixture_items()]
+
+    print(
+        f"{'辞書件数':>10} {'作成(秒)':>10} {'線形探索(マイクロ秒)':>20} "
+        f"{'オートマトン(マイクロ秒)':>24}"
+    )
+    for size in sizes:
+        entries = make_hashtag_entries(size, titles)
+
+        start = time.perf_counter()
+        matcher = KeywordMatcher(entries)
+        build_time = time.perf_counter() - start
+
+        # 線形探索は優先順（優先度の降順、同じ場合は辞書内の順序）に並べておく
+        ordered = [
+            entry
+            for _, entry in sorted(
+                enumerate(entries), key=lambda pair: (-pair[1][2], pair[0])
+            )
+        ]
+
+        start = time.perf_counter()
+        expected = [
+            linear_select(ordered, title, HASHTAG_BENCHMARK_MAX_TAGS)
+            for title in titles
+        ]
+        linear_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        actual = [matcher.select(title, HASHTAG_BENCHMARK_MAX_TAGS) for title in titles]
+        matcher_time = time.perf_counter() - start
+
+        if actual != expected:
+            print(f"エラー: 辞書{size}件で線形探索と選ばれたハッシュタグが一致しません")
+            return False
+
+        print(
+            f"{size:>10} {build_time:>10.3f} "
+            f"{linear_time / len(titles) * 1e6:>20.1f} "
+            f"{matcher_time / len(titles) * 1e6:>24.1f}"
+        )
+
+    print(f"{len(titles)}件のタイトルすべてで選ばれたハッシュタグが一致しました")
+    return True
+
+
+def make_history(years, now):
+    """現在までのyears年分の投稿履歴を古い順に作る"""
+    count = years * 365 * HISTORY_POSTS_PER_DAY
+    interval = timedelta(days=1) / HISTORY_POSTS_PER_DAY
+    history = []
+    for index in range(count):
+        posted_at = now - interval * (count - index)
+        history.append(
+            {
+                "title": f"作品{index} モザイク版",
+                "post_text": (
+                    f"投稿{index}\n\n#PR\nhttps://al.fanza.co.jp/?lurl=https%3A%2F%2F"
+                    f"book.dmm.co.jp%2Fproduct%2F{index}%2Fcid{index}%2F"
+                ),
+                "tweet_id": str(index),
+                "timestamp": posted_at.strftime(post_history.TIMESTAMP_FORMAT),
+            }
+        )
+    return history
+
+
+def legacy_save_history(history_file, entry):
+    """旧方式: 履歴全体を読み込み、1件追加してファイル全体を書き直す（比較用）"""
+    with open(history_file, "r", encoding="utf-8") as f:
+        history = json.load(f)
+    history.append(entry)
+    with open(history_file, "w", encoding="utf-8") as f:
+        json.dump(history, f, ensure_ascii=False, indent=2)
+
+
+def legacy_check_history(history_file, title):
+    """旧方式: 履歴全体を読み込み、全件の日時を解析して7日以内の同じタイトルを探す（比較用）"""
+    with open(history_file, "r", encoding="utf-8") as f:
+        history = json.load(f)
+    seven_days_ago = datetime.now().timestamp() - (7 * 24 * 60 * 60)
+    for entry in history:
+        if entry["title"] == title:
+            post_time = datetime.strptime(entry["timestamp"], "%Y-%m-%d %H:%M:%S")
+            if post_time.timestamp() > seven_days_ago:
+                return True
+    return False
+
+
+def benchmark_history(args):
+    """
+    履歴の年数ごとに、旧方式（JSON配列の読み書き）と月ごとのJSON Linesへの追記・
+    直近の月だけを読む確認の所要時間を比較する
+    """
+    years_list = [int(arg) for arg in args] or DEFAULT_HISTORY_YEARS
+    runs = HISTORY_BENCHMARK_RUNS
+
+    print(
+        f"{'年数':>4} {'件数':>8} {'旧方式 追記(ミリ秒)':>18} {'旧方式 確認(ミリ秒)':>18} "
+        f"{'追記(ミリ秒)':>12} {'確認(ミリ秒)':>12}"
+    )
+    for years in years_list:
+        now = datetime.now()
+        history = make_history(years, now)
+        title = history[-1]["title"]
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            legacy_file = os.path.join(tmp_dir, "post_history.json")
+            with open(legacy_file, "w", encoding="utf-8") as f:
+                json.dump(history, f, ensure_ascii=False, indent=2)
+
+            # 月ごとのファイルに書き出し、前年以前の月を年ごとのファイルにまとめた状態にする
+            store_dir = os.path.join(tmp_dir, "post_history")
+            months = {}
+            for entry in history:
+                months.setdefault(entry["timestamp"][:7], []).append(entry)
+            os.makedirs(store_dir)
+            for month, entries in months.items():
+                post_history.write_lines(
+                    os.path.join(store_dir, f"{month}.jsonl"), entries, "w"
+                )
+            post_history.compact(store_dir)
+
+            entry = dict(
+                history[-1], timestamp=now.strftime(post_history.TIMESTAMP_FORMAT)
+            )
+
+            start = time.perf_counter()
+            for _ in range(runs):
+                found = legacy_check_history(legacy_file, title)
+            legacy_check_time = (time.perf_counter() - start) / runs
+
+            start = time.perf_counter()
+            for _ in range(runs):
+                posted = post_history.load_recent_posts(store_dir).find(title)
+            check_time = (time.perf_counter() - start) / runs
+
+            if not found or posted is None:
+                print(f"エラー: {years}年分の履歴で直近の投稿が見つかりません")
+                return False
+
+            start = time.perf_counter()
+            for _ in range(runs):
+                legacy_save_history(legacy_file, entry)
+            legacy_append_time = (time.perf_counter() - start) / runs
+
+            start = time.perf_counter()
+            for _ in range(runs):
+                post_history.append_entry(entry, store_dir)
+            append_time = (time.perf_counter() - start) / runs
+
+        print(
+            f"{years:>4} {len(history):>8,} {legacy_append_time * 1000:>18.2f} "
+            f"{legacy_check_time * 1000:>18.2f} {append_time * 1000:>12.3f} "
+            f"{check_time * 1000:>12.3f}"
+        )
+    return True
+
+
+def jaccard(a, b):
+    """文字n-gramの集合の厳密なJaccard係数"""
+    return len(a & b) / len(a | b) if a or b else 0.0
+
+
+def linear_find_similar(indexed, text, threshold):
+    """旧方式: 索引のすべての投稿と厳密なJaccard係数を計算して比べる（比較用）"""
+    target = text_similarity.shingles(text)
+    best = None
+    for other_text, other in indexed:
+        similarity = jaccard(target, other)
+        if similarity >= threshold and (best is None or similarity > best[1]):
+            best = (other_text, similarity)
+    return best
+
+
+def make_similar_filler(count, seed=0):
+    """投稿履歴と無関係な投稿テキストをcount件作る（索引を大きくするため）"""
+    rng = random.Random(seed)
+    hiragana = [chr(code) for code in range(ord("ぁ"), ord("ゖ") + 1)]
+    return [
+        "".join(rng.choice(hiragana) for _ in range(rng.randint(15, 35)))
+        + "\n\n#PR\nhttps://al.fanza.co.jp/?lurl=filler"
+        for _ in range(count)
+    ]
+
+
+def benchmark_similar(args):
+    """
+    投稿履歴を古い順に再生して送信前の類似チェックで見つかる投稿を数え、
+    索引の件数ごとに総当たりの厳密なJaccard係数とMinHash・LSHの確認時間を比較する
+    """
+    sizes = [int(arg) for arg in args] or DEFAULT_SIMILAR_SIZES
+    threshold = text_similarity.DEFAULT_THRESHOLD
+    texts = [entry["post_text"] for entry in post_history.load_history()]
+    if not texts:
+        print("エラー: 投稿履歴がありません")
+        return False
+
+    # 投稿履歴の再生: 各投稿を、それ以前の投稿と比べる
+    index = text_similarity.SimilarTextIndex(threshold=threshold)
+    indexed = []
+    exact_found = minhash_found = agreed = 0
+    for text in texts:
+        exact = linear_find_similar(indexed, text, threshold) is not None
+        estimated = index.find(text) is not None
+        exact_found += exact
+        minhash_found += estimated
+        agreed += exact == estimated
+        index.add(text)
+        indexed.append((text, text_similarity.shingles(text)))
+
+    print(
+        f"投稿履歴{len(texts)}件のうち、それ以前の投稿と似ていた投稿: "
+        f"厳密 {exact_found}件 / MinHash {minhash_found}件（判定の一致 {agreed}/{len(texts)}件）"
+    )
+    print(
+        f"送信前に差し替えることで、重複エラーの往復とバックオフの待機を最大{minhash_found}回省けます"
+    )
+    print()
+
+    print(
+        f"{'索引件数':>8} {'総当たり(ミリ秒)':>16} {'MinHash(ミリ秒)':>16} {'比較した件数':>12}"
+    )
+    queries = texts[-SIMILAR_BENCHMARK_RUNS:]
+    for size in sizes:
+        corpus = (texts + make_similar_filler(max(0, size - len(texts))))[:size]
+        index = text_similarity.SimilarTextIndex(threshold=threshold)
+        indexed = []
+        for text in corpus:
+            index.add(text)
+            indexed.append((text, text_similarity.shingles(text)))
+
+        start = time.perf_counter()
+        linear_results = [
+            linear_find_similar(indexed, text, threshold) is not None
+            for text in queries
+        ]
+        linear_time = (time.perf_counter() - start) / len(queries)
+
+        start = time.perf_counter()
+        minhash_results = [index.find(text) is not None for text in queries]
+        minhash_time = (time.perf_counter() - start) / len(queries)
+
+        # LSHで同じバケットに入り、署名を比べた投稿の数（1回あたりの平均）
+        compared = 0
+        for text in queries:
+            signature = index.signature(text)
+            candidates = set()
+            for key in index.band_keys(signature):
+                candidates.update(index.buckets.get(key, ()))
+            compared += len(candidates)
+
+        if linear_results != minhash_results:
+            mismatched = sum(a != b for a, b in zip(linear_results, minhash_results))
+            print(f"注意: {size}件の索引で判定が{mismatched}件異なりました")
+
+        print(
+            f"{size:>8,} {linear_time * 1000:>16.3f} {minhash_time * 1000:>16.3f} "
+            f"{compared / len(queries):>12.1f}"
+        )
+    return True
+
+
+def rewrite_then_fetch(posts):
+    """旧方式: リライトが終わってから表紙画像を取得する（比較用）"""
+    for post in posts:
+        process_manga_data.rewrite_post(post)
+    return process_manga_data.prefetch_cover_images(posts)
+
+
+def benchmark_images(args):
+    """
+    代替サーバーに対して、投稿キューから取り出した作品のリライトにかかる時間を、
+    表紙画像なし・リライト後に直列に取得・リライトと並行して取得（キャッシュなし / あり）で比較する
+    """
+    count = int(args[0]) if args else DEFAULT_IMAGE_POSTS
+    with contextlib.redirect_stdout(io.StringIO()):
+        selected = process_manga_data.select_manga_records(make_items(count * 10))
+    rows = selected[:count]
+
+    # リライトはキャッシュを使わず、毎回APIを呼び出す
+    process_manga_data.rewrite_cache = None
+
+    # (方式, POST_IMAGES, 処理, 空のキャッシュから始めるか)
+    modes = (
+        ("画像なし", "0", process_manga_data.rewrite_posts, True),
+        ("直列に取得", "1", rewrite_then_fetch, True),
+        ("並行して取得", "1", process_manga_data.rewrite_posts, True),
+        ("並行・キャッシュ済み", "1", process_manga_data.rewrite_posts, False),
+    )
+
+    print(
+        f"{'方式':<16} {'件数':>4} {'合計(秒)':>10} {'画像付き':>8} {'画像の取得':>10}"
+    )
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for label, post_images, rewrite, fresh_cache in modes:
+            if fresh_cache:
+                os.environ["IMAGE_CACHE_DIR"] = tempfile.mkdtemp(dir=tmp_dir)
+            posts = [
+                {
+                    "title": row["title"],
+                    "post_text": row["post_text"],
+                    "image_url": process_manga_data.cover_image_url(row),
+                }
+                for row in rows
+            ]
+
+            # どの方式でも同じ順番の応答が返るよう、毎回同じシードで代替サーバーを起動する
+            server, base_url = stub_servers.start(
+                stub_servers.StubConfig(latency=IMAGE_BENCHMARK_LATENCY, seed=0)
+            )
+            rate_limiter.configure(server.server_address[0], 1000.0, 1000)
+            process_manga_data.OPENROUTER_API_BASE = f"{base_url}/api/v1"
+            os.environ["DMM_IMAGE_BASE"] = base_url
+            os.environ["POST_IMAGES"] = post_images
+            try:
+                elapsed, _ = run_quietly(rewrite, posts)
+            finally:
+                server.shutdown()
+
+            with_media = sum(1 for post in posts if post.get("media_path"))
+            print(
+                f"{label:<16} {len(posts):>4} {elapsed:>10.2f} {with_media:>8} "
+                f"{server.state.counts['image']:>10}"
+            )
+    return True
+
+
+def main():
+    command = sys.argv[1] if len(sys.argv) > 1 else "select"
+    args = sys.argv[2:]
+
+    if command == "select":
+        return benchmark_select(args)
+    if command == "startup":
+        return benchmark_startup(args)
+    if command == "stream":
+        return benchmark_stream(args)
+    if command == "hedge":
+        return benchmark_hedge(args)
+    if command == "extract":
+        return benchmark_extract(args)
+    if command == "hashtags":
+        return benchmark_hashtags(args)
+    if command == "history":
+        return benchmark_history(args)
+    if command == "similar":
+        return benchmark_similar(args)
+    if command == "images":
+        return benchmark_images(args)
+
+    print(f"不明なコマンドです: {command}")
+    print(__doc__)
+    return False
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
@@ -1,6 +1,6 @@
 import os
-import requests
 from dotenv import load_dotenv
+import http_transport
 
 
 def check_dmm_auth():
@@ -26,8 +26,8 @@ def check_dmm_auth():
 
     try:
         # APIリクエスト
-        response = requests.get(
-            "https://api.dmm.com/affiliate/v3/ItemList", params=params
+        response = http_transport.request(
+            "GET", "https://api.dmm.com/affiliate/v3/ItemList", params=params
         )
 
         # レスポンスをチェック
@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+上限サイズ付きのディスクキャッシュの共通部分
+ファイルの更新時刻を最終アクセス時刻として扱い、上限サイズを超えたら古い順に削除する（LRU）
+APIレスポンスのキャッシュ（response_cache.py）と画像のキャッシュ（image_cache.py）で使う
+"""
+
+import os
+import threading
+
+
+class DiskCache:
+    """
+    1つのディレクトリにエントリを1ファイルずつ保存するキャッシュの基底クラス
+    どのファイルをエントリとして扱うかはis_entryで決める
+    """
+
+    def __init__(self, cache_dir, max_bytes):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def is_entry(self, name):
+        """上限サイズの計算・削除の対象とするファイルかどうか（書き込み途中の一時ファイルは除く）"""
+        return not name.endswith(".tmp")
+
+    def touch(self, path):
+        """
+        最終アクセス時刻を更新する（LRUの判定に使用）
+        戻り値: ファイルが存在しない場合はFalse
+        """
+        try:
+            os.utime(path, None)
+        except OSError:
+            return False
+        return True
+
+    def write_file(self, path, data):
+        """書き込み途中のファイルを読まれないよう、一時ファイルに書いてから置き換える"""
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        if isinstance(data, bytes):
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+        else:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(data)
+        os.replace(tmp_path, path)
+
+    def evict(self, keep=()):
+        """上限サイズに収まるまで、最終アクセスが古いエントリから削除する（keepのファイルは残す）"""
+        keep = set(keep)
+        with self._lock:
+            entries = []
+            total = 0
+            for name in os.listdir(self.cache_dir):
+                if not self.is_entry(name):
+                    continue
+                path = os.path.join(self.cache_dir, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+                total += stat.st_size
+
+            if total <= self.max_bytes:
+                return
+
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                if path in keep:
+                    continue
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+                total -= size
+                self.evictions += 1
+
+    def extra_stats(self):
+        """stats_textで削除件数の前に表示する項目（サブクラスで追加する）"""
+        return []
+
+    def stats_text(self):
+        """ヒット・ミス件数の表示用テキスト"""
+        total = self.hits + self.misses
+        rate = (self.hits / total * 100) if total else 0
+        items = [
+            f"ヒット {self.hits}件",
+            f"ミス {self.misses}件 (ヒット率 {rate:.0f}%)",
+        ]
+        items.extend(self.extra_stats())
+        items.append(f"削除 {self.evictions}件")
+        return " / ".join(items)
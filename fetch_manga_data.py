@@ -1,9 +1,59 @@
 import os
 import json
-import requests
 import sys  # sysモジュールを追加
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from dotenv import load_dotenv
+import http_transport
+import rate_limiter
+from response_cache import ResponseCache
+
+# プログラム開始時に環境変数を読み込み（接続先の設定を定数に反映するため）
+load_dotenv()
+
+# DMM APIの接続先（環境変数DMM_API_BASEでローカルの代替サーバーなどに変更可能）
+DMM_API_BASE = os.getenv("DMM_API_BASE", "https://api.dmm.com").rstrip("/")
+
+# DMM ItemList APIのエンドポイント
+ITEM_LIST_URL = f"{DMM_API_BASE}/affiliate/v3/ItemList"
+
+# DMM FloorList APIのエンドポイント
+FLOOR_LIST_URL = f"{DMM_API_BASE}/affiliate/v3/FloorList"
+
+# fetch_itemsで同時に発行するリクエスト数のデフォルト値
+DEFAULT_FETCH_WORKERS = 5
+
+# 1ページあたりの取得件数（ItemList APIの上限）
+PAGE_SIZE = 100
+
+# 1クエリあたりの取得上限件数のデフォルト値（PAGE_SIZEを超えるとoffsetでページングする）
+DEFAULT_MAX_ITEMS = 100
+
+# 取得した生データの保存先（JSON Lines形式、1行1作品）
+RAW_DATA_FILE = "manga_data_raw.jsonl"
+
+# APIレスポンスのキャッシュ（fetch_manga_data実行時に作成、Noneの場合はキャッシュしない）
+response_cache = None
+
+# 差分取得用の状態ファイル（前回までの新着作品の最新発売日とcontent_id、フロアごとに保存）
+WATERMARK_FILE = os.path.join(".cache", "fetch_watermark_{floor_key}.json")
+
+# 差分取得用に保持する直近1週間分の新着作品（JSON Lines形式、フロアごとに保存）
+NEW_RELEASES_FILE = os.path.join(".cache", "new_releases_{floor_key}.jsonl")
+
+# 取得対象のデフォルトフロア（環境変数DMM_FLOORSが未設定の場合）
+DEFAULT_FLOOR = {"site_code": "FANZA", "service_code": "ebook", "floor_code": "comic"}
+
+# 複数フロアを取得する際に同時に処理するフロア数のデフォルト値
+DEFAULT_FLOOR_WORKERS = 4
+
+# api.dmm.comへの同時リクエスト数の上限のデフォルト値
+DEFAULT_HOST_CONCURRENCY = 10
+
+# api.dmm.comへの同時リクエスト数を制限するセマフォ（全フロア・全クエリで共有）
+dmm_host_slots = threading.BoundedSemaphore(DEFAULT_HOST_CONCURRENCY)
 
 
 # 必須環境変数のチェック
@@ -36,36 +86,47 @@ def get_available_floors(api_id, affiliate_id):
     params = {"api_id": api_id, "affiliate_id": affiliate_id, "output": "json"}
 
     try:
-        response = requests.get(
-            "https://api.dmm.com/affiliate/v3/FloorList", params=params
-        )
-        print(f"デバッグ: フロア一覧取得ステータスコード: {response.status_code}")
+        data = response_cache.get("FloorList", params) if response_cache else None
+        if data is not None:
+            print("デバッグ: フロア一覧をキャッシュから取得しました")
+        else:
+            response = rate_limiter.request_with_retry(
+                "GET", FLOOR_LIST_URL, slot=dmm_host_slots, params=params
+            )
+            print(f"デバッグ: フロア一覧取得ステータスコード: {response.status_code}")
 
-        if response.status_code == 200:
-            data = response.json()
-            if "result" in data and "site" in data["result"]:
-                floors = []
-                for site in data["result"]["site"]:
-                    if "service" in site:
-                        for service in site["service"]:
-                            if "floor" in service:
-                                for floor in service["floor"]:
-                                    floors.append(
-                                        {
-                                            "site": site.get("name", ""),
-                                            "service": service.get("name", ""),
-                                            "floor": floor.get("id", ""),
-                                            "floor_name": floor.get("name", ""),
-                                        }
-                                    )
-
-                print(f"利用可能なフロア一覧を取得しました。合計: {len(floors)}件")
-                return floors
-            else:
-                print(f"デバッグ: レスポンス構造異常: {data}")
+            if response.status_code != 200:
+                print(f"デバッグ: フロア一覧API呼び出しエラー: {response.text}")
                 return []
+
+            data = response.json()
+            if response_cache and "result" in data and "site" in data["result"]:
+                response_cache.set("FloorList", params, data)
+
+        if "result" in data and "site" in data["result"]:
+            floors = []
+            for site in data["result"]["site"]:
+                if "service" in site:
+                    for service in site["service"]:
+                        if "floor" in service:
+                            for floor in service["floor"]:
+                                floors.append(
+                                    {
+                                        "site": site.get("name", ""),
+                                        "service": service.get("name", ""),
+                                        "floor": floor.get("id", ""),
+                                        "floor_name": floor.get("name", ""),
+                                        # ItemList APIの指定に使うコード
+                                        "site_code": site.get("code", ""),
+                                        "service_code": service.get("code", ""),
+                                        "floor_code": floor.get("code", ""),
+                                    }
+                                )
+
+            print(f"利用可能なフロア一覧を取得しました。合計: {len(floors)}件")
+            return floors
         else:
-            print(f"デバッグ: フロア一覧API呼び出しエラー: {response.text}")
+            print(f"デバッグ: レスポンス構造異常: {data}")
             return []
 
     except Exception as e:
@@ -75,12 +136,22 @@ def get_available_floors(api_id, affiliate_id):
 
 def fetch_manga_data():
     """FANZA APIから漫画データを取得（FANZAのみ）"""
+    global response_cache, dmm_host_slots
+
     # 環境変数の読み込み
     load_dotenv()
 
     # 必須環境変数のチェックを実行
     check_required_env_vars()
 
+    # 前回実行時のレスポンスを再利用するためのキャッシュ
+    response_cache = ResponseCache.from_env()
+
+    # api.dmm.comへの同時リクエスト数の上限（環境変数DMM_HOST_CONCURRENCYで変更可能）
+    dmm_host_slots = threading.BoundedSemaphore(
+        int(os.getenv("DMM_HOST_CONCURRENCY", DEFAULT_HOST_CONCURRENCY))
+    )
+
     # APIキーの取得
     api_id = os.getenv("DMM_API_ID")
     affiliate_id = os.getenv("DMM_AFFILIATE_ID")
@@ -95,26 +166,43 @@ def fetch_manga_data():
     one_week_ago = (datetime.now() - timedelta(days=7)).strftime("%Y-%m-%d")
     print(f"デバッグ: 新着判定用日付: {one_week_ago}")
 
-    # 収集したデータを保存するリスト
-    all_items = []
-
     try:
-        # FANZAのコミックを取得
-        print("\nFANZAのコミック商品を取得します")
-        comic_items = fetch_items(
-            api_id, affiliate_id, "FANZA", "ebook", "comic", one_week_ago
+        # 取得対象のフロアを決定（環境変数DMM_FLOORSが未設定ならFANZAのコミックのみ）
+        floors = resolve_floors(api_id, affiliate_id, os.getenv("DMM_FLOORS", ""))
+        if not floors:
+            print("取得対象のフロアが見つかりませんでした")
+            return False
+        floor_names = ", ".join(floor_label(floor) for floor in floors)
+        print(f"\n次のフロアの商品を取得します: {floor_names}")
+
+        # 同時リクエスト数（環境変数DMM_FETCH_WORKERSで変更可能、1で逐次取得）
+        max_workers = int(os.getenv("DMM_FETCH_WORKERS", DEFAULT_FETCH_WORKERS))
+        # 1クエリあたりの取得件数（環境変数DMM_FETCH_MAX_ITEMSで変更可能、100件を超えるとページング）
+        max_items = int(os.getenv("DMM_FETCH_MAX_ITEMS", DEFAULT_MAX_ITEMS))
+        # 差分取得モード（環境変数DMM_FETCH_INCREMENTAL=1で有効、新着作品は前回以降の分のみ取得）
+        incremental = os.getenv("DMM_FETCH_INCREMENTAL", "0") == "1"
+
+        # 同時に処理するフロア数（環境変数DMM_FLOOR_WORKERSで変更可能）
+        floor_workers = int(os.getenv("DMM_FLOOR_WORKERS", DEFAULT_FLOOR_WORKERS))
+
+        # 取得したデータはページ受信ごとにJSON Lines形式で保存する
+        total_count = fetch_floors_to_jsonl(
+            api_id,
+            affiliate_id,
+            floors,
+            one_week_ago,
+            RAW_DATA_FILE,
+            max_workers=max_workers,
+            max_items=max_items,
+            incremental=incremental,
+            floor_workers=floor_workers,
         )
-        all_items.extend(comic_items)
-        print(f"コミック商品: {len(comic_items)}件取得しました")
-
-        # 取得したデータをJSON形式で保存
-        with open("manga_data_raw.json", "w", encoding="utf-8") as f:
-            json.dump(all_items, f, ensure_ascii=False, indent=2)
+        print(f"全フロア: {total_count}件取得しました")
 
         # セール商品だけを別に抽出
         sale_items = [
             item
-            for item in all_items
+            for item in iter_jsonl(RAW_DATA_FILE)
             if "prices" in item
             and "price" in item["prices"]
             and "list_price" in item["prices"]
@@ -136,7 +224,9 @@ def fetch_manga_data():
         with open("sale_manga_data.json", "w", encoding="utf-8") as f:
             json.dump(sale_items, f, ensure_ascii=False, indent=2)
 
-        print(f"\n合計: {len(all_items)}作品のデータを取得しました")
+        print(f"\n合計: {total_count}作品のデータを取得しました")
+        print(f"APIキャッシュ: {response_cache.stats_text()}")
+        print(f"通信量:\n{http_transport.stats_text()}")
         print(f"割引商品: {len(sale_items)}作品を発見しました")
 
         # 最大割引率のアイテムを表示
@@ -171,163 +261,524 @@ def fetch_manga_data():
         return False
 
 
-def fetch_items(api_id, affiliate_id, site_id, service_id, floor_id, one_week_ago):
-    """指定されたパラメータでAPIからアイテムを取得"""
-    items = []
+def request_item_list(params, label):
+    """ItemList APIを1回呼び出し、取得したアイテムのリストを返す（取得できない場合はNone）"""
+    if response_cache:
+        cached_items = response_cache.get("ItemList", params)
+        if cached_items is not None:
+            print(f"デバッグ: {label}をキャッシュから取得: {len(cached_items)}件")
+            return cached_items
 
-    # 基本的なAPIパラメータ
-    base_params = {
+    print(f"デバッグ: {label}API呼び出し: {params}")
+    response = rate_limiter.request_with_retry(
+        "GET", ITEM_LIST_URL, slot=dmm_host_slots, params=params
+    )
+    if response.status_code == 200:
+        data = response.json()
+        if "result" in data and "items" in data["result"]:
+            if response_cache:
+                response_cache.set("ItemList", params, data["result"]["items"])
+            return data["result"]["items"]
+    elif response.status_code == 400:
+        # エラー時は簡潔なメッセージのみ表示
+        print(f"デバッグ: {label} - リクエストエラー(400)")
+    return None
+
+
+def iter_item_list(params, label, max_items=DEFAULT_MAX_ITEMS):
+    """
+    offsetを進めながらItemList APIを呼び出し、取得したアイテムを1件ずつ返すジェネレーター
+    ページを受け取るたびにアイテムを返すため、取得件数が増えてもページ1枚分しか保持しない
+    max_items: このクエリで取得する上限件数
+    """
+    page_size = int(params.get("hits", PAGE_SIZE))
+    offset = 1
+    fetched = 0
+
+    while fetched < max_items:
+        page_params = params.copy()
+        page_params["hits"] = min(page_size, max_items - fetched)
+        page_params["offset"] = offset
+
+        page = request_item_list(page_params, label)
+        if not page:
+            break
+
+        for item in page:
+            yield item
+
+        fetched += len(page)
+        offset += len(page)
+
+        # 要求件数に満たないページは最終ページ
+        if len(page) < page_params["hits"]:
+            break
+
+
+def build_base_params(api_id, affiliate_id, site_id, service_id, floor_id):
+    """全クエリ共通のAPIパラメータを作成する"""
+    return {
         "api_id": api_id,
         "affiliate_id": affiliate_id,
         "site": site_id,
         "service": service_id,
         "floor": floor_id,
-        "hits": 100,  # 一度に取得する件数
+        "hits": PAGE_SIZE,  # 一度に取得する件数
         "output": "json",
     }
 
+
+def build_item_queries(base_params, one_week_ago):
+    """
+    fetch_itemsで発行するクエリ一覧を作成する
+    並び順がそのまま統合順になるため、順序を変更しないこと
+    """
+    queries = [
+        # 1. ランキング上位作品の取得（デイリー）
+        ("デイリーランキング", "daily_rank", {"sort": "rank", "period": "day"}),
+        # 2. ランキング上位作品の取得（週間）
+        ("週間ランキング", "weekly_rank", {"sort": "rank", "period": "week"}),
+        # 3. ランキング上位作品の取得（月間）
+        ("月間ランキング", "monthly_rank", {"sort": "rank", "period": "month"}),
+        # 4. 新着作品の取得
+        ("新着作品", "new", {"sort": "date", "released_date_from": one_week_ago}),
+        # 5. セール/割引作品の取得
+        ("セール/割引作品", "sale", {"sort": "price", "hits": 100}),
+    ]
+
+    result = []
+    for label, kind, extra in queries:
+        params = base_params.copy()
+        params.update(extra)
+        result.append((label, kind, params))
+    return result
+
+
+def run_item_queries(queries, worker, max_workers=DEFAULT_FETCH_WORKERS):
+    """
+    各クエリに対してworker(query)を実行し、クエリと同じ順序で戻り値を返す
+    max_workersが1以下の場合は逐次実行、それ以外はスレッドプールで同時に実行する
+    """
+    if max_workers <= 1:
+        return [worker(query) for query in queries]
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(queries))) as executor:
+        futures = [executor.submit(worker, query) for query in queries]
+        # 完了順ではなく発行順で結果を受け取る
+        return [future.result() for future in futures]
+
+
+class ItemIndex:
+    """
+    content_idをキーにアイテムを統合するインデックス
+    dictの挿入順をそのまま出力順として使うため、統合はアイテム数に対して線形時間で終わる
+    """
+
+    def __init__(self):
+        self._items = {}
+
+    def __len__(self):
+        return len(self._items)
+
+    def get(self, content_id):
+        """content_idに対応する統合済みアイテムを返す（未登録ならNone）"""
+        return self._items.get(content_id)
+
+    def add(self, item):
+        """アイテムを末尾に追加する（同じcontent_idが登録済みの場合は既存を優先）"""
+        return self._items.setdefault(item.get("content_id"), item)
+
+    def items(self):
+        """統合済みアイテムを最初に登録された順で返す"""
+        return list(self._items.values())
+
+
+def merge_query_items(index, label, kind, query_items):
+    """1クエリ分のアイテムをインデックスに統合する（content_idをキーとして）"""
+    if kind == "daily_rank":
+        print(f"{label}: {len(query_items)}件取得")
+        for item in query_items:
+            item["ranking_info"] = {"daily_rank": item.get("rank", 0)}
+            index.add(item)
+
+    elif kind in ("weekly_rank", "monthly_rank"):
+        print(f"{label}: {len(query_items)}件取得")
+        for item in query_items:
+            existing = index.get(item.get("content_id"))
+            if existing:
+                existing["ranking_info"][kind] = item.get("rank", 0)
+            else:
+                item["ranking_info"] = {kind: item.get("rank", 0)}
+                index.add(item)
+
+    elif kind == "new":
+        print(f"{label}: {len(query_items)}件取得")
+        for item in query_items:
+            existing = index.get(item.get("content_id"))
+            if existing:
+                existing["is_new"] = True
+            else:
+                item["is_new"] = True
+                item["ranking_info"] = {}
+                index.add(item)
+
+    elif kind == "sale":
+        # 割引商品を検出（通常価格と現在価格を比較）
+        discount_count = 0
+        for item in query_items:
+            # 価格情報をチェック
+            if "prices" in item:
+                prices = item["prices"]
+                if "price" in prices and "list_price" in prices:
+                    price = int(prices["price"])
+                    list_price = int(prices["list_price"])
+                    if price < list_price:
+                        discount_count += 1
+
+            # 重複を避けて追加
+            if not index.get(item.get("content_id")):
+                if "ranking_info" not in item:
+                    item["ranking_info"] = {}
+                index.add(item)
+        print(f"割引作品: {discount_count}件取得")
+
+
+def fetch_items(
+    api_id,
+    affiliate_id,
+    site_id,
+    service_id,
+    floor_id,
+    one_week_ago,
+    max_workers=DEFAULT_FETCH_WORKERS,
+    max_items=DEFAULT_MAX_ITEMS,
+):
+    """
+    指定されたパラメータでAPIからアイテムを取得
+    max_workers: 同時に発行するリクエスト数（1以下で従来どおり逐次取得）
+    max_items: 1クエリあたりの取得上限件数
+    """
+    index = ItemIndex()
+
+    # 基本的なAPIパラメータ
+    base_params = build_base_params(api_id, affiliate_id, site_id, service_id, floor_id)
+
     # デバッグ情報: ベースパラメータ
     print(f"デバッグ: ベースパラメータ: {base_params}")
 
-    # 1. ランキング上位作品の取得（デイリー）
-    daily_params = base_params.copy()
-    daily_params.update({"sort": "rank", "period": "day"})
-    print(f"デバッグ: デイリーランキングAPI呼び出し: {daily_params}")
-    response = requests.get(
-        "https://api.dmm.com/affiliate/v3/ItemList", params=daily_params
-    )
-    if response.status_code == 200:
-        data = response.json()
-        if "result" in data and "items" in data["result"]:
-            items_count = len(data["result"]["items"])
-            print(f"デイリーランキング: {items_count}件取得")
-            for item in data["result"]["items"]:
-                item["ranking_info"] = {"daily_rank": item.get("rank", 0)}
-                items.append(item)
-    elif response.status_code == 400:
-        # エラー時は簡潔なメッセージのみ表示
-        print(f"デバッグ: デイリーランキング - リクエストエラー(400)")
-
-    # 2. ランキング上位作品の取得（週間）
-    weekly_params = base_params.copy()
-    weekly_params.update({"sort": "rank", "period": "week"})
-    print(f"デバッグ: 週間ランキングAPI呼び出し: {weekly_params}")
-    response = requests.get(
-        "https://api.dmm.com/affiliate/v3/ItemList", params=weekly_params
-    )
-    if response.status_code == 200:
-        data = response.json()
-        if "result" in data and "items" in data["result"]:
-            items_count = len(data["result"]["items"])
-            print(f"週間ランキング: {items_count}件取得")
-            # 既存のデータと統合（content_idをキーとして）
-            for item in data["result"]["items"]:
+    def collect(query):
+        label, _, params = query
+        return list(iter_item_list(params, label, max_items))
+
+    queries = build_item_queries(base_params, one_week_ago)
+    responses = run_item_queries(queries, collect, max_workers)
+
+    # 取得順に関係なく、常にクエリの定義順で統合する（ランキング情報を逐次実行時と一致させる）
+    for (label, kind, _), query_items in zip(queries, responses):
+        merge_query_items(index, label, kind, query_items)
+
+    return index.items()
+
+
+def iter_jsonl(path):
+    """JSON Lines形式のファイルを1行ずつ読み込んで返すジェネレーター"""
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def append_fields(line, fields):
+    """
+    JSON Linesの1行（json.dumpsで書き出したオブジェクト）の末尾に項目を追加する
+    行全体を読み込み直さずに、json.dumpsで項目を追加したオブジェクトを書き出した場合と同じ行を作る
+    """
+    if not fields:
+        return line
+    body = line.rstrip("\n")[:-1]
+    separator = ", " if body != "{" else ""
+    return f"{body}{separator}{json.dumps(fields, ensure_ascii=False)[1:]}\n"
+
+
+def fetch_items_to_jsonl(
+    api_id,
+    affiliate_id,
+    site_id,
+    service_id,
+    floor_id,
+    one_week_ago,
+    output_path,
+    max_workers=DEFAULT_FETCH_WORKERS,
+    max_items=DEFAULT_MAX_ITEMS,
+    incremental=False,
+    source_floor=None,
+):
+    """
+    fetch_itemsと同じ統合結果を、作品本体をメモリに溜めずにJSON Lines形式で書き出す
+    各クエリのページは受信するたびに一時ファイルへ書き出し、統合時は作品ごとにcontent_idと
+    ランキング情報だけをメモリに保持する
+    作品本体を保持しないぶんメモリ使用量はfetch_itemsより小さいが、一定ではなく作品数に比例して増える
+    （benchmark_fetch.py streamで1クエリ100件: 約2MB、5000件: 約9MB）
+    一時ファイルへの書き出しと読み込みがあるため、処理時間はfetch_itemsの約1.4倍かかる
+    incremental: Trueの場合、新着作品は前回の取得以降の分だけを取得して前回分と統合する
+    source_floor: 指定した場合は各作品に取得元フロアとして付与する
+    戻り値: 書き出した作品数
+    """
+    base_params = build_base_params(api_id, affiliate_id, site_id, service_id, floor_id)
+    print(f"デバッグ: ベースパラメータ: {base_params}")
+
+    # 差分取得の場合は前回の最新発売日以降の新着作品だけを取得する
+    floor_key = f"{site_id}_{service_id}_{floor_id}"
+    watermark = load_watermark(floor_key, one_week_ago) if incremental else None
+    if watermark:
+        released_from = watermark["latest_date"][:10]
+        print(f"デバッグ: 差分取得: {released_from}以降の新着作品のみ取得します")
+    else:
+        released_from = one_week_ago
+
+    queries = build_item_queries(base_params, released_from)
+
+    with tempfile.TemporaryDirectory() as spool_dir:
+
+        def spool(query):
+            label, kind, params = query
+            path = os.path.join(spool_dir, f"{kind}.jsonl")
+            with open(path, "w", encoding="utf-8") as f:
+                for item in iter_item_list(params, label, max_items):
+                    f.write(json.dumps(item, ensure_ascii=False) + "\n")
+            return path
+
+        spool_paths = run_item_queries(queries, spool, max_workers)
+
+        if incremental:
+            # 新着作品を前回分と統合し、次回のための状態を保存する（ランキングは毎回取り直す）
+            new_index = [kind for _, kind, _ in queries].index("new")
+            fold_new_releases(
+                spool_paths[new_index], floor_key, watermark, one_week_ago
+            )
+            save_watermark(spool_paths[new_index], floor_key)
+
+        # 1回目の走査: 統合に必要な項目だけでインデックスを作り、ランキング情報を集計する
+        # あわせて、各行がその作品の最初に登場した行かどうかを1行1バイトで記録する
+        index = ItemIndex()
+        first_flags = []
+        for (label, kind, _), path in zip(queries, spool_paths):
+            keys = []
+            flags = bytearray()
+            query_ids = set()
+            for item in iter_jsonl(path):
                 content_id = item.get("content_id")
-                existing = next(
-                    (x for x in items if x.get("content_id") == content_id), None
+                flags.append(
+                    index.get(content_id) is None and content_id not in query_ids
                 )
-                if existing:
-                    existing["ranking_info"]["weekly_rank"] = item.get("rank", 0)
-                else:
-                    item["ranking_info"] = {"weekly_rank": item.get("rank", 0)}
-                    items.append(item)
-    elif response.status_code == 400:
-        # エラー時は簡潔なメッセージのみ表示
-        print(f"デバッグ: 週間ランキング - リクエストエラー(400)")
-
-    # 3. ランキング上位作品の取得（月間）
-    monthly_params = base_params.copy()
-    monthly_params.update({"sort": "rank", "period": "month"})
-    print(f"デバッグ: 月間ランキングAPI呼び出し: {monthly_params}")
-    response = requests.get(
-        "https://api.dmm.com/affiliate/v3/ItemList", params=monthly_params
-    )
-    if response.status_code == 200:
-        data = response.json()
-        if "result" in data and "items" in data["result"]:
-            items_count = len(data["result"]["items"])
-            print(f"月間ランキング: {items_count}件取得")
-            # 既存のデータと統合
-            for item in data["result"]["items"]:
-                content_id = item.get("content_id")
-                existing = next(
-                    (x for x in items if x.get("content_id") == content_id), None
+                query_ids.add(content_id)
+                keys.append(
+                    {k: item[k] for k in ("content_id", "rank", "prices") if k in item}
                 )
-                if existing:
-                    existing["ranking_info"]["monthly_rank"] = item.get("rank", 0)
-                else:
-                    item["ranking_info"] = {"monthly_rank": item.get("rank", 0)}
-                    items.append(item)
-    elif response.status_code == 400:
-        # エラー時は簡潔なメッセージのみ表示
-        print(f"デバッグ: 月間ランキング - リクエストエラー(400)")
-
-    # 4. 新着作品の取得
-    new_params = base_params.copy()
-    new_params.update({"sort": "date", "released_date_from": one_week_ago})
-    print(f"デバッグ: 新着作品API呼び出し: {new_params}")
-    response = requests.get(
-        "https://api.dmm.com/affiliate/v3/ItemList", params=new_params
-    )
-    if response.status_code == 200:
-        data = response.json()
-        if "result" in data and "items" in data["result"]:
-            items_count = len(data["result"]["items"])
-            print(f"新着作品: {items_count}件取得")
-            # 既存のデータと統合
-            for item in data["result"]["items"]:
-                content_id = item.get("content_id")
-                existing = next(
-                    (x for x in items if x.get("content_id") == content_id), None
-                )
-                if existing:
-                    existing["is_new"] = True
-                else:
-                    item["is_new"] = True
-                    item["ranking_info"] = {}
-                    items.append(item)
-    elif response.status_code == 400:
-        # エラー時は簡潔なメッセージのみ表示
-        print(f"デバッグ: 新着作品 - リクエストエラー(400)")
-
-    # 5. セール/割引作品の取得
-    sale_params = base_params.copy()
-    sale_params.update({"sort": "price", "hits": 100})
-    print(f"デバッグ: セール/割引作品API呼び出し: {sale_params}")
-    response = requests.get(
-        "https://api.dmm.com/affiliate/v3/ItemList", params=sale_params
+            merge_query_items(index, label, kind, keys)
+            first_flags.append(flags)
+
+        # 2回目の走査: 最初に登場した行にランキング情報を付け足して書き出す
+        # インデックスは作品が最初に登場した順に並んでいるため、行を読み込み直さずに対応づけられる
+        merged = iter(index.items())
+        count = 0
+        with open(output_path, "w", encoding="utf-8") as out:
+            for path, flags in zip(spool_paths, first_flags):
+                with open(path, "r", encoding="utf-8") as f:
+                    for line, first in zip(f, flags):
+                        if not first:
+                            continue
+                        fields = {
+                            key: value
+                            for key, value in next(merged).items()
+                            if key in ("ranking_info", "is_new")
+                        }
+                        if source_floor is not None:
+                            fields["source_floor"] = source_floor
+                        out.write(append_fields(line, fields))
+                        count += 1
+
+    return count
+
+
+def floor_label(floor):
+    """ログ表示用のフロア名"""
+    return floor.get("floor_name") or floor["floor_code"]
+
+
+def resolve_floors(api_id, affiliate_id, floor_filter):
+    """
+    取得対象のフロア一覧を返す
+    floor_filter: カンマ区切りのフロアコードまたはフロア名（"all"でサイト内の全フロア、空ならデフォルトのみ）
+    サイトは環境変数DMM_SITE（デフォルト: FANZA）で絞り込む
+    """
+    if not floor_filter.strip():
+        return [DEFAULT_FLOOR]
+
+    site_code = os.getenv("DMM_SITE", DEFAULT_FLOOR["site_code"])
+    wanted = {name.strip() for name in floor_filter.split(",") if name.strip()}
+
+    floors = []
+    seen = set()
+    for floor in get_available_floors(api_id, affiliate_id):
+        if floor.get("site_code") != site_code:
+            continue
+        if "all" not in wanted and not (
+            floor.get("floor_code") in wanted or floor.get("floor_name") in wanted
+        ):
+            continue
+        key = (floor["service_code"], floor["floor_code"])
+        if key not in seen:
+            seen.add(key)
+            floors.append(floor)
+    return floors
+
+
+def fetch_floors_to_jsonl(
+    api_id,
+    affiliate_id,
+    floors,
+    one_week_ago,
+    output_path,
+    max_workers=DEFAULT_FETCH_WORKERS,
+    max_items=DEFAULT_MAX_ITEMS,
+    incremental=False,
+    floor_workers=DEFAULT_FLOOR_WORKERS,
+):
+    """
+    複数フロアの商品を並列に取得し、content_idで重複を除いた1つのJSON Linesに統合する
+    各作品には取得元フロアをsource_floorとして付与する（複数フロアにある作品は先のフロアを優先）
+    api.dmm.comへの同時リクエスト数はdmm_host_slotsで制限される
+    戻り値: 書き出した作品数
+    """
+    if len(floors) == 1:
+        # 1フロアだけの場合は統合するものがないため、出力先に直接書き出す
+        floor = floors[0]
+        count = fetch_items_to_jsonl(
+            api_id,
+            affiliate_id,
+            floor["site_code"],
+            floor["service_code"],
+            floor["floor_code"],
+            one_week_ago,
+            output_path,
+            max_workers=max_workers,
+            max_items=max_items,
+            incremental=incremental,
+            source_floor=floor["floor_code"],
+        )
+        print(f"{floor_label(floor)}: {count}件取得しました")
+        return count
+
+    with tempfile.TemporaryDirectory() as work_dir:
+
+        def fetch_floor(position_floor):
+            position, floor = position_floor
+            path = os.path.join(work_dir, f"floor_{position}.jsonl")
+            count = fetch_items_to_jsonl(
+                api_id,
+                affiliate_id,
+                floor["site_code"],
+                floor["service_code"],
+                floor["floor_code"],
+                one_week_ago,
+                path,
+                max_workers=max_workers,
+                max_items=max_items,
+                incremental=incremental,
+            )
+            print(f"{floor_label(floor)}: {count}件取得しました")
+            return path
+
+        workers = max(1, min(floor_workers, len(floors)))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            paths = list(executor.map(fetch_floor, enumerate(floors)))
+
+        # フロアの指定順に統合し、content_idが重複する作品は最初のフロアのものを残す
+        written = set()
+        count = 0
+        with open(output_path, "w", encoding="utf-8") as out:
+            for floor, path in zip(floors, paths):
+                for item in iter_jsonl(path):
+                    content_id = item.get("content_id")
+                    if content_id in written:
+                        continue
+                    written.add(content_id)
+                    item["source_floor"] = floor["floor_code"]
+                    out.write(json.dumps(item, ensure_ascii=False) + "\n")
+                    count += 1
+
+    return count
+
+
+def load_watermark(floor_key, one_week_ago):
+    """
+    前回の差分取得状態を読み込む
+    状態がない場合や、前回の最新発売日が1週間より前の場合はNone（全件取得）を返す
+    """
+    try:
+        with open(
+            WATERMARK_FILE.format(floor_key=floor_key), "r", encoding="utf-8"
+        ) as f:
+            watermark = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    if not os.path.exists(NEW_RELEASES_FILE.format(floor_key=floor_key)):
+        return None
+    if watermark.get("latest_date", "")[:10] < one_week_ago:
+        return None
+    return watermark
+
+
+def fold_new_releases(new_items_path, floor_key, watermark, one_week_ago):
+    """
+    今回取得した新着作品の後ろに、前回までの新着作品のうち1週間以内のものを追加する
+    new_items_pathの内容を統合結果で置き換える
+    """
+    fresh_ids = set()
+    seen_ids = set(watermark["content_ids"]) if watermark else set()
+    delta_count = 0
+    for item in iter_jsonl(new_items_path):
+        fresh_ids.add(item.get("content_id"))
+        if item.get("content_id") not in seen_ids:
+            delta_count += 1
+
+    carried_count = 0
+    if watermark:
+        with open(new_items_path, "a", encoding="utf-8") as f:
+            for item in iter_jsonl(NEW_RELEASES_FILE.format(floor_key=floor_key)):
+                if item.get("content_id") in fresh_ids:
+                    continue
+                if str(item.get("date", ""))[:10] < one_week_ago:
+                    continue
+                f.write(json.dumps(item, ensure_ascii=False) + "\n")
+                carried_count += 1
+
+    print(
+        f"差分取得: 新規の新着作品 {delta_count}件 / 前回から引き継ぎ {carried_count}件"
     )
-    if response.status_code == 200:
-        data = response.json()
-        if "result" in data and "items" in data["result"]:
-            items_count = len(data["result"]["items"])
-            # 割引商品を検出（通常価格と現在価格を比較）
-            discount_count = 0
-            for item in data["result"]["items"]:
-                # 価格情報をチェック
-                if "prices" in item:
-                    prices = item["prices"]
-                    if "price" in prices and "list_price" in prices:
-                        price = int(prices["price"])
-                        list_price = int(prices["list_price"])
-                        if price < list_price:
-                            discount_count += 1
-
-                # 重複を避けて追加
-                content_id = item.get("content_id")
-                existing = next(
-                    (x for x in items if x.get("content_id") == content_id), None
-                )
-                if not existing:
-                    if "ranking_info" not in item:
-                        item["ranking_info"] = {}
-                    items.append(item)
-            print(f"割引作品: {discount_count}件取得")
-    elif response.status_code == 400:
-        # エラー時は簡潔なメッセージのみ表示
-        print(f"デバッグ: セール/割引作品 - リクエストエラー(400)")
 
-    return items
+
+def save_watermark(new_items_path, floor_key):
+    """新着作品の一覧を保存し、最新発売日とcontent_idを次回の差分取得用に記録する"""
+    new_releases_file = NEW_RELEASES_FILE.format(floor_key=floor_key)
+    os.makedirs(os.path.dirname(new_releases_file), exist_ok=True)
+
+    latest_date = ""
+    content_ids = []
+    with open(new_releases_file, "w", encoding="utf-8") as out:
+        for item in iter_jsonl(new_items_path):
+            latest_date = max(latest_date, str(item.get("date", "")))
+            content_ids.append(item.get("content_id"))
+            out.write(json.dumps(item, ensure_ascii=False) + "\n")
+
+    with open(WATERMARK_FILE.format(floor_key=floor_key), "w", encoding="utf-8") as f:
+        json.dump(
+            {"latest_date": latest_date, "content_ids": content_ids},
+            f,
+            ensure_ascii=False,
+        )
 
 
 if __name__ == "__main__":
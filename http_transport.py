@@ -0,0 +1,179 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+外部API呼び出し共通のHTTP通信層
+ホストごとにrequests.Sessionを使い回して接続（TLSハンドシェイク）を再利用し、
+gzip圧縮の要求・接続/読み込みタイムアウトの設定・通信量の集計を一か所で行う
+"""
+
+import logging
+import os
+import threading
+import time
+import urllib.parse
+
+import requests
+from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+# .envの設定をモジュール読み込み時に反映する（このモジュールを読み込むrate_limiterの設定も含む）
+load_dotenv()
+
+# 接続タイムアウトと読み込みタイムアウト（秒）
+CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", 5))
+READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", 60))
+
+# ホストごとに保持する接続数の上限（同時リクエスト数以上にしておく）
+POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", 16))
+
+# 全リクエストに付与する共通ヘッダー
+DEFAULT_HEADERS = {"Accept-Encoding": "gzip, deflate"}
+
+# 画像などをダウンロードする際の読み込み単位（バイト）
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+_sessions = {}
+_stats = {}
+_lock = threading.Lock()
+
+
+def get_session(host):
+    """ホストごとのSessionを返す（初回のみ作成し、以降は接続プールを共有する）"""
+    with _lock:
+        session = _sessions.get(host)
+        if session is None:
+            session = requests.Session()
+            # 再試行はrate_limiter側で行うため、ここでは自動再試行しない
+            adapter = HTTPAdapter(
+                pool_connections=1, pool_maxsize=POOL_SIZE, max_retries=0
+            )
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            session.headers.update(DEFAULT_HEADERS)
+            _sessions[host] = session
+        return session
+
+
+class RedirectAdapter(HTTPAdapter):
+    """送信先のスキーム・ホストを差し替えるアダプター（代替サーバーへの接続用）"""
+
+    def __init__(self, target_base, **kwargs):
+        super().__init__(**kwargs)
+        self.target = urllib.parse.urlparse(target_base)
+
+    def send(self, request, **kwargs):
+        parsed = urllib.parse.urlparse(request.url)
+        request.url = urllib.parse.urlunparse(
+            parsed._replace(scheme=self.target.scheme, netloc=self.target.netloc)
+        )
+        return super().send(request, **kwargs)
+
+
+def redirect_session(session, source_base, target_base):
+    """
+    ライブラリが内部で持つSession（tweepyなど）の送信先を差し替える
+    source_baseで始まるURLへのリクエストはtarget_baseのホストに送られる
+    """
+    session.mount(source_base, RedirectAdapter(target_base))
+
+
+def _record(host, sent, received, elapsed):
+    """ホストごとの通信量と所要時間を集計する"""
+    with _lock:
+        stats = _stats.setdefault(
+            host, {"calls": 0, "sent": 0, "received": 0, "elapsed": 0.0}
+        )
+        stats["calls"] += 1
+        stats["sent"] += sent
+        stats["received"] += received
+        stats["elapsed"] += elapsed
+
+
+def _request_size(response):
+    """
+    送信したリクエストのバイト数（リクエスト行・ヘッダー・ボディ）
+    HTTP/1.1で送信した場合のサイズとして計算する（urllib3が付けるHostヘッダーを含む）
+    """
+    request = response.request
+    if request is None:
+        return 0
+
+    head = f"{request.method} {request.path_url} HTTP/1.1\r\n"
+    head += f"Host: {urllib.parse.urlparse(request.url).netloc}\r\n"
+    for key, value in request.headers.items():
+        if isinstance(value, bytes):
+            value = value.decode("latin-1")
+        head += f"{key}: {value}\r\n"
+    size = len((head + "\r\n").encode("latin-1", "replace"))
+
+    body = request.body
+    if isinstance(body, str):
+        size += len(body.encode("utf-8"))
+    elif isinstance(body, bytes):
+        size += len(body)
+    return size
+
+
+def request(method, url, timeout=None, **kwargs):
+    """
+    共有Sessionを使ってHTTPリクエストを送信する
+    timeoutを省略した場合は(CONNECT_TIMEOUT, READ_TIMEOUT)を使用する
+    """
+    host = urllib.parse.urlparse(url).hostname
+    session = get_session(host)
+
+    start = time.perf_counter()
+    response = session.request(
+        method, url, timeout=timeout or (CONNECT_TIMEOUT, READ_TIMEOUT), **kwargs
+    )
+    elapsed = time.perf_counter() - start
+
+    # 受信量は圧縮後の転送サイズ（Content-Length）を優先し、なければ展開後のサイズを使う
+    if kwargs.get("stream"):
+        received = int(response.headers.get("Content-Length", 0) or 0)
+    else:
+        received = int(
+            response.headers.get("Content-Length", 0) or len(response.content)
+        )
+    sent = _request_size(response)
+    _record(host, sent, received, elapsed)
+
+    logger.debug(
+        f"{method} {host} -> {response.status_code} "
+        f"({sent}B送信 / {received}B受信 / {elapsed:.2f}秒)"
+    )
+    return response
+
+
+def download(url, save_path, timeout=None):
+    """
+    URLの内容をストリーミングでファイルに保存する
+    戻り値: 保存したバイト数（ステータスが200以外の場合は例外を送出）
+    """
+    response = request("GET", url, timeout=timeout, stream=True)
+    try:
+        response.raise_for_status()
+        size = 0
+        with open(save_path, "wb") as f:
+            for chunk in response.iter_content(DOWNLOAD_CHUNK_SIZE):
+                f.write(chunk)
+                size += len(chunk)
+    finally:
+        response.close()
+    return size
+
+
+def stats_text():
+    """ホストごとの通信量の表示用テキスト"""
+    with _lock:
+        if not _stats:
+            return "通信なし"
+        lines = []
+        for host, stats in sorted(_stats.items()):
+            lines.append(
+                f"{host}: {stats['calls']}回 / 送信 {stats['sent']:,}B / "
+                f"受信 {stats['received']:,}B / 合計 {stats['elapsed']:.2f}秒"
+            )
+        return "\n".join(lines)
@@ -0,0 +1,222 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+投稿に添付する表紙画像のディスクキャッシュ
+画像はXにアップロードできる大きさ・形式に変換してから、内容のハッシュ（SHA-256）をファイル名にして保存する
+（同じ画像が別のURLで配信されていても1つだけ保存する）
+URLとファイル名の対応はindex.jsonに保存し、2回目以降はダウンロードも変換もしない
+"""
+
+import hashlib
+import io
+import json
+import os
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+
+import http_transport
+from disk_cache import DiskCache
+
+# デフォルトのキャッシュ保存先
+DEFAULT_CACHE_DIR = os.path.join(".cache", "images")
+
+# キャッシュ全体の上限サイズ（MB）
+DEFAULT_MAX_MB = 100
+
+# 同時にダウンロードする画像の数
+DEFAULT_FETCH_WORKERS = 4
+
+# URLとファイル名の対応を保存するファイル
+INDEX_FILE = "index.json"
+
+# Xにアップロードする画像の上限（バイト数・長辺のピクセル数）
+MAX_IMAGE_BYTES = 5 * 1024 * 1024
+MAX_IMAGE_SIDE = 2048
+
+# 縮小・変換する際のJPEGの画質（上限サイズに収まるまで下限まで下げる）
+JPEG_QUALITY = 85
+MIN_JPEG_QUALITY = 45
+
+# Xにそのままアップロードできる形式（先頭のバイト列と拡張子）
+IMAGE_SIGNATURES = (
+    (b"\xff\xd8\xff", "jpg"),
+    (b"\x89PNG\r\n\x1a\n", "png"),
+    (b"GIF87a", "gif"),
+    (b"GIF89a", "gif"),
+)
+
+
+def detect_format(data):
+    """画像の先頭のバイト列から拡張子を判定する（対応していない形式はNone）"""
+    for signature, extension in IMAGE_SIGNATURES:
+        if data.startswith(signature):
+            return extension
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "webp"
+    return None
+
+
+def prepare_image(data, max_side=MAX_IMAGE_SIDE, max_bytes=MAX_IMAGE_BYTES):
+    """
+    Xにアップロードできる画像に変換する
+    長辺がmax_sideを超える・サイズがmax_bytesを超える・対応していない形式の画像は、縮小してJPEGにする
+    Pillowがインストールされていない場合は変換せず、そのままアップロードできる画像だけを使う
+    戻り値: (画像のバイト列, 拡張子)（使えない画像の場合はNone）
+    """
+    extension = detect_format(data)
+    try:
+        from PIL import Image
+    except ImportError:
+        if extension and len(data) <= max_bytes:
+            return data, extension
+        return None
+
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            if extension and len(data) <= max_bytes and max(image.size) <= max_side:
+                return data, extension
+
+            # JPEGは縮小後の大きさに近い解像度で読み込む（全画素を展開してから縮小するより速い）
+            scale = min(1.0, max_side / max(image.size))
+            image.draft(
+                "RGB", (int(image.width * scale) + 1, int(image.height * scale) + 1)
+            )
+            image = image.convert("RGB")
+            image.thumbnail((max_side, max_side))
+            quality = JPEG_QUALITY
+            while True:
+                buffer = io.BytesIO()
+                image.save(buffer, "JPEG", quality=quality, optimize=True)
+                if buffer.tell() <= max_bytes or quality <= MIN_JPEG_QUALITY:
+                    break
+                quality -= 10
+    except (OSError, ValueError):
+        return None
+
+    if buffer.tell() > max_bytes:
+        return None
+    return buffer.getvalue(), "jpg"
+
+
+def resolve_url(url):
+    """環境変数DMM_IMAGE_BASEが設定されている場合は、画像の取得先を代替サーバーに差し替える"""
+    image_base = os.getenv("DMM_IMAGE_BASE")
+    if not image_base:
+        return url
+    target = urllib.parse.urlparse(image_base)
+    return urllib.parse.urlunparse(
+        urllib.parse.urlparse(url)._replace(scheme=target.scheme, netloc=target.netloc)
+    )
+
+
+class ImageCache(DiskCache):
+    """
+    変換済みの画像を内容のハッシュで保存するキャッシュ（上限サイズを超えたらLRUで削除する）
+    """
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=None, fetch_workers=None):
+        super().__init__(
+            cache_dir,
+            max_bytes if max_bytes is not None else DEFAULT_MAX_MB * 1024 * 1024,
+        )
+        self.fetch_workers = fetch_workers or DEFAULT_FETCH_WORKERS
+        self.index_path = os.path.join(cache_dir, INDEX_FILE)
+        self.failures = 0
+
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                self.index = json.load(f)
+        except (OSError, ValueError):
+            self.index = {}
+
+    @classmethod
+    def from_env(cls):
+        """
+        環境変数から設定を読み込んでキャッシュを作成する
+        IMAGE_CACHE_DIR: 保存先 / IMAGE_CACHE_MAX_MB: 上限サイズ
+        IMAGE_FETCH_WORKERS: 同時にダウンロードする画像の数
+        """
+        return cls(
+            cache_dir=os.getenv("IMAGE_CACHE_DIR", DEFAULT_CACHE_DIR),
+            max_bytes=int(os.getenv("IMAGE_CACHE_MAX_MB", DEFAULT_MAX_MB))
+            * 1024
+            * 1024,
+            fetch_workers=int(os.getenv("IMAGE_FETCH_WORKERS", DEFAULT_FETCH_WORKERS)),
+        )
+
+    def is_entry(self, name):
+        return name != INDEX_FILE and super().is_entry(name)
+
+    def get(self, url):
+        """キャッシュ済みの画像のパスを返す（未登録・削除済みの場合はNone）"""
+        with self._lock:
+            filename = self.index.get(url)
+        if not filename:
+            return None
+
+        path = os.path.join(self.cache_dir, filename)
+        return path if self.touch(path) else None
+
+    def fetch(self, url):
+        """
+        画像のパスを返す（キャッシュになければダウンロード・変換して保存する）
+        取得・変換に失敗した場合はNone
+        """
+        path = self.get(url)
+        if path:
+            with self._lock:
+                self.hits += 1
+            return path
+
+        try:
+            response = http_transport.request("GET", resolve_url(url))
+            response.raise_for_status()
+            prepared = prepare_image(response.content)
+        except Exception as e:
+            print(f"画像の取得に失敗しました: {url} ({e})")
+            prepared = None
+        if prepared is None:
+            with self._lock:
+                self.failures += 1
+            return None
+
+        data, extension = prepared
+        filename = f"{hashlib.sha256(data).hexdigest()}.{extension}"
+        path = os.path.join(self.cache_dir, filename)
+        if not os.path.exists(path):
+            self.write_file(path, data)
+
+        with self._lock:
+            self.index[url] = filename
+            self.misses += 1
+        return path
+
+    def prefetch(self, urls):
+        """
+        複数の画像を並列に取得し、索引を保存して上限サイズに収める
+        戻り値: URLから画像のパス（取得できなかった場合はNone）への辞書
+        """
+        urls = list(dict.fromkeys(url for url in urls if url))
+        if not urls:
+            return {}
+        with ThreadPoolExecutor(max_workers=self.fetch_workers) as executor:
+            paths = dict(zip(urls, executor.map(self.fetch, urls)))
+        self.evict(keep=[path for path in paths.values() if path])
+        self.save_index()
+        return paths
+
+    def save_index(self):
+        """URLとファイル名の対応を保存する（削除済みのファイルを指すものは除く）"""
+        with self._lock:
+            self.index = {
+                url: filename
+                for url, filename in self.index.items()
+                if os.path.exists(os.path.join(self.cache_dir, filename))
+            }
+            tmp_path = f"{self.index_path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self.index, f, ensure_ascii=False)
+            os.replace(tmp_path, self.index_path)
+
+    def extra_stats(self):
+        return [f"失敗 {self.failures}件"]
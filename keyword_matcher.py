@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+キーワード辞書による一括照合（Aho-Corasick法）
+辞書からオートマトンを一度だけ作成し、キーワードが数千件あってもテキストを1回走査するだけで
+含まれるキーワードをすべて見つける（照合時間は辞書の大きさではなくテキストの長さで決まる）
+"""
+
+from collections import deque
+
+
+class KeywordMatcher:
+    """
+    キーワードと値（ハッシュタグなど）の辞書から作成する照合用のオートマトン
+    entries: (キーワード, 値, 優先度)のリスト
+    優先度が大きいものを優先し、同じ場合はリスト内で先にあるものを優先する
+    """
+
+    def __init__(self, entries):
+        self.values = []
+        self.sort_keys = []
+
+        # 状態ごとの遷移先・失敗時の遷移先・その状態で見つかるキーワード（エントリ番号）
+        self.goto = [{}]
+        self.fail = [0]
+        outputs = [[]]
+
+        for index, (keyword, value, priority) in enumerate(entries):
+            self.values.append(value)
+            self.sort_keys.append((-priority, index))
+            if not keyword:
+                continue
+
+            state = 0
+            for char in keyword:
+                next_state = self.goto[state].get(char)
+                if next_state is None:
+                    next_state = len(self.goto)
+                    self.goto[state][char] = next_state
+                    self.goto.append({})
+                    self.fail.append(0)
+                    outputs.append([])
+                state = next_state
+            outputs[state].append(index)
+
+        # 幅優先で失敗時の遷移先を求め、接尾辞として含まれるキーワードも見つかるようにする
+        pending = deque(self.goto[0].values())
+        while pending:
+            state = pending.popleft()
+            for char, next_state in self.goto[state].items():
+                pending.append(next_state)
+                fallback = self.fail[state]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[next_state] = self.goto[fallback].get(char, 0)
+                outputs[next_state].extend(outputs[self.fail[next_state]])
+
+        self.outputs = [tuple(found) for found in outputs]
+
+    def __len__(self):
+        return len(self.values)
+
+    def find(self, text):
+        """テキストに含まれるキーワードのエントリ番号の集合を返す"""
+        goto, fail, outputs = self.goto, self.fail, self.outputs
+        found = set()
+        state = 0
+        for char in text:
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if outputs[state]:
+                found.update(outputs[state])
+        return found
+
+    def select(self, text, limit=1):
+        """テキストに含まれるキーワードの値を、優先順に重複なく最大limit件返す"""
+        selected = []
+        for index in sorted(self.find(text), key=self.sort_keys.__getitem__):
+            value = self.values[index]
+            if value not in selected:
+                selected.append(value)
+                if len(selected) >= limit:
+                    break
+        return selected
@@ -0,0 +1,236 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+投稿履歴の保存と、直近の投稿の索引
+履歴はpost_history/に月ごとのJSON Lines（YYYY-MM.jsonl）として追記するだけで保存し、
+直近の投稿の確認では期間に含まれる月のファイルだけを読む（履歴が何年分あっても読む量は変わらない）
+前年以前の月のファイルは年ごとのファイル（YYYY.jsonl）にまとめる
+同じ作品の版違い（モザイク版・【FANZA限定版】など）も同じ作品として見つけられるよう、
+正規化したタイトルとcontent_idをキーにして過去の投稿を引く
+"""
+
+import json
+import os
+import re
+import unicodedata
+import urllib.parse
+from datetime import datetime, timedelta
+
+# 投稿履歴の保存先（月ごと・年ごとのJSON Lines）
+HISTORY_DIR = "post_history"
+
+# 以前の形式の投稿履歴（全件を1つのJSON配列で保存していたもの、見つかればHISTORY_DIRに移行する）
+LEGACY_HISTORY_FILE = "post_history.json"
+
+# 投稿履歴のtimestampの形式
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# 同じ作品を再投稿しない期間（日）
+RECENT_DAYS = 7
+
+# 月ごとのファイルを年ごとのファイルにまとめるまでの猶予（日）
+# 直近の投稿の確認で読む期間（RECENT_DAYS）より長くし、確認に必要な月はまとめないようにする
+COMPACTION_GRACE_DAYS = 31
+
+# 月ごとのファイル名（YYYY-MM）と年ごとのファイル名（YYYY）
+MONTH_SEGMENT_PATTERN = re.compile(r"^\d{4}-\d{2}$")
+YEAR_SEGMENT_PATTERN = re.compile(r"^\d{4}$")
+
+# タイトルから除く括弧書き（【FANZA限定版】【デジタル特装版】(モザイク版) など）
+TITLE_LABEL_PATTERN = re.compile(r"【[^】]*】|\[[^\]]*版\]|\([^)]*版\)")
+
+# タイトル末尾の版表記（記号と空白を除いた後に、繰り返し取り除く）
+EDITION_SUFFIX_PATTERN = re.compile(r"(モザイク|無修正|デジタル特装|特装|限定|通常)版$")
+
+# 商品ページのURLに含まれるcontent_id（/product/6116532/k187afrnt10894/ や cid=d_123456）
+CONTENT_ID_PATTERN = re.compile(r"/product/\d+/([0-9a-z_]+)/|cid=([0-9a-z_]+)")
+
+
+def normalize_title(title):
+    """
+    版違いの作品が同じキーになるようタイトルを正規化する
+    全角・半角をそろえ、括弧書きの版表記・記号・空白・末尾の「モザイク版」などを除く
+    """
+    text = unicodedata.normalize("NFKC", title or "")
+    text = TITLE_LABEL_PATTERN.sub("", text)
+    text = "".join(
+        char for char in text if unicodedata.category(char)[0] in ("L", "N")
+    ).lower()
+
+    previous = None
+    while previous != text:
+        previous = text
+        text = EDITION_SUFFIX_PATTERN.sub("", text)
+    return text
+
+
+def extract_content_id(text):
+    """URL（またはURLを含む投稿テキスト）からcontent_idを取り出す（見つからなければNone）"""
+    match = CONTENT_ID_PATTERN.search(urllib.parse.unquote(text or ""))
+    if not match:
+        return None
+    return match.group(1) or match.group(2)
+
+
+def is_valid_entry(entry):
+    """timestampを文字列のまま比較できる形式の履歴かどうか"""
+    timestamp = entry.get("timestamp") if isinstance(entry, dict) else None
+    return isinstance(timestamp, str) and len(timestamp) == len("YYYY-MM-DD HH:MM:SS")
+
+
+def list_segments(directory=HISTORY_DIR):
+    """履歴ファイルの(名前, パス)を古い順に返す（年ごとのファイルは同じ年の月より前）"""
+    if not os.path.isdir(directory):
+        return []
+    segments = []
+    for filename in os.listdir(directory):
+        name, ext = os.path.splitext(filename)
+        if ext == ".jsonl" and (
+            MONTH_SEGMENT_PATTERN.match(name) or YEAR_SEGMENT_PATTERN.match(name)
+        ):
+            segments.append((name, os.path.join(directory, filename)))
+    return sorted(segments)
+
+
+def read_segment(path):
+    """履歴ファイルを読み込む（書き込み途中で壊れた行は読み飛ばす）"""
+    entries = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            if is_valid_entry(entry):
+                entries.append(entry)
+    return entries
+
+
+def write_lines(path, entries, mode):
+    """履歴をJSON Linesとして書き込む"""
+    with open(path, mode, encoding="utf-8") as f:
+        for entry in entries:
+            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+
+def migrate_legacy_history(directory=HISTORY_DIR, legacy_path=LEGACY_HISTORY_FILE):
+    """以前の形式の投稿履歴（JSON配列）があれば月ごとのファイルに移して削除する"""
+    if not os.path.exists(legacy_path):
+        return
+    with open(legacy_path, "r", encoding="utf-8") as f:
+        history = json.load(f)
+
+    os.makedirs(directory, exist_ok=True)
+    months = {}
+    for entry in history:
+        if is_valid_entry(entry):
+            months.setdefault(entry["timestamp"][:7], []).append(entry)
+    for month, entries in months.items():
+        write_lines(os.path.join(directory, f"{month}.jsonl"), entries, "a")
+    os.remove(legacy_path)
+
+
+def compact(directory=HISTORY_DIR, now=None):
+    """
+    猶予期間を過ぎた前年以前の月のファイルを、年ごとのファイルにまとめる
+    戻り値: まとめた月のファイルの数
+    """
+    limit_year = ((now or datetime.now()) - timedelta(days=COMPACTION_GRACE_DAYS)).year
+    merged = 0
+    for name, path in list_segments(directory):
+        if not MONTH_SEGMENT_PATTERN.match(name) or int(name[:4]) >= limit_year:
+            continue
+        year_path = os.path.join(directory, f"{name[:4]}.jsonl")
+        write_lines(year_path, read_segment(path), "a")
+        os.remove(path)
+        merged += 1
+    return merged
+
+
+def append_entry(entry, directory=HISTORY_DIR):
+    """
+    投稿履歴に1件追加する（その月のファイルの末尾に1行書き足すだけで、既存の履歴は読まない）
+    月が変わって新しいファイルを作る際に、古い月のファイルをまとめる
+    """
+    migrate_legacy_history(directory)
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{entry['timestamp'][:7]}.jsonl")
+    new_segment = not os.path.exists(path)
+    write_lines(path, [entry], "a")
+    if new_segment:
+        compact(directory)
+
+
+def load_history(path=HISTORY_DIR):
+    """
+    投稿履歴をすべて古い順に読み込む（フィクスチャの作成などに使う）
+    pathに以前の形式のJSONファイルを指定した場合はそのまま読み込む
+    """
+    if os.path.isfile(path):
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                history = json.load(f)
+        except (OSError, ValueError):
+            return []
+        return history if isinstance(history, list) else []
+
+    history = []
+    for _, segment_path in list_segments(path):
+        history.extend(read_segment(segment_path))
+    return history
+
+
+def load_recent_entries(directory=HISTORY_DIR, days=RECENT_DAYS, now=None):
+    """直近days日以内の投稿履歴を返す（期間に含まれる月のファイルだけを読む）"""
+    since = ((now or datetime.now()) - timedelta(days=days)).strftime(TIMESTAMP_FORMAT)
+    entries = []
+    for name, path in list_segments(directory):
+        if MONTH_SEGMENT_PATTERN.match(name) and name >= since[:7]:
+            entries.extend(
+                entry for entry in read_segment(path) if entry["timestamp"] > since
+            )
+    return entries
+
+
+class RecentPostIndex:
+    """
+    正規化したタイトルとcontent_idから、同じ作品の最新の投稿を引く直近の投稿の索引
+    content_idを保存していない古い履歴は、投稿テキストのURLからcontent_idを取り出す
+    """
+
+    def __init__(self, entries):
+        self.by_title = {}
+        self.by_content_id = {}
+        for entry in entries:
+            self.add(entry)
+
+    def add(self, entry):
+        """投稿を索引に追加する（同じキーの投稿がある場合は新しいほうを残す）"""
+        keys = [(self.by_title, normalize_title(entry.get("title")))]
+        content_id = entry.get("content_id") or extract_content_id(
+            entry.get("post_text")
+        )
+        keys.append((self.by_content_id, content_id))
+
+        for index, key in keys:
+            if not key:
+                continue
+            latest = index.get(key)
+            if latest is None or latest["timestamp"] <= entry["timestamp"]:
+                index[key] = entry
+
+    def __len__(self):
+        return len(self.by_title)
+
+    def find(self, title, content_id=None):
+        """同じ作品の直近の投稿を返す（なければNone）"""
+        if content_id and content_id in self.by_content_id:
+            return self.by_content_id[content_id]
+        title_key = normalize_title(title)
+        return self.by_title.get(title_key) if title_key else None
+
+
+def load_recent_posts(directory=HISTORY_DIR, days=RECENT_DAYS):
+    """投稿履歴から直近days日以内の投稿の索引を作る"""
+    migrate_legacy_history(directory)
+    return RecentPostIndex(load_recent_entries(directory, days))
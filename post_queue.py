@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+投稿待ちの作品の永続キュー（post_queue.json）
+content_idをキーに作品を保存し、優先度のヒープから最も優先度の高い未投稿の作品を取り出す
+選定結果の並び順が変わっても同じ作品を指し続けるため、実行のたびに別の作品を処理したり
+同じ作品を繰り返したりしない
+取り出した作品は投稿が完了するまで「取り出し中」として残し、投稿に失敗した場合は次回キューに戻す
+"""
+
+import heapq
+import json
+import os
+from datetime import datetime, timedelta
+
+import post_history
+
+# キューの保存先
+QUEUE_FILE = "post_queue.json"
+
+# 選定結果に含まれなくなってから、この日数が過ぎた作品は取り出す際・保存する際に捨てる
+DEFAULT_TTL_DAYS = 3
+
+# 保存する日時の形式
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+def queue_key(item):
+    """投稿キューのキー（content_idがない作品は正規化したタイトル）"""
+    return item.get("content_id") or post_history.normalize_title(item["title"])
+
+
+class PostQueue:
+    """
+    content_idで引ける作品の表と、(優先度, content_id)のヒープからなる優先度付きキュー
+    優先度は小さいほど先に取り出す（比較できるリスト）
+    優先度が変わった作品や削除した作品のヒープ上の要素は、取り出す際に読み飛ばす（遅延削除）
+    取り出した作品はin_flightを付けて表に残し、completeで削除するまでヒープには戻さない
+    """
+
+    def __init__(self, path=QUEUE_FILE, ttl_days=DEFAULT_TTL_DAYS):
+        self.path = path
+        self.ttl = timedelta(days=ttl_days)
+        self.items = {}
+        self.heap = []
+
+        if os.path.exists(path):
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+                self.items = data.get("items", {})
+                self.heap = [list(entry) for entry in data.get("heap", [])]
+                heapq.heapify(self.heap)
+            except (OSError, ValueError, AttributeError):
+                self.items = {}
+                self.heap = []
+
+    def __len__(self):
+        """取り出し中の作品を除いた、投稿待ちの作品数"""
+        return sum(1 for entry in self.items.values() if not entry.get("in_flight"))
+
+    def enqueue(self, content_id, item, priority, now=None):
+        """
+        作品を追加する（すでにある場合は内容・優先度・最終確認日時を更新する）
+        戻り値: 新たに追加した場合はTrue
+        """
+        now = (now or datetime.now()).strftime(TIMESTAMP_FORMAT)
+        priority = list(priority)
+        existing = self.items.get(content_id)
+        self.items[content_id] = {
+            "item": item,
+            "priority": priority,
+            "enqueued_at": existing["enqueued_at"] if existing else now,
+            "last_seen": now,
+        }
+        if existing and existing.get("in_flight"):
+            # 取り出し中の作品は、投稿の結果がわかるまでヒープに戻さない
+            self.items[content_id]["in_flight"] = existing["in_flight"]
+        elif existing is None or existing["priority"] != priority:
+            heapq.heappush(self.heap, [priority, content_id])
+        return existing is None
+
+    def is_expired(self, entry, now):
+        """選定結果に含まれなくなってから有効期限が過ぎたかどうか"""
+        try:
+            last_seen = datetime.strptime(entry["last_seen"], TIMESTAMP_FORMAT)
+        except (KeyError, TypeError, ValueError):
+            return True
+        return now - last_seen > self.ttl
+
+    def prune(self, should_skip=None, now=None):
+        """
+        有効期限切れの作品と、should_skip(作品)がTrueを返す作品（投稿済みなど）を削除する
+        ヒープ上の要素は残し、取り出す際・保存する際に読み飛ばす
+        戻り値: 削除した作品のリスト
+        """
+        now = now or datetime.now()
+        dropped = []
+        for content_id, entry in list(self.items.items()):
+            if self.is_expired(entry, now) or (
+                should_skip is not None and should_skip(entry["item"])
+            ):
+                del self.items[content_id]
+                dropped.append(entry["item"])
+        return dropped
+
+    def dequeue(self, should_skip=None, now=None):
+        """
+        最も優先度の高い作品を取り出し中にする（completeで削除するまで表には残す）
+        有効期限切れの作品と、should_skip(作品)がTrueを返す作品（投稿済みなど）は捨てて次を見る
+        戻り値: (作品, 捨てた作品のリスト)（取り出せる作品がない場合、作品はNone）
+        """
+        now = now or datetime.now()
+        dropped = []
+        while self.heap:
+            priority, content_id = heapq.heappop(self.heap)
+            entry = self.items.get(content_id)
+            if entry is None or entry["priority"] != priority or entry.get("in_flight"):
+                # 削除済み・取り出し中、または優先度が更新された古い要素
+                continue
+
+            if self.is_expired(entry, now) or (
+                should_skip is not None and should_skip(entry["item"])
+            ):
+                del self.items[content_id]
+                dropped.append(entry["item"])
+                continue
+            entry["in_flight"] = now.strftime(TIMESTAMP_FORMAT)
+            return entry["item"], dropped
+        return None, dropped
+
+    def complete(self, content_id):
+        """
+        投稿が完了した作品を削除する
+        戻り値: 削除した場合はTrue
+        """
+        return self.items.pop(content_id, None) is not None
+
+    def release(self):
+        """
+        取り出し中のまま残っている作品（投稿に失敗した作品）をヒープに戻す
+        戻り値: 戻した作品のリスト
+        """
+        released = []
+        for content_id, entry in self.items.items():
+            if entry.pop("in_flight", None):
+                heapq.heappush(self.heap, [entry["priority"], content_id])
+                released.append(entry["item"])
+        return released
+
+    def save(self, now=None):
+        """
+        キューを保存する
+        有効期限切れの作品は取り出されなくても削除し、古い要素が増えすぎていればヒープを作り直す
+        """
+        self.prune(now=now)
+        if len(self.heap) > 2 * len(self.items) + 16:
+            self.heap = [
+                [entry["priority"], content_id]
+                for content_id, entry in self.items.items()
+                if not entry.get("in_flight")
+            ]
+            heapq.heapify(self.heap)
+
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(
+                {"items": self.items, "heap": self.heap},
+                f,
+                ensure_ascii=False,
+                indent=1,
+            )
+        os.replace(temp_path, self.path)
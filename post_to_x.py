@@ -8,11 +8,15 @@ import time
 import requests
 from dotenv import load_dotenv
 import logging
-import urllib.parse
-import urllib.request
 from datetime import datetime
 import re
 import random
+from concurrent.futures import ThreadPoolExecutor
+import http_transport
+import rate_limiter
+import post_history
+from post_queue import PostQueue, queue_key
+from text_similarity import SimilarTextIndex
 
 # ロギング設定
 logging.basicConfig(
@@ -78,6 +82,20 @@ AFFILIATE_POST_CHANNEL_ID = os.getenv(
     "AFFILIATE_POST_CHANNEL_ID"
 )  # X投稿用チャンネルID
 
+# 送信前に似た投稿テキストがないか確認する期間（日）と、似ているとみなす推定Jaccard係数
+SIMILAR_POST_DAYS = int(os.getenv("SIMILAR_POST_DAYS", "30"))
+SIMILAR_POST_THRESHOLD = float(os.getenv("SIMILAR_POST_THRESHOLD", "0.7"))
+
+# 連続投稿（--burst）で投稿する作品のリスト（process_manga_data.py --burst が作成する）
+BURST_POSTS_FILE = "burst_posts.json"
+
+# 連続投稿の投稿間隔（秒）
+DEFAULT_POST_BURST_INTERVAL = 60
+
+# 添付画像のアップロードに使うスレッド（投稿テキストの準備と並行してアップロードする）
+# 画像を添付しない投稿では作らないよう、get_media_executorで初めて使うときに作成する
+media_executor = None
+
 
 def load_post_data():
     """
@@ -92,19 +110,6 @@ def load_post_data():
         return None
 
 
-def download_image(image_url, save_path):
-    """
-    画像をダウンロードして保存する
-    """
-    try:
-        urllib.request.urlretrieve(image_url, save_path)
-        logger.info(f"画像をダウンロードしました: {save_path}")
-        return True
-    except Exception as e:
-        logger.error(f"画像のダウンロードに失敗しました: {e}")
-        return False
-
-
 def create_twitter_client():
     """
     Twitter APIクライアントを作成する
@@ -140,19 +145,80 @@ def create_twitter_client():
             access_token_secret=access_secret,
         )
 
-        # 画像アップロード用のAPIv1.1クライアント
-        auth = tweepy.OAuth1UserHandler(
-            api_key, api_secret, access_token, access_secret
-        )
-        api_v1 = tweepy.API(auth)
+        # 環境変数X_API_BASEが設定されている場合はローカルの代替サーバーに接続する
+        x_api_base = os.getenv("X_API_BASE")
+        if x_api_base:
+            http_transport.redirect_session(
+                client.session, "https://api.twitter.com", x_api_base
+            )
+            logger.info(f"X APIの接続先を変更しました: {x_api_base}")
 
-        return {"client": client, "api_v1": api_v1}
+        # 画像アップロード用のAPIv1.1クライアントは、画像を添付するときにget_media_apiで作る
+        return {
+            "client": client,
+            "api_v1": None,
+            "credentials": (api_key, api_secret, access_token, access_secret),
+        }
 
     except Exception as e:
         logger.error(f"Twitterクライアントの作成に失敗しました: {e}")
         return None
 
 
+def get_media_api(twitter_client):
+    """
+    画像アップロード用のAPIv1.1クライアントを返す（初めて呼ばれたときに作成して使い回す）
+    """
+    if twitter_client.get("api_v1") is None:
+        import tweepy
+
+        auth = tweepy.OAuth1UserHandler(*twitter_client["credentials"])
+        api_v1 = tweepy.API(auth)
+
+        x_api_base = os.getenv("X_API_BASE")
+        if x_api_base:
+            http_transport.redirect_session(
+                api_v1.session, "https://upload.twitter.com", x_api_base
+            )
+        twitter_client["api_v1"] = api_v1
+    return twitter_client["api_v1"]
+
+
+def get_media_executor():
+    """
+    画像アップロード用のスレッドを返す（初めて呼ばれたときに作成して使い回す）
+    """
+    global media_executor
+    if media_executor is None:
+        media_executor = ThreadPoolExecutor(max_workers=1)
+    return media_executor
+
+
+def upload_media(media_path, twitter_client):
+    """
+    画像をアップロードしてmedia_idを返す
+    """
+    media = get_media_api(twitter_client).media_upload(media_path)
+    logger.info(f"画像をアップロードしました: {media_path}")
+    return media.media_id
+
+
+def start_media_upload(post_data, twitter_client):
+    """
+    添付画像（media_path）があれば別スレッドでアップロードを始める
+    戻り値: media_idを返すFuture（画像がない場合はNone）
+    """
+    media_path = post_data.get("media_path")
+    if not media_path:
+        return None
+    if not os.path.exists(media_path):
+        logger.warning(
+            f"添付画像が見つからないため、テキストのみで投稿します: {media_path}"
+        )
+        return None
+    return get_media_executor().submit(upload_media, media_path, twitter_client)
+
+
 def add_variation_to_text(text):
     """
     投稿テキストにバリエーションを追加して重複投稿エラーを回避する
@@ -194,6 +260,48 @@ def add_variation_to_text(text):
     return text
 
 
+def load_similar_posts():
+    """
+    直近SIMILAR_POST_DAYS日以内に投稿したテキストの類似検索用の索引を作る
+    """
+    index = SimilarTextIndex(threshold=SIMILAR_POST_THRESHOLD)
+    for entry in post_history.load_recent_entries(days=SIMILAR_POST_DAYS):
+        index.add(entry.get("post_text", ""), entry)
+    return index
+
+
+def avoid_similar_post_text(post_data, post_text):
+    """
+    直近の投稿と似ている投稿テキストを、送信前に予備のリライト案に差し替える
+    似ていない予備がなければバリエーションを追加する（重複エラーの往復と待機を省く）
+    """
+    try:
+        similar_posts = load_similar_posts()
+    except Exception as e:
+        logger.warning(f"投稿テキストの類似チェックに失敗しました: {e}")
+        return post_text
+
+    similar = similar_posts.find(post_text)
+    if similar is None:
+        return post_text
+
+    entry, similarity = similar
+    logger.warning(
+        f"直近の投稿と似た投稿テキストです（類似度{similarity:.2f}、{entry['timestamp']}）"
+    )
+
+    spare_texts = post_data.get("spare_post_texts") or []
+    while spare_texts:
+        # 使った予備は取り除き、重複エラーでのリトライでは別の案を使う
+        candidate = spare_texts.pop(0).strip()
+        if candidate and similar_posts.find(candidate) is None:
+            logger.info(f"予備のリライト案に切り替えました（残り{len(spare_texts)}件）")
+            return candidate
+
+    logger.info("似ていない予備がないため、投稿テキストにバリエーションを追加しました")
+    return add_variation_to_text(post_text)
+
+
 def is_duplicate_content_error(e):
     """
     エラーが重複コンテンツによるものかを判定
@@ -204,9 +312,25 @@ def is_duplicate_content_error(e):
     ) and "duplicate content" in error_text
 
 
-def post_to_twitter(post_data, twitter_client, retry_count=0):
+def is_retryable_api_error(e):
+    """
+    エラーがレート制限（429）またはX側のサーバーエラー（5xx）によるものかを判定
+    """
+    status_code = getattr(getattr(e, "response", None), "status_code", None)
+    return status_code == 429 or (status_code is not None and status_code >= 500)
+
+
+def get_error_headers(e):
+    """
+    APIエラーのレスポンスヘッダーを取得する（x-rate-limit-resetの参照用）
+    """
+    return getattr(getattr(e, "response", None), "headers", None)
+
+
+def post_to_twitter(post_data, twitter_client, retry_count=0, media_future=None):
     """
     Twitterに投稿する
+    media_future: 添付画像のアップロード（start_media_upload、省略時はここで始める）
     """
     try:
         if not twitter_client or not post_data:
@@ -214,7 +338,10 @@ def post_to_twitter(post_data, twitter_client, retry_count=0):
             return False
 
         client = twitter_client["client"]
-        api_v1 = twitter_client["api_v1"]
+
+        # 添付画像のアップロードは、以下の投稿テキストの準備と並行して進める
+        if media_future is None:
+            media_future = start_media_upload(post_data, twitter_client)
 
         # 投稿テキスト準備
         post_text = post_data.get("post_text", "").strip()
@@ -246,12 +373,24 @@ def post_to_twitter(post_data, twitter_client, retry_count=0):
             logger.error("投稿テキストがありません。")
             return False
 
-        # リトライの場合はテキストにバリエーションを追加
+        # リトライの場合は予備のリライト案に切り替え、なければテキストにバリエーションを追加
         if retry_count > 0:
-            post_text = add_variation_to_text(post_text)
-            logger.info(
-                f"重複エラー回避のため投稿テキストを変更しました（リトライ{retry_count}回目）"
-            )
+            spare_texts = post_data.get("spare_post_texts") or []
+            if spare_texts:
+                # 使った予備は取り除き、次のリトライでは別の案を使う
+                post_text = spare_texts.pop(0).strip()
+                logger.info(
+                    "重複エラー回避のため予備のリライト案に切り替えました"
+                    f"（リトライ{retry_count}回目、残り{len(spare_texts)}件）"
+                )
+            else:
+                post_text = add_variation_to_text(post_text)
+                logger.info(
+                    f"重複エラー回避のため投稿テキストを変更しました（リトライ{retry_count}回目）"
+                )
+        else:
+            # 直近の投稿と似ていないかを送信前に確認する
+            post_text = avoid_similar_post_text(post_data, post_text)
 
         # URLがすでにテキストに含まれている場合は削除（二重投稿防止）
         post_text = re.sub(r"https?://[^\s]+", "", post_text).strip()
@@ -269,9 +408,25 @@ def post_to_twitter(post_data, twitter_client, retry_count=0):
                 # 末尾に改行とアフィリエイトURLを追加
                 post_text = post_text + "\n\n" + affiliate_url
 
+        # 画像のアップロードの完了を待つ（失敗した場合はテキストのみで投稿する）
+        media_ids = None
+        if media_future is not None:
+            try:
+                media_ids = [media_future.result()]
+            except Exception as e:
+                logger.warning(
+                    f"画像のアップロードに失敗したため、テキストのみで投稿します: {e}"
+                )
+
         try:
-            # テキストのみの投稿を作成（画像なし）
-            response = client.create_tweet(text=post_text)
+            # 投稿を作成（画像がなければテキストのみ）
+            # レート制限・サーバーエラーはx-rate-limit-resetに従って待機してから再試行する
+            response = rate_limiter.call_with_retry(
+                "api.twitter.com",
+                lambda: client.create_tweet(text=post_text, media_ids=media_ids),
+                is_retryable_api_error,
+                get_headers=get_error_headers,
+            )
 
             if response.data:
                 tweet_id = response.data["id"]
@@ -289,12 +444,13 @@ def post_to_twitter(post_data, twitter_client, retry_count=0):
             # 重複コンテンツエラーの場合、最大3回までリトライ
             if is_duplicate_content_error(e) and retry_count < 3:
                 logger.warning(f"重複コンテンツエラーが発生しました: {e}")
-                logger.info(
-                    f"投稿テキストにバリエーションを追加して再試行します（{retry_count+1}/3）"
+                logger.info(f"投稿テキストを変更して再試行します（{retry_count+1}/3）")
+                # ジッター付きのバックオフで待機してから再試行
+                time.sleep(rate_limiter.backoff_delay(retry_count))
+                # アップロード済みの画像はそのまま使う
+                return post_to_twitter(
+                    post_data, twitter_client, retry_count + 1, media_future
                 )
-                # 少し待機してから再試行
-                time.sleep(2)
-                return post_to_twitter(post_data, twitter_client, retry_count + 1)
             else:
                 # それ以外のエラーまたはリトライ回数オーバー
                 raise
@@ -309,20 +465,9 @@ def post_to_twitter(post_data, twitter_client, retry_count=0):
 
 def save_post_history(post_data, tweet_id, actual_post_text=None):
     """
-    投稿履歴を保存する
+    投稿履歴を保存する（その月の履歴ファイルに1行追記する）
     """
     try:
-        history_file = "post_history.json"
-
-        # 既存の履歴を読み込む
-        history = []
-        if os.path.exists(history_file):
-            try:
-                with open(history_file, "r", encoding="utf-8") as f:
-                    history = json.load(f)
-            except:
-                history = []
-
         # 投稿履歴を追加
         history_entry = {
             "title": post_data["title"],
@@ -331,12 +476,11 @@ def save_post_history(post_data, tweet_id, actual_post_text=None):
             "tweet_id": tweet_id,
             "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
         }
+        # 次回以降の重複チェックに使うcontent_id
+        if post_data.get("content_id"):
+            history_entry["content_id"] = post_data["content_id"]
 
-        history.append(history_entry)
-
-        # 履歴を保存
-        with open(history_file, "w", encoding="utf-8") as f:
-            json.dump(history, f, ensure_ascii=False, indent=2)
+        post_history.append_entry(history_entry)
 
         logger.info("投稿履歴を保存しました")
 
@@ -344,42 +488,125 @@ def save_post_history(post_data, tweet_id, actual_post_text=None):
         logger.error(f"投稿履歴の保存に失敗しました: {e}")
 
 
-def check_post_history(title):
+def check_post_history(title, content_id=None):
     """
-    過去に同じタイトルの投稿があるかチェック
+    過去7日以内に同じ作品の投稿があるかチェック
+    版違い（モザイク版・【FANZA限定版】など）のタイトルやcontent_idが同じ投稿も同じ作品として扱う
     """
     try:
-        history_file = "post_history.json"
-        if not os.path.exists(history_file):
-            return False
-
-        with open(history_file, "r", encoding="utf-8") as f:
-            history = json.load(f)
-
-        # 過去7日以内に同じタイトルの投稿があるかをチェック
-        now = datetime.now()
-        seven_days_ago = now.timestamp() - (7 * 24 * 60 * 60)
-
-        for entry in history:
-            if entry["title"] == title:
-                try:
-                    post_time = datetime.strptime(
-                        entry["timestamp"], "%Y-%m-%d %H:%M:%S"
-                    )
-                    if post_time.timestamp() > seven_days_ago:
-                        logger.warning(
-                            f"過去7日以内に同じタイトルの投稿があります: {title}"
-                        )
-                        return True
-                except:
-                    pass
-
+        posted = post_history.load_recent_posts().find(title, content_id)
+        if posted:
+            logger.warning(
+                f"過去7日以内に同じ作品の投稿があります（{posted['timestamp']}）: {title}"
+            )
+            return True
         return False
     except Exception as e:
         logger.error(f"投稿履歴のチェックに失敗しました: {e}")
         return False
 
 
+def remove_from_queue(post_data):
+    """
+    投稿した（または投稿済みだった）作品を投稿キューから削除する
+    削除しなかった作品は取り出し中のまま残り、次回のprocess_manga_data.pyでキューに戻る
+    """
+    try:
+        posting_queue = PostQueue()
+        if posting_queue.complete(queue_key(post_data)):
+            posting_queue.save()
+            logger.info("投稿キューから削除しました")
+    except Exception as e:
+        logger.error(f"投稿キューの更新に失敗しました: {e}")
+
+
+def load_burst_posts():
+    """
+    burst_posts.jsonから連続投稿する作品のリストを読み込む
+    """
+    try:
+        with open(BURST_POSTS_FILE, "r", encoding="utf-8") as f:
+            posts = json.load(f)
+        return posts if isinstance(posts, list) else None
+    except Exception as e:
+        logger.error(f"連続投稿のデータの読み込みに失敗しました: {e}")
+        return None
+
+
+def save_burst_posts(posts):
+    """
+    まだ投稿していない作品だけをburst_posts.jsonに書き戻す（同じ実行の中でpost_to_x.py --burstを続けて呼ぶと続きから投稿する）
+    burst_posts.jsonは次回のprocess_manga_data.py --burstで上書きされるため、実行をまたいでは使わない
+    （投稿できなかった作品は投稿キューで取り出し中のまま残り、次回のprocess_manga_data.pyでキューに戻る）
+    """
+    temp_path = f"{BURST_POSTS_FILE}.tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        json.dump(posts, f, ensure_ascii=False, indent=2)
+    os.replace(temp_path, BURST_POSTS_FILE)
+
+
+def post_burst(limit=None):
+    """
+    burst_posts.jsonの作品を先頭から最大limit件（省略時は全件）、POST_BURST_INTERVAL秒の間隔で投稿する
+    Twitterクライアントは最初に投稿するときに1回だけ作り、以降の投稿で使い回す
+    投稿に失敗した場合は終了する（残りの作品は次回のprocess_manga_data.pyで投稿キューに戻る）
+    """
+    posts = load_burst_posts()
+    if posts is None:
+        return False
+
+    interval = float(os.getenv("POST_BURST_INTERVAL", DEFAULT_POST_BURST_INTERVAL))
+    limit = len(posts) if limit is None else limit
+    logger.info(
+        f"連続投稿を開始します（待ち {len(posts)}件、最大{limit}件、間隔 {interval:.0f}秒）"
+    )
+
+    twitter_client = None
+    last_posted = None
+    posted = 0
+    success = True
+    while posts and posted < limit:
+        post_data = posts[0]
+        title = post_data.get("title", "")
+        if title and check_post_history(title, post_data.get("content_id")):
+            logger.warning(f"過去7日以内に投稿済みのため飛ばします: {title}")
+            remove_from_queue(post_data)
+            posts.pop(0)
+            save_burst_posts(posts)
+            continue
+
+        if twitter_client is None:
+            twitter_client = create_twitter_client()
+            if not twitter_client:
+                logger.error("Twitterクライアントの作成に失敗しました")
+                success = False
+                break
+
+        # 添付画像のアップロードを先に始め、投稿間隔の待機と並行して進める
+        media_future = start_media_upload(post_data, twitter_client)
+
+        # 前回の投稿から投稿間隔が空くまで待機する
+        if last_posted is not None:
+            wait = interval - (time.monotonic() - last_posted)
+            if wait > 0:
+                logger.info(f"次の投稿まで{wait:.0f}秒待機します")
+                time.sleep(wait)
+
+        if not post_to_twitter(post_data, twitter_client, media_future=media_future):
+            logger.error(f"投稿に失敗したため連続投稿を中止します: {title}")
+            success = False
+            break
+        last_posted = time.monotonic()
+        posted += 1
+        remove_from_queue(post_data)
+        posts.pop(0)
+        save_burst_posts(posts)
+
+    logger.info(f"連続投稿で{posted}件を投稿しました（残り {len(posts)}件）")
+    logger.info(f"通信量:\n{http_transport.stats_text()}")
+    return success
+
+
 def main():
     """
     メイン処理
@@ -394,9 +621,10 @@ def main():
 
     # 過去7日以内に同じタイトルの投稿があるかチェック
     title = post_data.get("title", "")
-    if title and check_post_history(title):
+    if title and check_post_history(title, post_data.get("content_id")):
         logger.warning("過去7日以内に同じタイトルの投稿があるため、処理を中止します")
         # この場合は成功として扱い、別の投稿が選ばれるようにする
+        remove_from_queue(post_data)
         return True
 
     # Twitterクライアントを作成
@@ -408,7 +636,10 @@ def main():
     # 投稿する
     success = post_to_twitter(post_data, twitter_client)
 
+    logger.info(f"通信量:\n{http_transport.stats_text()}")
+
     if success:
+        remove_from_queue(post_data)
         logger.info("投稿処理が完了しました")
         return True
     else:
@@ -417,5 +648,10 @@ def main():
 
 
 if __name__ == "__main__":
-    result = main()
+    if len(sys.argv) > 1 and sys.argv[1] == "--burst":
+        # burst_posts.jsonの作品を連続で投稿する（件数を省略した場合は全件）
+        result = post_burst(int(sys.argv[2]) if len(sys.argv) > 2 else None)
+    else:
+        # デフォルトはcurrent_post.jsonの1件を投稿する
+        result = main()
     sys.exit(0 if result else 1)
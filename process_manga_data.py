@@ -1,14 +1,24 @@
 import json
-import pandas as pd
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
-import requests
 import os
-from dotenv import load_dotenv
+import queue
+import random
+import threading
 import time
+from dotenv import load_dotenv
 import subprocess
 import re  # 正規表現のモジュール
 import urllib.parse  # URLエンコード用のモジュール追加
 import sys  # プログラム終了用にsysモジュール追加
+import http_transport  # API共通のHTTP通信層（接続の再利用・タイムアウト）
+import rate_limiter  # API共通のレート制限・リトライ処理
+from response_cache import ResponseCache  # AIリライト結果のディスクキャッシュ
+from keyword_matcher import KeywordMatcher  # ハッシュタグ辞書の一括照合
+import post_history  # 投稿履歴（直近の投稿の索引）
+from post_queue import PostQueue, queue_key  # 投稿待ちの作品の永続キュー
+from image_cache import ImageCache  # 表紙画像のディスクキャッシュ
 
 # プログラム開始時に環境変数を読み込み
 load_dotenv()
@@ -57,6 +67,168 @@ AFFILIATE_ID = os.getenv("AFFILIATE_ID")
 AFFILIATE_SITE = os.getenv("AFFILIATE_SITE")
 AFFILIATE_CHANNEL = os.getenv("AFFILIATE_CHANNEL")
 
+# OpenRouter APIの接続先（環境変数OPENROUTER_API_BASEでローカルの代替サーバーなどに変更可能）
+OPENROUTER_API_BASE = os.getenv(
+    "OPENROUTER_API_BASE", "https://openrouter.ai/api/v1"
+).rstrip("/")
+
+# 投稿に表示するランキング（ranking_infoのキー, 表示名, 表示する順位の上限）
+RANKING_DISPLAY = [
+    ("daily_rank", "日間", 50),
+    ("weekly_rank", "週間", 100),
+    ("monthly_rank", "月間", 200),
+]
+
+# 一括リライト（--all）の同時実行数と、1件あたりのAPI読み込みタイムアウト（秒）
+DEFAULT_REWRITE_WORKERS = 4
+DEFAULT_REWRITE_TIMEOUT = 30
+
+# 一括リライトで1回のAPIリクエストにまとめる件数（環境変数OPENROUTER_BATCH_SIZEで変更可能、1で1件ずつ）
+DEFAULT_REWRITE_BATCH_SIZE = 5
+
+# 複数件をまとめてリライトする際のユーザープロンプト
+# {instruction}にはユーザープロンプトテンプレート、{items}にはidと元テキストのJSON配列が入る
+BATCH_PROMPT_TEMPLATE = """以下のJSON配列に含まれる{count}件の投稿テキスト（text）を、それぞれ次の指示に従ってリライトしてください。
+
+指示:
+{instruction}
+
+結果は前置きや説明を付けずに、次の形式のJSON配列だけで返してください（idは入力と同じ値）:
+[{{"id": 0, "text": "リライト後の投稿テキスト"}}]
+
+投稿テキスト:
+{items}"""
+
+# ストリーミングモード（環境変数OPENROUTER_STREAM=1）では、応答を受信しながら
+# 投稿に使える日本語テキストが揃った時点で受信を打ち切り、待ち時間と出力トークンを減らす
+STREAM_REWRITES = os.getenv("OPENROUTER_STREAM", "0") == "1"
+
+# extract_rewritten_textが使う日本語の行数と文字数の上限（これだけ揃えば以降の応答は使われない）
+STREAM_MAX_LINES = 3
+STREAM_MAX_CHARS = 120
+
+# 日本語の文がこの文字数以上揃い、その後に日本語以外の行（英語の補足説明など）が届いた時点でも打ち切る
+STREAM_MIN_CHARS = int(os.getenv("OPENROUTER_STREAM_MIN_CHARS", 40))
+
+# ヘッジリクエスト（環境変数OPENROUTER_HEDGE_MODELSにカンマ区切りで予備のモデルを指定すると有効）
+# 主モデルから一定時間内に応答がなければ予備のモデルにも同じリクエストを送り、
+# 先に投稿に使える応答を返したモデルの結果を採用する（1つのモデルの遅延で全体が止まらないようにする）
+HEDGE_MODELS = [
+    model.strip()
+    for model in os.getenv("OPENROUTER_HEDGE_MODELS", "").split(",")
+    if model.strip()
+]
+
+# 予備のモデルを起動するまでの待ち時間は、過去のリライト所要時間のこのパーセンタイル値とする
+# （環境変数OPENROUTER_HEDGE_PERCENTILEで変更可能）
+DEFAULT_HEDGE_PERCENTILE = 95
+
+# 過去の記録が少ない間に使う待ち時間（秒、環境変数OPENROUTER_HEDGE_DELAYで変更可能）
+DEFAULT_HEDGE_DELAY = 5.0
+
+# パーセンタイルの計算に必要な記録数と、計算に使う直近の記録数
+HEDGE_MIN_SAMPLES = 5
+HEDGE_HISTORY_SIZE = 200
+
+# ヘッジリクエストごとに採用したモデルと各モデルの所要時間を記録するファイル（1行に1件）
+# 実行をまたいで記録が残るよう、ワークフローでキャッシュする.cache/に保存する（直近HEDGE_HISTORY_SIZE件まで）
+REWRITE_LATENCY_FILE = os.path.join(".cache", "rewrite_latency.jsonl")
+
+# モデルごとの直近の所要時間（秒）（初回使用時にREWRITE_LATENCY_FILEから読み込む）
+rewrite_latencies = None
+rewrite_latencies_lock = threading.Lock()
+
+# 1件のリライトで作成する候補数（環境変数OPENROUTER_CANDIDATESで変更可能、1で従来どおり）
+# 2以上の場合は1回のリクエストで複数のリライト案を受け取り、最も評価の高いものを投稿に使い、
+# 残りは重複エラー時の予備としてcurrent_post.jsonのspare_post_textsに保存する
+DEFAULT_REWRITE_CANDIDATES = 1
+
+# 複数のリライト案を一度に作成する際のユーザープロンプト
+# {instruction}にはユーザープロンプトテンプレート、{skeleton}には返してほしいJSON配列の形式が入る
+CANDIDATES_PROMPT_TEMPLATE = """次の指示に従って、表現や切り口がそれぞれ異なるリライト案を{count}件作成してください。
+
+指示:
+{instruction}
+
+結果は前置きや説明を付けずに、次の形式のJSON配列だけで返してください:
+{skeleton}"""
+
+# 候補の評価に使うXの文字数の上限（全角文字は2文字として数える）とURLの換算文字数
+X_MAX_WEIGHTED_LENGTH = 280
+X_URL_LENGTH = 23
+
+# 候補の評価で理想とする本文（ハッシュタグより前）の文字数
+IDEAL_CANDIDATE_LENGTH = 80
+
+# AIリライト結果のキャッシュ（モデル・プロンプト・元テキストが同じならAPIを呼ばずに再利用する）
+REWRITE_CACHE_DIR = os.path.join(".cache", "rewrite")
+REWRITE_CACHE_ENDPOINT = "OpenRouter"
+# 有効期間は直近の投稿の確認期間（RECENT_DAYS）以内にする
+# （それより長いと、確認期間を過ぎて同じ作品を再投稿したときに前回とまったく同じ文章を使ってしまう）
+DEFAULT_REWRITE_CACHE_TTL = post_history.RECENT_DAYS * 24 * 60 * 60
+DEFAULT_REWRITE_CACHE_MAX_MB = 20
+
+# 1件のキャッシュに保存するAI応答のバリエーション数（環境変数OPENROUTER_CACHE_VARIANTSで変更可能）
+# 2以上の場合は、この数に達するまではAPIを呼んで応答を追加し、達した後はその中から1つを選んで使う
+REWRITE_CACHE_VARIANTS = max(1, int(os.getenv("OPENROUTER_CACHE_VARIANTS", 1)))
+
+# AIリライト結果のキャッシュ（process_manga_data実行時に作成、Noneの場合はキャッシュしない）
+rewrite_cache = None
+
+# 一括リライトの結果を完了順に書き出すファイル（1行に1件、indexは選定結果内の位置）
+REWRITTEN_POSTS_FILE = "rewritten_posts.jsonl"
+
+# 連続投稿（--burst）でリライトした作品のリストを保存するファイル（post_to_x.py --burst で投稿する）
+BURST_POSTS_FILE = "burst_posts.json"
+
+# 投稿に添付する表紙画像の大きさ（DMM APIのimageURLのキー、先にあるものを優先）
+COVER_IMAGE_KEYS = ("large", "list", "small")
+
+
+def create_rewrite_cache():
+    """
+    環境変数からAIリライト結果のキャッシュを作成する
+    OPENROUTER_CACHE_DIR: 保存先 / OPENROUTER_CACHE_MAX_MB: 上限サイズ
+    OPENROUTER_CACHE_TTL: 有効期限（秒、0でキャッシュしない）
+    """
+    return ResponseCache(
+        cache_dir=os.getenv("OPENROUTER_CACHE_DIR", REWRITE_CACHE_DIR),
+        ttls={
+            REWRITE_CACHE_ENDPOINT: int(
+                os.getenv("OPENROUTER_CACHE_TTL", DEFAULT_REWRITE_CACHE_TTL)
+            )
+        },
+        max_bytes=int(
+            os.getenv("OPENROUTER_CACHE_MAX_MB", DEFAULT_REWRITE_CACHE_MAX_MB)
+        )
+        * 1024
+        * 1024,
+    )
+
+
+def load_rewrite_variants(cache_params):
+    """キャッシュ済みのAI応答（バリエーションのリスト）を返す（未登録の場合は空のリスト）"""
+    if rewrite_cache is None:
+        return []
+    entry = rewrite_cache.get(REWRITE_CACHE_ENDPOINT, cache_params)
+    return entry.get("variants", []) if entry else []
+
+
+def save_rewrite_variants(cache_params, variants, raw_texts):
+    """
+    AI応答をキャッシュのバリエーションに追加する（上限を超えた分は古いものから捨てる）
+    1回の呼び出しで得た複数の候補は、上限に関係なくすべて残す
+    """
+    if rewrite_cache is None:
+        return
+    variants = [text for text in variants if text not in raw_texts] + list(raw_texts)
+    limit = max(REWRITE_CACHE_VARIANTS, len(raw_texts))
+    rewrite_cache.set(
+        REWRITE_CACHE_ENDPOINT,
+        cache_params,
+        {"variants": variants[-limit:]},
+    )
+
 
 def update_manga_data():
     """
@@ -80,9 +252,10 @@ def update_manga_data():
         return False
 
 
-def rewrite_text_with_ai(original_text):
+def load_openrouter_settings():
     """
-    オープンルーターAPIを使用して投稿テキストをリライトする
+    OpenRouter APIの設定（APIキー・モデル・プロンプト）を環境変数から読み込む
+    未設定の項目があればValueErrorを送出する
     """
     # 環境変数は既にプログラム開始時に読み込み済みのため、ここでは不要
     # load_dotenv()
@@ -102,8 +275,6 @@ def rewrite_text_with_ai(original_text):
             "環境変数OPENROUTER_MODELが設定されていません。処理を中止します。"
         )
 
-    print(f"使用するAIモデル: {model}")
-
     # システムプロンプトを取得
     system_prompt = os.getenv("OPENROUTER_SYSTEM_PROMPT")
     if not system_prompt:
@@ -118,22 +289,46 @@ def rewrite_text_with_ai(original_text):
             "環境変数OPENROUTER_USER_PROMPT_TEMPLATEが設定されていません。処理を中止します。"
         )
 
-    # ユーザープロンプトにテキストを挿入
-    user_prompt = user_prompt_template.format(text=original_text)
+    return {
+        "api_key": api_key,
+        "model": model,
+        "system_prompt": system_prompt,
+        "user_prompt_template": user_prompt_template,
+    }
 
+
+def rewrite_cache_params(settings, original_text):
+    """リライト結果のキャッシュキーに使うパラメータ（モデル・プロンプト・元テキスト）"""
+    return {
+        "model": settings["model"],
+        "system_prompt": settings["system_prompt"],
+        "user_prompt_template": settings["user_prompt_template"],
+        "post_text": original_text,
+    }
+
+
+def post_chat_completion(settings, user_prompt, timeout=None, stream=False):
+    """
+    OpenRouterのchat/completionsにリクエストを送信してレスポンスを返す
+    429・5xxはRetry-Afterに従って再試行し、それでも失敗した場合は最後のレスポンスを返す
+    stream=Trueの場合はストリーミング（SSE）で応答を要求し、本文を読まずにレスポンスを返す
+    """
     # オープンルーターAPIエンドポイント
-    url = "https://openrouter.ai/api/v1/chat/completions"
+    url = f"{OPENROUTER_API_BASE}/chat/completions"
 
     # リクエストヘッダー
-    headers = {"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"}
+    headers = {
+        "Authorization": f"Bearer {settings['api_key']}",
+        "Content-Type": "application/json",
+    }
 
     # リクエストボディ
     data = {
-        "model": model,
+        "model": settings["model"],
         "messages": [
             {
                 "role": "system",
-                "content": system_prompt,
+                "content": settings["system_prompt"],
             },
             {
                 "role": "user",
@@ -142,9 +337,344 @@ def rewrite_text_with_ai(original_text):
         ],
     }
 
+    if stream:
+        data["stream"] = True
+
+    return rate_limiter.request_with_retry(
+        "POST", url, headers=headers, json=data, timeout=timeout, stream=stream
+    )
+
+
+def extract_response_content(response_data):
+    """APIレスポンスからAIの応答テキストを取り出す（形式が不明な場合はNone）"""
+    if "choices" in response_data and response_data["choices"]:
+        # 従来の形式
+        return response_data["choices"][0]["message"]["content"].strip()
+    if "data" in response_data and response_data["data"]:
+        # 代替の形式1
+        return response_data["data"][0]["content"].strip()
+    if "response" in response_data:
+        # 代替の形式2
+        return response_data["response"].strip()
+
+    # レスポンス形式が判断できない場合
+    print("API レスポンスの構造が変更されています。完全なレスポンス:")
+    print(json.dumps(response_data, indent=2, ensure_ascii=False))
+    return None
+
+
+def is_usable_line(line):
+    """
+    extract_rewritten_textで投稿テキストとして使われる日本語の行かどうか（ストリーミングの打ち切り判定用）
+    見出し・リスト・例示・解説の行は使われないため数えない
+    """
+    line = line.strip()
+    if not line or line in ["---", "***", "___"]:
+        return False
+    if re.match(
+        r"^(#+ |\d+\.\s|[•*\-]\s|例:|例：|ツイート例|投稿例|以下のような|"
+        r"これは|ここで|このツイート|この投稿|解説：)",
+        line,
+    ):
+        return False
+    return re.search(r"[ぁ-んァ-ン一-龥]", line) is not None
+
+
+def stream_chat_completion(settings, user_prompt, timeout=None):
+    """
+    ストリーミング（SSE）でAIの応答を受信し、投稿に使える日本語の行が揃った時点で受信を打ち切る
+    打ち切りの判定は改行まで届いた行だけで行い、返すテキストも最後の改行までとする
+    戻り値: (応答テキスト, 途中で打ち切ったかどうか)（APIエラーの場合は(None, False)）
+    """
+    response = post_chat_completion(settings, user_prompt, timeout, stream=True)
+    try:
+        if response.status_code != 200:
+            print(f"APIエラー: {response.status_code} - {response.text[:500]}")
+            return None, False
+
+        text = ""
+        checked = 0  # 判定済みの位置（改行の直後）
+        usable_lines = []
+        in_code_block = False
+        for raw_line in response.iter_lines():
+            # 空行やコメント行（: OPENROUTER PROCESSING など）は読み飛ばす
+            line = raw_line.decode("utf-8")
+            if not line.startswith("data:"):
+                continue
+            payload = line[len("data:") :].strip()
+            if payload == "[DONE]":
+                break
+            try:
+                choices = json.loads(payload).get("choices") or []
+            except ValueError:
+                continue
+            if not choices:
+                continue
+            text += (choices[0].get("delta") or {}).get("content") or ""
+
+            # 改行まで届いた行を判定する
+            while "\n" in text[checked:]:
+                end = text.index("\n", checked)
+                completed_line = text[checked:end]
+                checked = end + 1
+
+                if completed_line.strip().startswith("```"):
+                    in_code_block = not in_code_block
+                    continue
+                if in_code_block:
+                    continue
+
+                if is_usable_line(completed_line):
+                    usable_lines.append(completed_line.strip())
+                    usable_chars = len(" ".join(usable_lines))
+                    if (
+                        len(usable_lines) >= STREAM_MAX_LINES
+                        or usable_chars >= STREAM_MAX_CHARS
+                    ):
+                        return text[:checked], True
+                elif (
+                    completed_line.strip()
+                    and usable_lines
+                    and len(" ".join(usable_lines)) >= STREAM_MIN_CHARS
+                ):
+                    # 日本語の投稿文が終わり、補足説明などが始まった
+                    return text[:checked], True
+
+        return text, False
+    finally:
+        # 途中で打ち切った場合も接続を閉じて生成を止める
+        response.close()
+
+
+def is_acceptable_response(raw_text):
+    """
+    AIの応答に、extract_rewritten_textで投稿テキストとして使われる日本語の行が含まれるかどうか
+    （含まれない場合はフォールバックテキストになるため、ヘッジリクエストでは採用しない）
+    """
+    if not raw_text:
+        return False
+    text = re.sub(r"```.*?```", "", raw_text, flags=re.DOTALL)
+    usable_text = "".join(line for line in text.split("\n") if is_usable_line(line))
+    return len(usable_text.strip()) >= 5
+
+
+def load_rewrite_latencies():
+    """モデルごとの直近の所要時間を返す（初回のみREWRITE_LATENCY_FILEから読み込む）"""
+    global rewrite_latencies
+    with rewrite_latencies_lock:
+        if rewrite_latencies is not None:
+            return rewrite_latencies
+        rewrite_latencies = {}
+        if os.path.exists(REWRITE_LATENCY_FILE):
+            with open(REWRITE_LATENCY_FILE, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue
+                    for entry in record.get("models", []):
+                        add_rewrite_latency(entry)
+        return rewrite_latencies
+
+
+def add_rewrite_latency(entry):
+    """
+    モデルの所要時間を直近の記録に追加する（rewrite_latencies_lockを取得した状態で呼ぶ）
+    応答が届く前に他のモデルを採用した場合の経過時間は実際の所要時間より短く、
+    遅延の分布を低く見積もってしまうため使わない（ファイルには記録する）
+    """
+    if entry.get("latency") is None or entry.get("status") == "unfinished":
+        return
+    latencies = rewrite_latencies.setdefault(
+        entry["model"], deque(maxlen=HEDGE_HISTORY_SIZE)
+    )
+    latencies.append(entry["latency"])
+
+
+def hedge_delay(model):
+    """予備のモデルを起動するまでの待ち時間（秒）"""
+    latencies = sorted(load_rewrite_latencies().get(model, []))
+    if len(latencies) < HEDGE_MIN_SAMPLES:
+        return float(os.getenv("OPENROUTER_HEDGE_DELAY", DEFAULT_HEDGE_DELAY))
+
+    percentile = float(
+        os.getenv("OPENROUTER_HEDGE_PERCENTILE", DEFAULT_HEDGE_PERCENTILE)
+    )
+    # 最近接順位法でパーセンタイル値を求める
+    rank = max(1, -(-len(latencies) * percentile // 100))
+    return latencies[min(len(latencies), int(rank)) - 1]
+
+
+def record_rewrite_latency(winner, entries, elapsed):
+    """ヘッジリクエストの結果（採用したモデルと各モデルの所要時間）を記録する"""
+    record = {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "winner": winner,
+        "elapsed": round(elapsed, 3),
+        "models": entries,
+    }
+    load_rewrite_latencies()
+    with rewrite_latencies_lock:
+        for entry in entries:
+            add_rewrite_latency(entry)
+
+        # 直近HEDGE_HISTORY_SIZE件だけを残して書き直す
+        lines = []
+        if os.path.exists(REWRITE_LATENCY_FILE):
+            with open(REWRITE_LATENCY_FILE, "r", encoding="utf-8") as f:
+                lines = [line for line in f if line.strip()]
+        lines.append(json.dumps(record, ensure_ascii=False) + "\n")
+
+        directory = os.path.dirname(REWRITE_LATENCY_FILE)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        temp_path = f"{REWRITE_LATENCY_FILE}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            f.writelines(lines[-HEDGE_HISTORY_SIZE:])
+        os.replace(temp_path, REWRITE_LATENCY_FILE)
+
+
+def request_model_rewrite(settings, user_prompt, timeout, results):
+    """1つのモデルにリライトを依頼し、(モデル, AIの応答, 所要時間)をresultsに入れる"""
+    start = time.perf_counter()
+    raw_text = None
+    try:
+        response = post_chat_completion(settings, user_prompt, timeout)
+        if response.status_code == 200:
+            raw_text = extract_response_content(response.json())
+        else:
+            print(
+                f"{settings['model']}のAPIエラー: {response.status_code} - "
+                f"{response.text[:500]}"
+            )
+    except Exception as e:
+        print(f"{settings['model']}のリライト処理エラー: {e}")
+    results.put((settings["model"], raw_text, time.perf_counter() - start))
+
+
+def hedged_chat_completion(settings, user_prompt, timeout=None):
+    """
+    主モデルにリクエストを送り、hedge_delay秒以内に応答がなければ予備のモデルにも同じリクエストを送って、
+    先に投稿に使える応答を返したモデルの結果を採用する（エラーや使えない応答の場合はすぐ次のモデルを起動する）
+    採用しなかったリクエストは待たずに放置する（終了を待たないようデーモンスレッドで送信する）
+    戻り値: (AIの応答, 採用したモデル)（すべてのモデルで失敗した場合は(None, None)）
+    """
+    models = [settings["model"]] + [
+        model for model in HEDGE_MODELS if model != settings["model"]
+    ]
+    results = queue.Queue()
+    started = {}
+    entries = {}
+    winner = None
+    raw_text = None
+    start = time.perf_counter()
+
+    def launch(model):
+        started[model] = time.perf_counter()
+        threading.Thread(
+            target=request_model_rewrite,
+            args=(dict(settings, model=model), user_prompt, timeout, results),
+            daemon=True,
+        ).start()
+
+    launch(models[0])
+    while len(entries) < len(started):
+        # 起動していないモデルが残っていれば、最後に起動したモデルの待ち時間が過ぎるまで応答を待つ
+        wait = None
+        if len(started) < len(models):
+            last_model = models[len(started) - 1]
+            wait = max(
+                0.0, started[last_model] + hedge_delay(last_model) - time.perf_counter()
+            )
+        try:
+            model, text, latency = results.get(timeout=wait)
+        except queue.Empty:
+            next_model = models[len(started)]
+            print(
+                f"{wait:.1f}秒以内に応答がないため、{next_model}にもリクエストを送ります"
+            )
+            launch(next_model)
+            continue
+
+        ok = is_acceptable_response(text)
+        entries[model] = {
+            "model": model,
+            "latency": round(latency, 3),
+            "status": "ok" if ok else "failed",
+        }
+        if ok:
+            winner, raw_text = model, text
+            break
+
+        print(f"{model}から投稿に使える応答が得られませんでした")
+        if len(started) < len(models):
+            launch(models[len(started)])
+
+    # 応答を待たなかったモデルは、その時点までの経過時間を記録する
+    now = time.perf_counter()
+    for model, started_at in started.items():
+        entries.setdefault(
+            model,
+            {
+                "model": model,
+                "latency": round(now - started_at, 3),
+                "status": "unfinished",
+            },
+        )
+
+    record_rewrite_latency(winner, [entries[model] for model in started], now - start)
+    return raw_text, winner
+
+
+def rewrite_text_with_ai(original_text, timeout=None):
+    """
+    オープンルーターAPIを使用して投稿テキストをリライトする
+    timeout: APIの(接続, 読み込み)タイムアウト秒数（省略時はhttp_transportの既定値）
+    """
+    settings = load_openrouter_settings()
+
+    print(f"使用するAIモデル: {settings['model']}")
+
+    # 同じモデル・プロンプト・元テキストで以前リライトしていれば、キャッシュした応答を使う
+    cache_params = rewrite_cache_params(settings, original_text)
+    cached_variants = load_rewrite_variants(cache_params)
+    if len(cached_variants) >= REWRITE_CACHE_VARIANTS:
+        print("キャッシュ済みのAI応答を使用します（API呼び出しなし）")
+        return extract_rewritten_text(random.choice(cached_variants), original_text)
+
+    # ユーザープロンプトにテキストを挿入
+    user_prompt = settings["user_prompt_template"].format(text=original_text)
+
     try:
-        # リクエスト送信
-        response = requests.post(url, headers=headers, json=data)
+        if STREAM_REWRITES:
+            # ストリーミングで受信し、投稿に使える日本語テキストが揃った時点で打ち切る
+            raw_text, cut_off = stream_chat_completion(settings, user_prompt, timeout)
+            if not raw_text:
+                print("APIエラーのため、フォールバックテキストを使用します")
+                return extract_rewritten_text("", original_text)
+
+            print(
+                f"ストリーミングで{len(raw_text)}文字を受信しました"
+                + ("（必要な分が揃ったため途中で打ち切りました）" if cut_off else "")
+            )
+            save_rewrite_variants(cache_params, cached_variants, [raw_text])
+            return extract_rewritten_text(raw_text, original_text)
+
+        if HEDGE_MODELS:
+            # 主モデルの応答が遅ければ予備のモデルにも送り、先に使える応答を返したほうを採用する
+            raw_text, winner = hedged_chat_completion(settings, user_prompt, timeout)
+            if not raw_text:
+                print(
+                    "すべてのモデルで失敗したため、フォールバックテキストを使用します"
+                )
+                return extract_rewritten_text("", original_text)
+
+            print(f"{winner}の応答を採用しました")
+            save_rewrite_variants(cache_params, cached_variants, [raw_text])
+            return extract_rewritten_text(raw_text, original_text)
+
+        # リクエスト送信（429・5xxはRetry-Afterに従って再試行し、それでも失敗すればフォールバック）
+        response = post_chat_completion(settings, user_prompt, timeout)
 
         # デバッグ情報として生のレスポンスを出力
         print(f"API レスポンスステータス: {response.status_code}")
@@ -158,24 +688,15 @@ def rewrite_text_with_ai(original_text):
             print(f"レスポンスのキー: {list(response_data.keys())}")
 
             # 応答データ構造の確認と処理
-            if "choices" in response_data and response_data["choices"]:
-                # 従来の形式
-                raw_text = response_data["choices"][0]["message"]["content"].strip()
-            elif "data" in response_data and response_data["data"]:
-                # 代替の形式1
-                raw_text = response_data["data"][0]["content"].strip()
-            elif "response" in response_data:
-                # 代替の形式2
-                raw_text = response_data["response"].strip()
-            else:
-                # レスポンス形式が判断できない場合
-                print("API レスポンスの構造が変更されています。完全なレスポンス:")
-                print(json.dumps(response_data, indent=2, ensure_ascii=False))
-
+            raw_text = extract_response_content(response_data)
+            if raw_text is None:
                 # エラーではなく、フォールバックテキストを使用する
                 print("レスポンス形式が不明なため、フォールバックテキストを使用します")
                 return extract_rewritten_text("", original_text)
 
+            # 次回以降のためにAIの応答をキャッシュ
+            save_rewrite_variants(cache_params, cached_variants, [raw_text])
+
             # デバッグ出力
             print("AIのレスポンス（処理前）:")
             print(raw_text[:100] + "..." if len(raw_text) > 100 else raw_text)
@@ -191,11 +712,9 @@ def rewrite_text_with_ai(original_text):
                 else rewritten_text
             )
 
-            # レート制限を回避するための待機
-            time.sleep(1)
             return rewritten_text
         elif response.status_code == 429:
-            # クォータ超過エラー
+            # クォータ超過エラー（再試行しても解除されなかった場合）
             print(
                 "APIクォータ超過エラー（429）が発生しました。フォールバックテキストを使用します。"
             )
@@ -215,184 +734,428 @@ def rewrite_text_with_ai(original_text):
         return extract_rewritten_text("", original_text)
 
 
+def build_batch_prompt(user_prompt_template, original_texts):
+    """複数件の元テキストを1つのユーザープロンプトにまとめる（idは0始まりの位置）"""
+    items = [{"id": i, "text": text} for i, text in enumerate(original_texts)]
+    return BATCH_PROMPT_TEMPLATE.format(
+        count=len(items),
+        instruction=user_prompt_template.format(text="（各投稿テキスト）"),
+        items=json.dumps(items, ensure_ascii=False, indent=1),
+    )
+
+
+def parse_batch_response(content):
+    """
+    まとめてリライトしたAIの応答（JSON配列）をidごとの応答テキストに分解する
+    戻り値: {id: テキスト}（解析できなかった項目は含まれない）
+    """
+    # コードブロックや前置きが付いていても、最初の[から最後の]までを配列として読む
+    start = content.find("[")
+    end = content.rfind("]")
+    if start < 0 or end <= start:
+        return {}
+    try:
+        entries = json.loads(content[start : end + 1])
+    except ValueError:
+        return {}
+    if not isinstance(entries, list):
+        return {}
+
+    results = {}
+    for entry in entries:
+        if not isinstance(entry, dict):
+            continue
+        text = entry.get("text")
+        try:
+            item_id = int(entry.get("id"))
+        except (TypeError, ValueError):
+            continue
+        if isinstance(text, str) and text.strip():
+            results[item_id] = text.strip()
+    return results
+
+
+def rewrite_texts_with_ai(original_texts, timeout=None):
+    """
+    複数の投稿テキストを1回のAPIリクエストでまとめてリライトする
+    システムプロンプトと指示は1回だけ送信し、結果はJSON配列で受け取ってidごとに分解する
+    キャッシュ済みの項目はAPIに送らず、応答を解析できなかった項目は1件ずつリライトし直す
+    戻り値: リライト後の投稿テキストのリスト（original_textsと同じ順）
+    """
+    settings = load_openrouter_settings()
+
+    rewritten_texts = [None] * len(original_texts)
+    pending = []
+    for index, original_text in enumerate(original_texts):
+        cache_params = rewrite_cache_params(settings, original_text)
+        cached_variants = load_rewrite_variants(cache_params)
+        if len(cached_variants) >= REWRITE_CACHE_VARIANTS:
+            rewritten_texts[index] = extract_rewritten_text(
+                random.choice(cached_variants), original_text
+            )
+        else:
+            pending.append((index, cache_params, cached_variants))
+
+    if len(pending) == 1:
+        # 1件だけなら通常のリライトと同じ
+        index = pending[0][0]
+        rewritten_texts[index] = rewrite_text_with_ai(original_texts[index], timeout)
+        return rewritten_texts
+
+    parsed = {}
+    if pending:
+        print(
+            f"{len(pending)}件をまとめてリライトします（使用するAIモデル: {settings['model']}）"
+        )
+        user_prompt = build_batch_prompt(
+            settings["user_prompt_template"],
+            [original_texts[index] for index, _, _ in pending],
+        )
+        try:
+            response = post_chat_completion(settings, user_prompt, timeout)
+            if response.status_code == 200:
+                content = extract_response_content(response.json())
+                parsed = parse_batch_response(content or "")
+            else:
+                print(f"APIエラー: {response.status_code} - {response.text[:500]}")
+        except Exception as e:
+            print(f"まとめてリライトする処理でエラーが発生しました: {e}")
+
+    fallback_count = 0
+    for position, (index, cache_params, cached_variants) in enumerate(pending):
+        raw_text = parsed.get(position)
+        if raw_text is None:
+            # 解析できなかった項目は1件ずつリライトし直す
+            fallback_count += 1
+            rewritten_texts[index] = rewrite_text_with_ai(
+                original_texts[index], timeout
+            )
+            continue
+
+        save_rewrite_variants(cache_params, cached_variants, [raw_text])
+        rewritten_texts[index] = extract_rewritten_text(raw_text, original_texts[index])
+
+    if fallback_count:
+        print(
+            f"{fallback_count}/{len(pending)}件はまとめた応答を解析できなかったため、"
+            "1件ずつリライトしました"
+        )
+    return rewritten_texts
+
+
+def weighted_length(text):
+    """Xの文字数の数え方（半角は1、全角・絵文字は2）でテキストの長さを返す"""
+    length = 0
+    for char in text:
+        code = ord(char)
+        if (
+            code <= 0x10FF
+            or 0x2000 <= code <= 0x200D
+            or 0x2010 <= code <= 0x201F
+            or 0x2032 <= code <= 0x2037
+        ):
+            length += 1
+        else:
+            length += 2
+    return length
+
+
+def score_candidate(text):
+    """
+    リライト案を評価する（高いほど良い）
+    URLを付けてもXの文字数制限に収まること、途中で切り詰められていないこと、
+    本文が理想の長さに近いことを評価する
+    """
+    body = text.split("\n\n")[0]
+    score = -abs(len(body) - IDEAL_CANDIDATE_LENGTH)
+
+    # URLは改行を挟んで末尾に付く
+    if weighted_length(text) + 1 + X_URL_LENGTH > X_MAX_WEIGHTED_LENGTH:
+        score -= 1000
+
+    # extract_rewritten_textで長すぎて切り詰められた本文
+    if "…" in body[-3:] and len(body) > 120:
+        score -= 100
+
+    return score
+
+
+def rewrite_candidates_with_ai(original_text, count, timeout=None):
+    """
+    1回のAPIリクエストで複数のリライト案を作成し、評価の高い順に並べて返す
+    キャッシュに十分な数の応答があればAPIを呼ばずにそれを使う
+    案を1つも取り出せなかった場合は通常の1件のリライトの結果だけを返す
+    """
+    settings = load_openrouter_settings()
+    cache_params = rewrite_cache_params(settings, original_text)
+    cached_variants = load_rewrite_variants(cache_params)
+
+    if len(cached_variants) >= count:
+        print("キャッシュ済みのAI応答からリライト案を作成します（API呼び出しなし）")
+        raw_texts = random.sample(cached_variants, count)
+    else:
+        print(
+            f"リライト案を{count}件作成します（使用するAIモデル: {settings['model']}）"
+        )
+        skeleton = json.dumps(
+            [{"id": i, "text": "リライト案"} for i in range(count)],
+            ensure_ascii=False,
+        )
+        user_prompt = CANDIDATES_PROMPT_TEMPLATE.format(
+            count=count,
+            instruction=settings["user_prompt_template"].format(text=original_text),
+            skeleton=skeleton,
+        )
+        parsed = {}
+        try:
+            response = post_chat_completion(settings, user_prompt, timeout)
+            if response.status_code == 200:
+                content = extract_response_content(response.json())
+                parsed = parse_batch_response(content or "")
+            else:
+                print(f"APIエラー: {response.status_code} - {response.text[:500]}")
+        except Exception as e:
+            print(f"リライト案の作成でエラーが発生しました: {e}")
+
+        # 日本語を含まない案はextract_rewritten_textでフォールバック文になるため使わない
+        raw_texts = [
+            text
+            for _, text in sorted(parsed.items())
+            if re.search(r"[ぁ-んァ-ン一-龥]", text)
+        ]
+        if not raw_texts:
+            print("リライト案を取り出せなかったため、通常のリライトを行います")
+            return [rewrite_text_with_ai(original_text, timeout)]
+
+        save_rewrite_variants(cache_params, cached_variants, raw_texts)
+
+    candidates = []
+    for raw_text in raw_texts:
+        candidate = extract_rewritten_text(raw_text, original_text)
+        if candidate not in candidates:
+            candidates.append(candidate)
+
+    candidates.sort(key=score_candidate, reverse=True)
+    print(
+        f"リライト案{len(candidates)}件を評価しました（最高点: {score_candidate(candidates[0])}）"
+    )
+    return candidates
+
+
+# AIの応答から除去する表現のルール（上から順に適用する）
+# (コンパイル済みの正規表現, 置換後の文字列, 一致に必要な文字列のいずれか)
+# 必要な文字列がどれもテキストに含まれなければ一致しないため、正規表現の実行を省く
+# 削除で前後の文字がつながって次のルールに一致することがあるため、複数のルールを1つの正規表現にはまとめない
+YEN_AMOUNT_RULE = (re.compile(r"\d{1,3}(,\d{3})*円"), "", ("円",))
+YEN_SIGN_RULE = (re.compile(r"¥\d{1,3}(,\d{3})*"), "", ("¥",))
+YEN_PHRASE_RULE = (re.compile(r"[\d,.]+円[でにはが]"), "", ("円",))
+
+RESPONSE_CLEANUP_RULES = [
+    # マークダウン形式のヘッダー (# や ## で始まる行)
+    (re.compile(r"^#+ .*$", re.MULTILINE), "", ("# ",)),
+    # マークダウンの強調表示 (**text** や *text*)
+    (re.compile(r"\*\*(.*?)\*\*"), r"\1", ("**",)),
+    (re.compile(r"\*(.*?)\*"), r"\1", ("*",)),
+    # マークダウン形式のリスト（数字や記号で始まる行）
+    (re.compile(r"^\d+\.\s.*$", re.MULTILINE), "", (".",)),
+    (re.compile(r"^[•*\-]\s.*$", re.MULTILINE), "", ("•", "*", "-")),
+    # コード部分やマークダウンブロック
+    (re.compile(r"```.*?```", re.DOTALL), "", ("```",)),
+    # 金額に関する表現（例：100円、1,000円、¥500など）
+    YEN_AMOUNT_RULE,
+    YEN_SIGN_RULE,
+    (re.compile(r"\d+(円|万円|千円)"), "", ("円",)),
+    # 金額を含む文章パターン（「〜円で」などの表現）
+    YEN_PHRASE_RULE,
+    (re.compile(r"コスパ[がは]?[良最高]"), "", ("コスパ",)),
+    # 価格に関連する表現
+    (re.compile(r"(お買い得|格安|安い|高い|値段|料金|価格)"), "", None),
+]
+
+# 抽出したテキストに金額情報が残っていないか最後に確認するルール
+PRICE_RECHECK_RULES = [YEN_AMOUNT_RULE, YEN_SIGN_RULE, YEN_PHRASE_RULE]
+
+# 投稿テキストとして使わない行（例示・解説）の先頭
+EXCLUDED_LINE_PATTERN = re.compile(
+    r"^(例:|例：|ツイート例|投稿例|以下のような|これは|ここで|このツイート|この投稿|解説：)"
+)
+
+# マークダウンの区切り線
+SEPARATOR_LINES = ("---", "***", "___")
+
+JAPANESE_PATTERN = re.compile(r"[ぁ-んァ-ン一-龥]")
+TITLE_PATTERN = re.compile(r"『(.+?)』")
+EMOJI_PATTERN = re.compile(r"[😍😳🔥💦❤️]")
+EMOJI_OR_SPACE_PATTERN = re.compile(r"[😍😳🔥💦❤️\s]")
+
+# タイトルやテキストから選べなかった場合のハッシュタグ候補
+HASHTAG_CANDIDATES = [
+    "#官能",
+    "#ファンタジー",
+    "#背徳感",
+    "#ドキドキ",
+    "#興奮",
+    "#ハーレム",
+    "#アダルト",
+    "#エロマンガ",
+    "#成人向け",
+    "#エロ漫画",
+    "#おすすめ",
+    "#人気",
+    "#新刊",
+    "#BL",
+    "#GL",
+    "#TL",
+    "#マンガ",
+    "#漫画",
+    "#コミック",
+    "#妄想",
+    "#大人の時間",
+    "#フェチ",
+    "#ギャル",
+    "#美少女",
+    "#エッチ",
+    "#読書",
+    "#電子書籍",
+    "#濡れる",
+    "#おうち時間",
+    "#熱い",
+]
+
+# タイトルに含まれる語とハッシュタグの辞書ファイル（環境変数HASHTAG_KEYWORDS_FILEで変更可能）
+# {"keyword": 語, "hashtag": ハッシュタグ, "priority": 優先度}のJSON配列
+# タイトルに複数の語が含まれる場合は優先度が大きいもの、同じ場合はファイル内で先にあるものを使う
+HASHTAG_KEYWORDS_FILE = "hashtag_keywords.json"
+
+# タイトルから選ぶハッシュタグの最大数（環境変数HASHTAG_MAX_TAGSで変更可能）
+DEFAULT_HASHTAG_MAX_TAGS = 1
+
+# ハッシュタグ辞書の照合用オートマトン（初回使用時に作成し、以降は使い回す）
+hashtag_matcher = None
+hashtag_matcher_lock = threading.Lock()
+
+# 日本語テキストが見つからなかった場合のフォールバックテキスト
+FALLBACK_TEXTS = [
+    "これマジでヤバい内容…見た瞬間興奮が止まらない😳",
+    "背徳感すごいのに目が離せない…こんなの反則だろ🔥",
+    "見てるだけで羨ましすぎる…最高かよ😍",
+    "こんな展開待ってた！超興奮する内容でヤバい😳",
+    "私の理性が崩壊しそう…こんな濃厚な展開ヤバすぎ💦",
+    "これ見た瞬間に我慢できなくなって即買いしたわw🔥",
+    "急にこんなシチュエーションになるとか反則すぎる…💦",
+]
+
+# 絵文字がない場合に追加する絵文字
+EMOJI_OPTIONS = ["😳", "😍", "🔥", "💦", "❤️"]
+
+
+def apply_rules(text, rules):
+    """ルールを順に適用する（必要な文字列を含まないルールは正規表現を実行せずに飛ばす）"""
+    for pattern, replacement, required in rules:
+        if required and not any(literal in text for literal in required):
+            continue
+        text = pattern.sub(replacement, text)
+    return text
+
+
+def load_hashtag_matcher():
+    """ハッシュタグ辞書を読み込んで照合用のオートマトンを返す（初回のみ作成し、以降は使い回す）"""
+    global hashtag_matcher
+    with hashtag_matcher_lock:
+        if hashtag_matcher is not None:
+            return hashtag_matcher
+
+        path = os.getenv("HASHTAG_KEYWORDS_FILE", HASHTAG_KEYWORDS_FILE)
+        entries = []
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                entries = json.load(f)
+        else:
+            print(f"警告: ハッシュタグ辞書 {path} が見つかりません")
+
+        hashtag_matcher = KeywordMatcher(
+            [
+                (entry["keyword"], entry["hashtag"], entry.get("priority", 0))
+                for entry in entries
+            ]
+        )
+        return hashtag_matcher
+
+
+def select_hashtags(text, original_text):
+    """
+    投稿に付けるハッシュタグを選ぶ
+    元テキストの『』内のタイトルから辞書で選び（最大HASHTAG_MAX_TAGS件）、
+    選べなければAIの応答の内容、それもなければランダムに1つ選ぶ
+    """
+    if original_text:
+        title_match = TITLE_PATTERN.search(original_text)
+        if title_match:
+            max_tags = int(os.getenv("HASHTAG_MAX_TAGS", DEFAULT_HASHTAG_MAX_TAGS))
+            tags = load_hashtag_matcher().select(title_match.group(1), max_tags)
+            if tags:
+                return tags
+
+    if "BL" in text:
+        return ["#BL"]
+    if "百合" in text or "GL" in text:
+        return ["#GL"]
+    if "TL" in text:
+        return ["#TL"]
+    return [random.choice(HASHTAG_CANDIDATES)]
+
+
 def extract_rewritten_text(text, original_text=None):
     """
     AIの応答から実際のリライト結果だけを抽出する
     思考プロセスや英語の分析を除去し、日本語の投稿テキストのみを返す
     特に「羨ましすぎる」「背徳感やばい」などのカジュアルな表現を優先的に抽出する
     """
-    import re
-    import random
-
     # ログ出力（デバッグ用）
     print(f"元のAI応答テキスト:\n{text}")
 
-    # マークダウン形式のヘッダーを削除 (# や ## で始まる行)
-    text = re.sub(r"^#+ .*$", "", text, flags=re.MULTILINE)
-
-    # マークダウンの強調表示を削除 (**text** や *text*)
-    text = re.sub(r"\*\*(.*?)\*\*", r"\1", text)
-    text = re.sub(r"\*(.*?)\*", r"\1", text)
-
-    # マークダウン形式のリスト（数字や記号で始まる行）を検出して除去
-    text = re.sub(r"^\d+\.\s.*$", "", text, flags=re.MULTILINE)  # 数字リスト
-    text = re.sub(r"^[•*\-]\s.*$", "", text, flags=re.MULTILINE)  # 記号リスト
-
-    # コード部分やマークダウンブロックを除去
-    text = re.sub(r"```.*?```", "", text, flags=re.DOTALL)
-
-    # 金額に関する表現を削除（例：100円、1,000円、¥500など）
-    text = re.sub(r'\d{1,3}(,\d{3})*円', '', text)
-    text = re.sub(r'¥\d{1,3}(,\d{3})*', '', text)
-    text = re.sub(r'\d+(円|万円|千円)', '', text)
-    
-    # 金額を含む文章パターンを削除（「〜円で」などの表現）
-    text = re.sub(r'[\d,.]+円[でにはが]', '', text)
-    text = re.sub(r'コスパ[がは]?[良最高]', '', text)
-    
-    # 価格に関連する表現を削除
-    text = re.sub(r'(お買い得|格安|安い|高い|値段|料金|価格)', '', text)
-
-    # ハッシュタグ候補を用意
-    hashtag_candidates = [
-        "#官能",
-        "#ファンタジー",
-        "#背徳感",
-        "#ドキドキ",
-        "#興奮",
-        "#ハーレム",
-        "#アダルト",
-        "#エロマンガ",
-        "#成人向け",
-        "#エロ漫画",
-        "#おすすめ",
-        "#人気",
-        "#新刊",
-        "#BL",
-        "#GL",
-        "#TL",
-        "#マンガ",
-        "#漫画",
-        "#コミック",
-        "#妄想",
-        "#大人の時間",
-        "#フェチ",
-        "#ギャル",
-        "#美少女",
-        "#エッチ",
-        "#読書",
-        "#電子書籍",
-        "#濡れる",
-        "#おうち時間",
-        "#熱い",
-    ]
+    # マークダウン・コード・金額や価格に関する表現を除去
+    text = apply_rules(text, RESPONSE_CLEANUP_RULES)
 
-    # タイトルから適切なハッシュタグを選ぶ
-    title_keywords = {
-        "ハーレム": "#ハーレム",
-        "孕ませ": "#大人の時間",
-        "絶頂": "#エッチ",
-        "搾": "#フェチ",
-        "魔物": "#ファンタジー",
-        "触手": "#フェチ",
-        "女子校生": "#美少女",
-        "JK": "#美少女",
-        "妹": "#背徳感",
-        "姉": "#背徳感",
-        "先生": "#背徳感",
-        "義理": "#背徳感",
-        "学園": "#青春",
-        "ファンタジー": "#ファンタジー",
-        "ダンジョン": "#ファンタジー",
-        "メイド": "#美少女",
-        "巨乳": "#おっぱい",
-        "爆乳": "#おっぱい",
-        "BL": "#BL",
-        "GL": "#GL",
-        "TL": "#TL",
-    }
+    # タイトルまたは応答の内容からハッシュタグを選定
+    selected_hashtag = " ".join(select_hashtags(text, original_text))
 
-    # 原文からタイトルを抽出（後で使用）
-    title = ""
-    if original_text:
-        title_match = re.search(r"『(.+?)』", original_text)
-        if title_match:
-            title = title_match.group(1)
-
-    # タイトルからハッシュタグを選定
-    selected_hashtag = None
-    if title:
-        for keyword, tag in title_keywords.items():
-            if keyword in title:
-                selected_hashtag = tag
-                break
-
-    # タイトルから選べなかった場合は適切なカテゴリまたはランダム選択
-    if not selected_hashtag:
-        if "BL" in text:
-            selected_hashtag = "#BL"
-        elif "百合" in text or "GL" in text:
-            selected_hashtag = "#GL"
-        elif "TL" in text:
-            selected_hashtag = "#TL"
-        else:
-            selected_hashtag = random.choice(hashtag_candidates)
-
-    # AIのテキストから投稿用の文章を選択するロジック
-    # 明示的な指示や例の部分を取り除く
-    filtered_text = re.sub(r"^(例:|例：|ツイート例|投稿例|以下のような).*$", "", text, flags=re.MULTILINE)
-    
-    # 日本語テキスト部分を抽出
+    # 日本語テキスト部分を抽出（例示や解説の行は除く）
     japanese_lines = []
-    for line in filtered_text.split("\n"):
+    for line in text.split("\n"):
         # 空行やマークダウン記号のみの行をスキップ
-        if not line.strip() or line.strip() in ["---", "***", "___"]:
+        stripped = line.strip()
+        if not stripped or stripped in SEPARATOR_LINES:
             continue
-        # 明らかな解説や指示は除外
-        if re.match(r"^(これは|ここで|このツイート|この投稿|解説：)", line):
+        if EXCLUDED_LINE_PATTERN.match(line):
             continue
         # 日本語を含む行を抽出
-        if re.search(r"[ぁ-んァ-ン一-龥]", line):
-            japanese_lines.append(line.strip())
-    
+        if JAPANESE_PATTERN.search(line):
+            japanese_lines.append(stripped)
+
     # 日本語テキストが見つからなかった場合のフォールバック
     if not japanese_lines:
-        fallback_texts = [
-            "これマジでヤバい内容…見た瞬間興奮が止まらない😳",
-            "背徳感すごいのに目が離せない…こんなの反則だろ🔥",
-            "見てるだけで羨ましすぎる…最高かよ😍",
-            "こんな展開待ってた！超興奮する内容でヤバい😳",
-            "私の理性が崩壊しそう…こんな濃厚な展開ヤバすぎ💦",
-            "これ見た瞬間に我慢できなくなって即買いしたわw🔥",
-            "急にこんなシチュエーションになるとか反則すぎる…💦",
-        ]
-        final_text = random.choice(fallback_texts) + "…！"
+        final_text = random.choice(FALLBACK_TEXTS) + "…！"
     else:
-        # 変更点: カジュアルさを優先しつつも、テキストがより残るようにする
-        # 一旦全ての日本語テキストを連結（最大3行まで）
+        # カジュアルさを優先しつつも、テキストがより残るようにする（最大3行まで連結）
         main_text = " ".join(japanese_lines[:3])
-        
-        # 長すぎる場合は調整（最大120文字）- 以前の60文字から拡大
+
+        # 長すぎる場合は調整（最大120文字）
         if len(main_text) > 120:
             main_text = main_text[:120] + "…"
-        
+
         # 最終的に金額情報が含まれていないか再チェック
-        main_text = re.sub(r'\d{1,3}(,\d{3})*円', '', main_text)
-        main_text = re.sub(r'¥\d{1,3}(,\d{3})*', '', main_text)
-        main_text = re.sub(r'[\d,.]+円[でにはが]', '', main_text)
-        
-        final_text = main_text
+        final_text = apply_rules(main_text, PRICE_RECHECK_RULES)
 
     # 絵文字がなければ追加
-    if not re.search(r"[😍😳🔥💦❤️]", final_text):
-        emoji_options = ["😳", "😍", "🔥", "💦", "❤️"]
-        final_text += random.choice(emoji_options)
+    if not EMOJI_PATTERN.search(final_text):
+        final_text += random.choice(EMOJI_OPTIONS)
 
     # PRタグとハッシュタグを追加
     final_text = final_text.strip() + "\n\n" + selected_hashtag + " #PR"
 
     # 最終チェック - 空の投稿や絵文字だけの投稿にならないようにする
-    text_content = re.sub(r"[😍😳🔥💦❤️\s]", "", final_text)
+    text_content = EMOJI_OR_SPACE_PATTERN.sub("", final_text)
     if len(text_content) < 5:  # 実質的な内容が少なすぎる場合
         fallback = (
             "これヤバすぎる内容…興奮が止まらない😳\n\n" + selected_hashtag + " #PR"
@@ -406,208 +1169,507 @@ def extract_rewritten_text(text, original_text=None):
     return final_text
 
 
-def get_next_post_index():
+def rewrite_all_posts(result, output_path=REWRITTEN_POSTS_FILE, indices=None):
     """
-    次に処理すべき投稿のインデックスを取得する
+    選定した作品の投稿テキストを並列にリライトし、終わったものから順にJSON Linesで保存する
+    indices: リライトする作品のresult内の位置（省略時は全件）
+    OPENROUTER_BATCH_SIZE件ずつ1回のAPIリクエストにまとめ、まとめたリクエストを並列に送信する
+    同時実行数はOPENROUTER_REWRITE_WORKERS、1リクエストあたりのタイムアウトはOPENROUTER_REWRITE_TIMEOUTで変更可能
+    送信間隔はrate_limiterのOpenRouter用の制限に従う（OPENROUTER_RATE_LIMITで1秒あたりの上限を変更可能）
+    戻り値: リライト後の投稿テキストのリスト（resultと同じ順、リライトしなかった作品はNone）
     """
-    # 最後に処理した投稿のインデックスを保存するファイルのパス
-    index_file = "last_processed_index.txt"
+    if indices is None:
+        indices = list(range(len(result)))
+    max_workers = int(os.getenv("OPENROUTER_REWRITE_WORKERS", DEFAULT_REWRITE_WORKERS))
+    read_timeout = float(
+        os.getenv("OPENROUTER_REWRITE_TIMEOUT", DEFAULT_REWRITE_TIMEOUT)
+    )
+    timeout = (http_transport.CONNECT_TIMEOUT, read_timeout)
+    batch_size = max(
+        1, int(os.getenv("OPENROUTER_BATCH_SIZE", DEFAULT_REWRITE_BATCH_SIZE))
+    )
+    batches = [
+        indices[start : start + batch_size]
+        for start in range(0, len(indices), batch_size)
+    ]
 
-    # ファイルが存在する場合は内容を読み込む
-    if os.path.exists(index_file):
-        try:
-            with open(index_file, "r") as f:
-                last_index = int(f.read().strip())
-                return last_index + 1  # 次のインデックスを返す
-        except:
-            return 0  # エラーが発生した場合は最初から
-    else:
-        return 0  # ファイルがない場合は最初から
+    rate_limit = os.getenv("OPENROUTER_RATE_LIMIT")
+    if rate_limit:
+        host = urllib.parse.urlparse(OPENROUTER_API_BASE).hostname
+        rate_limiter.configure(host, float(rate_limit), max_workers)
+
+    print(
+        f"{len(indices)}件の投稿を{batch_size}件ずつまとめ、同時に{max_workers}リクエストずつ"
+        f"リライトします（タイムアウト {read_timeout:.0f}秒）"
+    )
+
+    start = time.perf_counter()
+    rewritten_texts = [None] * len(result)
+    with open(output_path, "w", encoding="utf-8") as f:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {
+                executor.submit(
+                    rewrite_texts_with_ai,
+                    [result[index]["post_text"] for index in batch],
+                    timeout,
+                ): batch
+                for batch in batches
+            }
+            done = 0
+            for future in as_completed(futures):
+                batch = futures[future]
+                for index, rewritten_text in zip(batch, future.result()):
+                    rewritten_texts[index] = rewritten_text
+
+                    # 途中で中断しても完了分が残るよう、終わったものから書き出す
+                    post = dict(result[index])
+                    post["index"] = index
+                    post["post_text"] = rewritten_text
+                    f.write(json.dumps(post, ensure_ascii=False) + "\n")
+                    done += 1
+                    print(f"リライト完了 {done}/{len(indices)}: {post['title']}")
+                f.flush()
+
+    elapsed = time.perf_counter() - start
+    print(
+        f"一括リライト完了: {len(indices)}件 / {elapsed:.1f}秒"
+        f"（結果は {output_path} に保存しました）"
+    )
+    return rewritten_texts
+
+
+def post_priority(row, position):
+    """
+    投稿キューでの優先度（小さいほど先に投稿する）
+    表示対象のランキングの順位を上限で割った値の最小値（ランキング外は2）、発売日の新しい順、選定結果内の順
+    """
+    score = 2
+    ranking_info = row.get("ranking_info")
+    if isinstance(ranking_info, dict):
+        for key, _, limit in RANKING_DISPLAY:
+            rank = ranking_info.get(key)
+            if isinstance(rank, (int, float)) and 0 < rank <= limit:
+                score = min(score, round(rank / limit, 4))
 
+    try:
+        released = datetime.strptime(str(row.get("date", ""))[:10], "%Y-%m-%d")
+        release_order = -released.toordinal()
+    except ValueError:
+        release_order = 0
 
-def save_processed_index(index):
+    return [score, release_order, position]
+
+
+def load_raw_manga_data():
     """
-    処理したインデックスを保存する
+    fetch_manga_data.pyが保存した生データを読み込む
+    JSON Lines形式（manga_data_raw.jsonl）を優先し、なければ旧形式のJSONを読み込む
     """
-    # 最後に処理した投稿のインデックスを保存するファイルのパス
-    index_file = "last_processed_index.txt"
+    if os.path.exists("manga_data_raw.jsonl"):
+        with open("manga_data_raw.jsonl", "r", encoding="utf-8") as f:
+            return [json.loads(line) for line in f if line.strip()]
 
-    # インデックスをファイルに保存
-    with open(index_file, "w") as f:
-        f.write(str(index))
+    with open("manga_data_raw.json", "r", encoding="utf-8") as f:
+        return json.load(f)
 
 
-def process_manga_data(process_single=True):
+def is_reservation(item, today):
+    """予約商品（発売日が今日より後）かどうかを判定する"""
+    date = item.get("date")
+    if date is None:
+        # date列がない場合は予約商品ではないと判定
+        return False
+    # 日付文字列から日付部分のみを取り出す（時間部分を除外）
+    return str(date).split(" ")[0] > today
+
+
+def extract_price(item):
+    """価格から数字だけを取り出して数値に変換する（取り出せない場合はNone）"""
+    prices = item.get("prices")
+    if isinstance(prices, dict) and "price" in prices:
+        digits = "".join(filter(str.isdigit, str(prices["price"])))
+        if digits:
+            return int(digits)
+    return None
+
+
+def contains_title_word(item, word):
+    """タイトルに指定の語を含むかどうか"""
+    title = item.get("title")
+    return title is not None and word in str(title)
+
+
+def is_fanza_exclusive(item):
+    """FANZA限定（独占）作品かどうか"""
+    url = item.get("URL")
+    return url is not None and ("exclusive" in str(url) or "独占" in str(url))
+
+
+def format_ranking(ranking_info):
+    """ランキング情報を「日間3位・週間10位」の形式にする（表示対象の順位のみ）"""
+    if not isinstance(ranking_info, dict):
+        return ""
+    ranking_text = []
+    for key, label, limit in RANKING_DISPLAY:
+        if key in ranking_info and ranking_info[key] <= limit:
+            ranking_text.append(f"{label}{ranking_info[key]}位")
+    return "・".join(ranking_text)
+
+
+def create_post_text(item, ranking_text, is_exclusive):
+    """投稿用テキストを作成する（URLは含めず、JSONの別フィールドとして保存する）"""
+    post_parts = [f"『{item.get('title', '')}』"]
+
+    # 作者
+    author = item.get("author") if "author" in item else item.get("artistName")
+    if author:
+        post_parts.append(f"作者: {author}")
+
+    # 特徴（新着・限定のみ表示）
+    features = ["🆕新着"]
+    if is_exclusive:
+        features.append("🔒FANZA限定")
+    post_parts.append("【" + "・".join(features) + "】")
+
+    # ランキング情報があれば表示
+    if ranking_text:
+        post_parts.append(f"📊ランキング: {ranking_text}")
+
+    # 価格
+    prices = item.get("prices")
+    if isinstance(prices, dict) and "price" in prices:
+        post_parts.append(f"💴価格: {prices['price']}円")
+
+    # ハッシュタグを本文の後に配置
+    post_parts.append("#PR")
+    return "\n".join(post_parts)
+
+
+def select_manga_records(manga_data, today=None):
     """
-    取得した漫画データを整形・選定
-    process_single: Trueの場合、次のインデックスの投稿1件だけをリライト
+    生データ（辞書のリスト）から投稿対象の作品を選定する（pandasを使わない通常の経路）
+    予約商品・400円未満・単話・ノベルを除いた新着作品に、ranking_textとpost_textを追加して返す
     """
-    try:
-        # 生データの読み込み
-        with open("manga_data_raw.json", "r", encoding="utf-8") as f:
-            manga_data = json.load(f)
+    if today is None:
+        today = datetime.now().strftime("%Y-%m-%d")
 
-        print(f"読み込んだデータ: {len(manga_data)}件")
+    # 予約商品を除外
+    released = [item for item in manga_data if not is_reservation(item, today)]
+
+    print(f"予約商品除外後: {len(released)}件")
+
+    # 新着作品から、400円未満と単話とノベルを除外
+    candidates = (
+        item
+        for item in released
+        if item.get("is_new") == True
+        and (extract_price(item) is None or extract_price(item) >= 400)
+        and not contains_title_word(item, "単話")
+        and not contains_title_word(item, "ノベル")
+    )
+
+    selected_manga = []
+    for item in candidates:
+        ranking_text = format_ranking(item.get("ranking_info"))
+        selected = dict(item)
+        selected["ranking_text"] = ranking_text
+        selected["post_text"] = create_post_text(
+            item, ranking_text, is_fanza_exclusive(item)
+        )
+        selected_manga.append(selected)
 
-        # データフレームに変換
-        df = pd.DataFrame(manga_data)
+    print(f"条件適合作品絞り込み完了: {len(selected_manga)}件")
+    return selected_manga
 
-        print("データフレーム作成完了")
 
-        # 必要なフラグを追加
-        df["is_fanza_exclusive"] = df["URL"].apply(
-            lambda x: "exclusive" in x or "独占" in str(x) if pd.notna(x) else False
-        )
+def get_nested_column(df, column, key):
+    """
+    辞書を格納した列（pricesやranking_infoなど）から指定キーの値を列として取り出す
+    列がない行・辞書でない行・キーがない行はNaN（またはNone）になる
+    """
+    import numpy as np
+    import pandas as pd
+
+    if column not in df:
+        return pd.Series(np.nan, index=df.index, dtype=object)
+    return df[column].astype(object).str.get(key)
+
+
+def contains_text(series, keyword):
+    """文字列を含むかどうかのフラグ列（欠損値はFalse）"""
+    return series.notna() & series.astype(str).str.contains(
+        keyword, regex=False, na=False
+    )
 
-        # 予約商品の除外（date列の日付が未来のもの）
+
+def select_manga(manga_data, today=None):
+    """
+    生データから投稿対象の作品を選定し、ランキング表示と投稿用テキストを追加したDataFrameを返す
+    フラグ・日付・価格・ランキングの判定はすべて列単位（ベクトル化）で行う
+    分析モード用（pandasはこの関数の呼び出し時に初めて読み込む）
+    """
+    import numpy as np
+    import pandas as pd
+
+    # データフレームに変換
+    df = pd.DataFrame(manga_data)
+
+    print("データフレーム作成完了")
+
+    # 必要なフラグを追加
+    url = df["URL"]
+    df["is_fanza_exclusive"] = url.notna() & url.astype(str).str.contains(
+        "exclusive|独占", na=False
+    )
+
+    # 予約商品の除外（date列の日付が未来のもの）
+    if today is None:
         today = datetime.now().strftime("%Y-%m-%d")
 
-        def is_reservation(row):
-            """予約商品かどうかを判定する関数"""
-            if "date" in row and pd.notna(row["date"]):
-                try:
-                    # 日付文字列から日付部分のみを取り出す（時間部分を除外）
-                    release_date = str(row["date"]).split(" ")[0]
-                    # 現在の日付と比較
-                    return release_date > today
-                except:
-                    # 日付解析エラーの場合は予約商品ではないと判定
-                    return False
-            # date列がない場合も予約商品ではないと判定
-            return False
+    if "date" in df:
+        # 日付文字列から日付部分のみを取り出し（時間部分を除外）、現在の日付と比較
+        release_date = df["date"].astype(str).str.split(" ", n=1).str[0]
+        df["is_reservation"] = df["date"].notna() & (release_date > today)
+    else:
+        # date列がない場合は予約商品ではないと判定
+        df["is_reservation"] = False
 
-        df["is_reservation"] = df.apply(is_reservation, axis=1)
-
-        print("予約商品判定完了")
-
-        # 価格を数値に変換する関数（400円未満の除外判定に使用）
-        def extract_price(row):
-            if (
-                "prices" in row
-                and isinstance(row["prices"], dict)
-                and "price" in row["prices"]
-            ):
-                try:
-                    # 価格から数字だけを取り出す
-                    price_str = str(row["prices"]["price"])
-                    price_num = int("".join(filter(str.isdigit, price_str)))
-                    return price_num
-                except:
-                    return None
-            return None
+    print("予約商品判定完了")
 
-        # 価格を数値に変換
-        df["price_value"] = df.apply(extract_price, axis=1)
+    # 価格から数字だけを取り出して数値に変換（400円未満の除外判定に使用）
+    price_digits = (
+        get_nested_column(df, "prices", "price")
+        .astype(str)
+        .str.replace(r"\D", "", regex=True)
+    )
+    df["price_value"] = pd.to_numeric(price_digits, errors="coerce")
 
-        print("価格抽出完了")
+    print("価格抽出完了")
 
-        # 条件に合致するかどうかをチェック
-        df["is_new"] = df.get("is_new", False)
-        df["is_exclusive"] = df["is_fanza_exclusive"]
+    # 条件に合致するかどうかをチェック
+    df["is_new"] = df.get("is_new", False)
+    df["is_exclusive"] = df["is_fanza_exclusive"]
 
-        # タイトルに「単話」を含むかどうかのフラグを追加
-        df["is_tankowa"] = df["title"].apply(
-            lambda x: "単話" in str(x) if pd.notna(x) else False
-        )
+    # タイトルに「単話」「ノベル」を含むかどうかのフラグを追加
+    df["is_tankowa"] = contains_text(df["title"], "単話")
+    df["is_novel"] = contains_text(df["title"], "ノベル")
+
+    print("単話・ノベル判定完了")
+
+    # 予約商品を除外
+    df = df[~df["is_reservation"]]
+
+    print(f"予約商品除外後: {len(df)}件")
 
-        # タイトルに「ノベル」を含むかどうかのフラグを追加
-        df["is_novel"] = df["title"].apply(
-            lambda x: "ノベル" in str(x) if pd.notna(x) else False
+    # 新着作品から、400円未満と単話とノベルを除外
+    selected_manga = df[
+        (df["is_new"] == True)
+        & ((df["price_value"].isnull()) | (df["price_value"] >= 400))
+        & (~df["is_tankowa"])
+        & (~df["is_novel"])
+    ].copy()
+
+    print(f"条件適合作品絞り込み完了: {len(selected_manga)}件")
+
+    # 以下、選定された作品のみに適用する処理（ランキング情報の表示は残す）
+    ranking_text = pd.Series("", index=selected_manga.index, dtype=object)
+    if "ranking_info" in selected_manga:
+        for key, label, limit in RANKING_DISPLAY:
+            rank = pd.to_numeric(
+                get_nested_column(selected_manga, "ranking_info", key),
+                errors="coerce",
+            )
+            rank_text = label + rank.fillna(0).astype("int64").astype(str) + "位・"
+            ranking_text = ranking_text + rank_text.where(rank <= limit, "")
+        # 各順位の末尾に付けた区切り文字のうち、最後のものを取り除く
+        ranking_text = ranking_text.str.rstrip("・")
+    selected_manga["ranking_text"] = ranking_text
+
+    # 投稿用テキスト作成（各行の要素を列ごとに組み立てて連結する）
+    post_text = "『" + selected_manga["title"].astype(str) + "』\n"
+
+    # 作者
+    author_column = None
+    if "author" in selected_manga:
+        author_column = "author"
+    elif "artistName" in selected_manga:
+        author_column = "artistName"
+    if author_column:
+        author = selected_manga[author_column]
+        author_part = "作者: " + author.astype(str) + "\n"
+        post_text = post_text + author_part.where(author.astype(bool), "")
+
+    # 特徴（新着・限定のみ表示）
+    is_new = selected_manga["is_new"].astype(bool)
+    is_exclusive = selected_manga["is_exclusive"].astype(bool)
+    features = np.select(
+        [is_new & is_exclusive, is_new, is_exclusive],
+        ["【🆕新着・🔒FANZA限定】\n", "【🆕新着】\n", "【🔒FANZA限定】\n"],
+        "",
+    )
+    post_text = post_text + features
+
+    # ランキング情報があれば表示
+    ranking_part = "📊ランキング: " + ranking_text + "\n"
+    post_text = post_text + ranking_part.where(ranking_text != "", "")
+
+    # 価格
+    price = get_nested_column(selected_manga, "prices", "price")
+    price_part = "💴価格: " + price.astype(str) + "円\n"
+    post_text = post_text + price_part.where(price.notna(), "")
+
+    # ハッシュタグを本文の後に配置
+    # URLはpost_textには含めない（JSONの別フィールドとして保存）
+    # アフィリエイトURLはリライト時にJSONから直接取得する
+    selected_manga["post_text"] = post_text + "#PR"
+
+    return selected_manga
+
+
+def analyze_manga_data():
+    """
+    分析モード: pandasで選定処理を行い、選定状況の集計を表示する（リライト・ファイル保存は行わない）
+    通常の選定処理（select_manga_records）と同じ作品が選ばれることもあわせて確認する
+    """
+    try:
+        manga_data = load_raw_manga_data()
+        print(f"読み込んだデータ: {len(manga_data)}件")
+
+        selected_frame = select_manga(manga_data)
+        selected_records = select_manga_records(manga_data)
+
+        print("\n=== 選定結果の集計 ===")
+        print(f"選定数: {len(selected_frame)}件")
+        print(f"FANZA限定: {int(selected_frame['is_exclusive'].sum())}件")
+        print(
+            f"ランキング表示あり: {int((selected_frame['ranking_text'] != '').sum())}件"
         )
+        print("価格の分布:")
+        print(selected_frame["price_value"].describe().to_string())
+        if "source_floor" in selected_frame:
+            print("フロア別の件数:")
+            print(selected_frame["source_floor"].value_counts().to_string())
+
+        # 通常の経路と選定結果が一致するか確認
+        frame_texts = selected_frame["post_text"].tolist()
+        record_texts = [item["post_text"] for item in selected_records]
+        if frame_texts != record_texts:
+            print("警告: 通常の選定処理と分析モードの選定結果が一致しません")
+            return False
 
-        print("単話・ノベル判定完了")
+        print("通常の選定処理と分析モードの選定結果は一致しています")
+        return True
 
-        # 予約商品を除外
-        df = df[~df["is_reservation"]]
+    except Exception as e:
+        print(f"データ分析エラー: {e}")
+        import traceback
 
-        print(f"予約商品除外後: {len(df)}件")
+        print(f"詳細: {traceback.format_exc()}")
+        return False
 
-        # 新着作品から、400円未満と単話とノベルを除外
-        selected_manga = df[
-            (df["is_new"] == True)
-            & ((df["price_value"].isnull()) | (df["price_value"] >= 400))
-            & (~df["is_tankowa"])
-            & (~df["is_novel"])
-        ].copy()
 
-        print(f"条件適合作品絞り込み完了: {len(selected_manga)}件")
+def cover_image_url(row):
+    """作品の表紙画像のURLを返す（imageURLがない場合は空文字）"""
+    image_url = row.get("imageURL")
+    if isinstance(image_url, str):
+        return image_url
+    if isinstance(image_url, dict):
+        for key in COVER_IMAGE_KEYS:
+            if image_url.get(key):
+                return image_url[key]
+    return ""
 
-        # 以下、選定された作品のみに適用する処理（ランキング情報の表示は残す）
-        def format_ranking(row):
-            if "ranking_info" not in row:
-                return ""
 
-            ranking_info = row["ranking_info"]
-            ranking_text = []
+def prefetch_cover_images(posts):
+    """
+    作品の表紙画像を並列に取得して画像キャッシュに保存し、各作品のmedia_pathに設定する
+    環境変数POST_IMAGESが0の場合は取得しない（テキストのみで投稿する）
+    戻り値: 画像キャッシュ（取得しなかった場合はNone）
+    """
+    if os.getenv("POST_IMAGES", "1") == "0":
+        return None
+    urls = [post.get("image_url") for post in posts]
+    if not any(urls):
+        return None
+
+    image_cache = ImageCache.from_env()
+    paths = image_cache.prefetch(urls)
+    for post in posts:
+        path = paths.get(post.get("image_url"))
+        if path:
+            post["media_path"] = path
+    return image_cache
+
+
+def rewrite_post(post):
+    """
+    投稿キューから取り出した作品の投稿テキストをAIでリライトする
+    OPENROUTER_CANDIDATESが2以上の場合は、残りの案を重複エラー時の予備として保存する
+    """
+    # 投稿テキストを取得
+    post_text = post["post_text"]
+
+    # AIでリライト処理
+    print("AIによるテキストリライト処理を開始します...")
+    candidate_count = int(
+        os.getenv("OPENROUTER_CANDIDATES", DEFAULT_REWRITE_CANDIDATES)
+    )
+    if candidate_count > 1:
+        # 最も評価の高い案を使い、残りは重複エラー時の予備として保存する
+        candidates = rewrite_candidates_with_ai(post_text, candidate_count)
+        rewritten_text = candidates[0]
+        post["spare_post_texts"] = candidates[1:]
+    else:
+        rewritten_text = rewrite_text_with_ai(post_text)
 
-            if "daily_rank" in ranking_info and ranking_info["daily_rank"] <= 50:
-                ranking_text.append(f"日間{ranking_info['daily_rank']}位")
+    # リライトされたテキストで結果を更新
+    post["post_text"] = rewritten_text
+    return post
 
-            if "weekly_rank" in ranking_info and ranking_info["weekly_rank"] <= 100:
-                ranking_text.append(f"週間{ranking_info['weekly_rank']}位")
 
-            if "monthly_rank" in ranking_info and ranking_info["monthly_rank"] <= 200:
-                ranking_text.append(f"月間{ranking_info['monthly_rank']}位")
+def rewrite_posts(posts):
+    """
+    投稿キューから取り出した作品を順にリライトし、並行して表紙画像を取得する
+    （画像の取得でリライトの完了が遅れないようにする）
+    戻り値: 画像キャッシュ（画像を取得しなかった場合はNone）
+    """
+    with ThreadPoolExecutor(max_workers=1) as image_executor:
+        image_future = image_executor.submit(prefetch_cover_images, posts)
+        for post in posts:
+            print(f"投稿キューの作品を処理します: {post['title']}")
+            rewrite_post(post)
+        try:
+            return image_future.result()
+        except Exception as e:
+            print(f"表紙画像の取得に失敗しました: {e}")
+            return None
 
-            return "・".join(ranking_text)
 
-        selected_manga["ranking_text"] = selected_manga.apply(format_ranking, axis=1)
+def process_manga_data(process_single=True, burst_size=1):
+    """
+    取得した漫画データを整形・選定
+    process_single: Trueの場合、投稿キューから取り出した1件だけをリライト、
+                    Falseの場合は全件を並列にリライトしてrewritten_posts.jsonlに保存
+    burst_size: 2以上の場合、投稿キューから最大burst_size件を取り出してリライトし、
+                連続投稿用にburst_posts.jsonに保存
+    """
+    global rewrite_cache
 
-        # 投稿用テキスト作成
-        def create_post_text(row):
-            post_parts = []
+    try:
+        # 以前のリライト結果を再利用するためのキャッシュ
+        rewrite_cache = create_rewrite_cache()
 
-            # タイトル
-            title = row.get("title", "")
-            post_parts.append(f"『{title}』")
+        # 生データの読み込み
+        manga_data = load_raw_manga_data()
 
-            # 作者
-            if "author" in row:
-                author = row["author"]
-                if author:
-                    post_parts.append(f"作者: {author}")
-            elif "artistName" in row:
-                author = row["artistName"]
-                if author:
-                    post_parts.append(f"作者: {author}")
-
-            # 特徴（新着・限定のみ表示）
-            features = []
-            if row["is_new"]:
-                features.append("🆕新着")
-            if row["is_exclusive"]:
-                features.append("🔒FANZA限定")
-
-            if features:
-                post_parts.append("【" + "・".join(features) + "】")
-
-            # ランキング情報があれば表示
-            if row["ranking_text"]:
-                post_parts.append(f"📊ランキング: {row['ranking_text']}")
-
-            # 価格
-            if (
-                "prices" in row
-                and isinstance(row["prices"], dict)
-                and "price" in row["prices"]
-            ):
-                price = row["prices"]["price"]
-                post_parts.append(f"💴価格: {price}円")
-
-            # ハッシュタグを本文の後に配置
-            post_parts.append("#PR")
-
-            # URLはpost_textには含めない（JSONの別フィールドとして保存）
-            # アフィリエイトURLはリライト時にJSONから直接取得する
-
-            return "\n".join(post_parts)
-
-        # 初期の投稿テキスト作成
-        selected_manga["post_text"] = selected_manga.apply(create_post_text, axis=1)
+        print(f"読み込んだデータ: {len(manga_data)}件")
+
+        # 投稿候補の選定と投稿用テキストの作成
+        selected_manga = select_manga_records(manga_data)
 
         # 選定結果をJSONで保存
         result = []
-        for _, row in selected_manga.iterrows():
+        for row in selected_manga:
             # アフィリエイトURLを構築
             original_url = row.get("affiliateURL", "") or row.get("URL", "")
 
@@ -655,12 +1717,18 @@ def process_manga_data(process_single=True):
             else:
                 fixed_url = ""
 
-            # 画像URLは含めない
             item = {
                 "title": row.get("title", ""),
                 "affiliateURL": fixed_url,
                 "post_text": row.get("post_text", ""),
             }
+            # 投稿に添付する表紙画像のURLを追加
+            image_url = cover_image_url(row)
+            if image_url:
+                item["image_url"] = image_url
+            # 投稿履歴との照合に使うcontent_idを追加
+            if row.get("content_id"):
+                item["content_id"] = row["content_id"]
             # authorフィールドが存在する場合のみ追加
             if "author" in row:
                 item["author"] = row["author"]
@@ -671,46 +1739,93 @@ def process_manga_data(process_single=True):
 
         print(f"抽出完了: {len(result)}件の新着作品を抽出しました")
 
+        # 過去7日以内に投稿済みの作品は、リライトする前に飛ばす
+        recent_posts = post_history.load_recent_posts()
+
+        def is_posted(item):
+            return recent_posts.find(item["title"], item.get("content_id")) is not None
+
+        # 全件リライトする場合（--all）
+        if not process_single and result:
+            pending = [
+                index for index, item in enumerate(result) if not is_posted(item)
+            ]
+            if len(pending) < len(result):
+                print(
+                    f"過去7日以内に投稿済みの{len(result) - len(pending)}件はリライトしません"
+                )
+            rewrite_all_posts(result, indices=pending)
+            print(f"リライトキャッシュ: {rewrite_cache.stats_text()}")
+            print(f"通信量:\n{http_transport.stats_text()}")
+
         # 1件だけリライト処理をする場合
         if process_single and result:
-            # 次に処理すべきインデックスを取得
-            next_index = get_next_post_index()
-
-            # インデックスがリストの範囲外の場合は最初からやり直す
-            if next_index >= len(result):
-                next_index = 0
-                print(f"すべての投稿を処理しました。インデックスを0にリセットします。")
+            # 前回投稿できなかった作品をキューに戻し、投稿済みになった作品を除いてから、
+            # 選定した作品を追加し、最も優先度の高い未投稿の作品を取り出す
+            posting_queue = PostQueue()
+            for item in posting_queue.release():
+                print(
+                    f"前回投稿できなかった作品を投稿キューに戻しました: {item['title']}"
+                )
+            for item in posting_queue.prune(is_posted):
+                print(
+                    f"投稿済みまたは期限切れのため投稿キューから削除しました: {item['title']}"
+                )
+            added = 0
+            for position, (row, item) in enumerate(zip(selected_manga, result)):
+                if is_posted(item):
+                    continue
+                if posting_queue.enqueue(
+                    queue_key(item), item, post_priority(row, position)
+                ):
+                    added += 1
+            print(f"投稿キューに{added}件を追加しました（待ち {len(posting_queue)}件）")
+
+            # 連続投稿の場合は最大burst_size件を取り出す
+            posts = []
+            while len(posts) < burst_size:
+                post, dropped = posting_queue.dequeue(is_posted)
+                for item in dropped:
+                    print(
+                        f"投稿済みまたは期限切れのため投稿キューから削除しました: {item['title']}"
+                    )
+                if post is None:
+                    break
+                posts.append(post)
 
-                # インデックスが0にリセットされる場合、データを更新するが、無限ループ防止のためここでは再実行せず終了する
+            if not posts:
+                posting_queue.save()
                 print(
-                    "すべての投稿を処理したため、終了します。次回実行時に新しいデータが取得されます。"
+                    "投稿キューに未投稿の作品がないため、終了します。次回実行時に新しいデータが取得されます。"
                 )
-                save_processed_index(next_index)  # リセットされたインデックスを保存
-                return True  # ここで処理を終了
+                return True
 
             print(
-                f"投稿 {next_index+1}/{len(result)} を処理します: {result[next_index]['title']}"
+                f"投稿キューから{len(posts)}件を取り出しました（残り {len(posting_queue)}件）"
             )
+            image_cache = rewrite_posts(posts)
 
-            # 投稿テキストを取得
-            post_text = result[next_index]["post_text"]
-
-            # AIでリライト処理
-            print("AIによるテキストリライト処理を開始します...")
-            rewritten_text = rewrite_text_with_ai(post_text)
-
-            # リライトされたテキストで結果を更新
-            result[next_index]["post_text"] = rewritten_text
-
-            # 単一の投稿結果をJSONで保存
-            with open("current_post.json", "w", encoding="utf-8") as f:
-                json.dump(result[next_index], f, ensure_ascii=False, indent=2)
-
-            # 処理したインデックスを保存
-            save_processed_index(next_index)
-
-            print(f"投稿 {next_index+1} のリライト処理完了")
-            print(f"リライト結果を current_post.json に保存しました")
+            if burst_size > 1:
+                # 連続投稿する作品のリストをJSONで保存（post_to_x.py --burst で投稿する）
+                output_path = BURST_POSTS_FILE
+                with open(output_path, "w", encoding="utf-8") as f:
+                    json.dump(posts, f, ensure_ascii=False, indent=2)
+            else:
+                # 単一の投稿結果をJSONで保存
+                output_path = "current_post.json"
+                with open(output_path, "w", encoding="utf-8") as f:
+                    json.dump(posts[0], f, ensure_ascii=False, indent=2)
+
+            # 取り出した作品は取り出し中として保存する（投稿後にpost_to_x.pyが削除し、
+            # 投稿に失敗した場合は次回キューに戻す）
+            posting_queue.save()
+
+            print(f"リライト処理完了: {len(posts)}件")
+            print(f"リライトキャッシュ: {rewrite_cache.stats_text()}")
+            if image_cache is not None:
+                print(f"画像キャッシュ: {image_cache.stats_text()}")
+            print(f"通信量:\n{http_transport.stats_text()}")
+            print(f"リライト結果を {output_path} に保存しました")
 
         return True
 
@@ -726,9 +1841,15 @@ if __name__ == "__main__":
     # コマンドライン引数があれば処理
     import sys
 
-    if len(sys.argv) > 1 and sys.argv[1] == "--all":
+    if len(sys.argv) > 1 and sys.argv[1] == "--analytics":
+        # pandasによる選定状況の分析のみ行う
+        analyze_manga_data()
+    elif len(sys.argv) > 1 and sys.argv[1] == "--all":
         # 全件リライトする場合
         process_manga_data(process_single=False)
+    elif len(sys.argv) > 2 and sys.argv[1] == "--burst":
+        # 連続投稿用に投稿キューから指定件数をリライトする場合
+        process_manga_data(process_single=True, burst_size=int(sys.argv[2]))
     else:
         # デフォルトは1件だけリライト
         process_manga_data(process_single=True)
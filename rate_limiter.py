@@ -0,0 +1,231 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+外部API（DMM・OpenRouter・X）共通のレート制限とリトライ処理
+ホストごとのトークンバケットで送信間隔を調整し、429やサーバーエラーはRetry-After /
+x-rate-limit-resetヘッダーに従って待機、ヘッダーがなければジッター付き指数バックオフで再試行する
+"""
+
+import contextlib
+import logging
+import os
+import random
+import threading
+import time
+import urllib.parse
+from email.utils import parsedate_to_datetime
+
+import requests
+
+# http_transportの読み込み時に.envの設定が反映されるため、以下の定数にも.envの値が使われる
+import http_transport
+
+logger = logging.getLogger(__name__)
+
+# ホストごとのレート制限（1秒あたりのリクエスト数, バースト上限）
+DEFAULT_RATE_LIMITS = {
+    "api.dmm.com": (10.0, 10),
+    "openrouter.ai": (1.0, 2),
+    "api.twitter.com": (0.5, 1),
+}
+
+# 上記にないホストのレート制限
+FALLBACK_RATE_LIMIT = (5.0, 5)
+
+# 再試行の対象とするHTTPステータスコード
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+# デフォルトの最大再試行回数
+DEFAULT_MAX_RETRIES = 3
+
+# 指数バックオフの基準秒数と上限秒数
+BACKOFF_BASE = 1.0
+BACKOFF_CAP = 30.0
+
+# サーバー指定の待機時間がこれを超える場合は待たずに諦める（cronの実行時間を守るため）
+MAX_WAIT = float(os.getenv("RATE_LIMIT_MAX_WAIT", 300))
+
+
+class TokenBucket:
+    """
+    スレッドセーフなトークンバケット
+    acquireは送信可能になるまで待機し、block_forで指定秒数すべての送信を止める
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """トークンを1つ消費する（足りなければ補充されるまで待機）"""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                if now < self.blocked_until:
+                    wait = self.blocked_until - now
+                else:
+                    self.tokens = min(
+                        self.capacity, self.tokens + (now - self.updated) * self.rate
+                    )
+                    self.updated = now
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                    wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def block_for(self, seconds):
+        """サーバーからレート制限を通知された場合に、指定秒数すべての送信を止める"""
+        with self._lock:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+
+_buckets = {}
+_buckets_lock = threading.Lock()
+
+
+def get_bucket(host):
+    """ホストに対応するトークンバケットを返す（全呼び出し元で共有）"""
+    with _buckets_lock:
+        if host not in _buckets:
+            rate, capacity = DEFAULT_RATE_LIMITS.get(host, FALLBACK_RATE_LIMIT)
+            _buckets[host] = TokenBucket(rate, capacity)
+        return _buckets[host]
+
+
+def configure(host, rate, capacity):
+    """ホストのレート制限を変更する（ローカルのスタブサーバーなどで使用）"""
+    with _buckets_lock:
+        _buckets[host] = TokenBucket(rate, capacity)
+
+
+def backoff_delay(attempt, base=BACKOFF_BASE, cap=BACKOFF_CAP):
+    """ジッター付き指数バックオフの待機秒数（attemptは0始まり）"""
+    delay = min(cap, base * (2**attempt))
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+def server_wait_seconds(headers):
+    """
+    Retry-After / x-rate-limit-resetヘッダーから待機すべき秒数を返す（指定がなければNone）
+    Retry-Afterは秒数とHTTP日付の両方、x-rate-limit-resetはUNIX時刻に対応する
+    """
+    if not headers:
+        return None
+
+    retry_after = headers.get("Retry-After")
+    if retry_after:
+        try:
+            return max(0.0, float(retry_after))
+        except ValueError:
+            try:
+                reset_at = parsedate_to_datetime(retry_after).timestamp()
+                return max(0.0, reset_at - time.time())
+            except (TypeError, ValueError):
+                pass
+
+    reset = headers.get("x-rate-limit-reset")
+    if reset:
+        try:
+            return max(0.0, float(reset) - time.time())
+        except ValueError:
+            pass
+
+    return None
+
+
+def retry_delay(attempt, headers=None):
+    """再試行までの待機秒数（サーバー指定があればそれを優先し、少しだけジッターを加える）"""
+    wait = server_wait_seconds(headers)
+    if wait is not None:
+        return wait + random.uniform(0, 0.5)
+    return backoff_delay(attempt)
+
+
+def request_with_retry(
+    method, url, max_retries=DEFAULT_MAX_RETRIES, slot=None, **kwargs
+):
+    """
+    レート制限付きでHTTPリクエストを送信し、429・5xx・接続エラーは待機して再試行する
+    再試行しても成功しない場合は最後のレスポンスを返す（接続エラーの場合は例外を送出）
+    slot（セマフォなど）を指定した場合は、各リクエストの送信中だけ取得する（再試行の待機中は解放する）
+    """
+    host = urllib.parse.urlparse(url).hostname
+    bucket = get_bucket(host)
+
+    for attempt in range(max_retries + 1):
+        bucket.acquire()
+        try:
+            with slot or contextlib.nullcontext():
+                response = http_transport.request(method, url, **kwargs)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            if attempt >= max_retries:
+                raise
+            delay = backoff_delay(attempt)
+            logger.warning(
+                f"{host}への接続エラー: {e} - {delay:.1f}秒後に再試行します"
+                f"（{attempt + 1}/{max_retries}）"
+            )
+            time.sleep(delay)
+            continue
+
+        if response.status_code not in RETRY_STATUS_CODES or attempt >= max_retries:
+            return response
+
+        delay = retry_delay(attempt, response.headers)
+        if delay > MAX_WAIT:
+            logger.warning(
+                f"{host}のレート制限解除まで{delay:.0f}秒かかるため再試行を中止します"
+            )
+            return response
+
+        if response.status_code == 429:
+            # 同じホストへの他のリクエストも解除まで待たせる
+            bucket.block_for(delay)
+        logger.warning(
+            f"{host}からステータス{response.status_code}を受信しました - "
+            f"{delay:.1f}秒後に再試行します（{attempt + 1}/{max_retries}）"
+        )
+        # stream=Trueで受信したレスポンスが接続を使ったまま待機しないよう、先に閉じて接続を返す
+        response.close()
+        time.sleep(delay)
+
+    return response
+
+
+def call_with_retry(
+    host, func, is_retryable, get_headers=None, max_retries=DEFAULT_MAX_RETRIES
+):
+    """
+    requests以外のクライアント（tweepyなど）の呼び出しをレート制限付きで実行する
+    is_retryable(例外)がTrueを返す例外は待機して再試行し、それ以外はそのまま送出する
+    get_headers(例外)でレスポンスヘッダーを取り出せる場合はその待機時間に従う
+    """
+    bucket = get_bucket(host)
+
+    for attempt in range(max_retries + 1):
+        bucket.acquire()
+        try:
+            return func()
+        except Exception as e:
+            if attempt >= max_retries or not is_retryable(e):
+                raise
+
+            headers = get_headers(e) if get_headers else None
+            delay = retry_delay(attempt, headers)
+            if delay > MAX_WAIT:
+                logger.warning(
+                    f"{host}のレート制限解除まで{delay:.0f}秒かかるため再試行を中止します"
+                )
+                raise
+            if server_wait_seconds(headers) is not None:
+                bucket.block_for(delay)
+            logger.warning(
+                f"{host}の呼び出しでエラーが発生しました: {e} - "
+                f"{delay:.1f}秒後に再試行します（{attempt + 1}/{max_retries}）"
+            )
+            time.sleep(delay)
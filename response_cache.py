@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+APIレスポンスのディスクキャッシュ（DMM APIのレスポンスやAIリライト結果）
+リクエストパラメータ（api_idを除く）をキーに、エンドポイントごとの有効期限付きで保存する
+"""
+
+import hashlib
+import json
+import os
+import time
+
+from disk_cache import DiskCache
+
+# デフォルトのキャッシュ保存先
+DEFAULT_CACHE_DIR = os.path.join(".cache", "dmm")
+
+# エンドポイントごとのデフォルト有効期限（秒）
+DEFAULT_TTLS = {
+    # ランキングは数時間ではほとんど変わらないため、次回の定期実行まで使い回す
+    "ItemList": 3 * 60 * 60,
+    # フロア一覧はほぼ変化しないため数日間有効
+    "FloorList": 3 * 24 * 60 * 60,
+}
+
+# キャッシュ全体の上限サイズ（MB）
+DEFAULT_MAX_MB = 50
+
+# キャッシュキーから除外するパラメータ（認証情報はキーにもファイルにも残さない）
+EXCLUDED_PARAMS = ("api_id",)
+
+
+class ResponseCache(DiskCache):
+    """
+    APIレスポンスをJSONファイルとして保存するキャッシュ（上限サイズを超えたらLRUで削除する）
+    """
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, ttls=None, max_bytes=None):
+        super().__init__(
+            cache_dir,
+            max_bytes if max_bytes is not None else DEFAULT_MAX_MB * 1024 * 1024,
+        )
+        self.ttls = dict(DEFAULT_TTLS)
+        if ttls:
+            self.ttls.update(ttls)
+
+    @classmethod
+    def from_env(cls):
+        """
+        環境変数から設定を読み込んでキャッシュを作成する
+        DMM_CACHE_DIR: 保存先 / DMM_CACHE_MAX_MB: 上限サイズ
+        DMM_CACHE_TTL_ITEMLIST, DMM_CACHE_TTL_FLOORLIST: 有効期限（秒、0でキャッシュしない）
+        """
+        ttls = {}
+        for endpoint in DEFAULT_TTLS:
+            value = os.getenv(f"DMM_CACHE_TTL_{endpoint.upper()}")
+            if value is not None:
+                ttls[endpoint] = int(value)
+
+        return cls(
+            cache_dir=os.getenv("DMM_CACHE_DIR", DEFAULT_CACHE_DIR),
+            ttls=ttls,
+            max_bytes=int(os.getenv("DMM_CACHE_MAX_MB", DEFAULT_MAX_MB)) * 1024 * 1024,
+        )
+
+    def make_key(self, endpoint, params):
+        """エンドポイントと正規化したパラメータからキャッシュキーを作成する"""
+        normalized = {
+            str(key): str(value)
+            for key, value in params.items()
+            if key not in EXCLUDED_PARAMS and value is not None
+        }
+        source = json.dumps([endpoint, normalized], sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(source.encode("utf-8")).hexdigest()
+
+    def is_entry(self, name):
+        return name.endswith(".json")
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def get(self, endpoint, params):
+        """キャッシュ済みのレスポンスを返す（未登録・期限切れの場合はNone）"""
+        ttl = self.ttls.get(endpoint, 0)
+        if ttl <= 0:
+            return None
+
+        path = self._path(self.make_key(endpoint, params))
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            with self._lock:
+                self.misses += 1
+            return None
+
+        if time.time() - entry.get("created_at", 0) > ttl:
+            # 期限切れのエントリは削除してミス扱いにする
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            with self._lock:
+                self.misses += 1
+            return None
+
+        self.touch(path)
+        with self._lock:
+            self.hits += 1
+        return entry.get("data")
+
+    def set(self, endpoint, params, data):
+        """レスポンスを保存し、上限サイズを超えていれば古いエントリを削除する"""
+        if self.ttls.get(endpoint, 0) <= 0:
+            return
+
+        path = self._path(self.make_key(endpoint, params))
+        entry = {"endpoint": endpoint, "created_at": time.time(), "data": data}
+        self.write_file(path, json.dumps(entry, ensure_ascii=False))
+        self.evict()
@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+投稿テキストの類似検索（MinHashとLSH）
+URL・ハッシュタグ・記号を除いたテキストを文字n-gramに分け、MinHashの署名で類似度（Jaccard係数）を推定する
+署名を帯（band）ごとに分けたバケットに登録しておき、同じバケットに入った投稿とだけ比べるため、
+索引の件数が増えても確認1回あたりに比べる投稿の数はほとんど増えない
+"""
+
+import re
+import unicodedata
+import zlib
+
+# 署名の長さ（ハッシュ関数の数）と、LSHの帯の数（帯あたりの行数 = 署名の長さ / 帯の数）
+DEFAULT_NUM_PERM = 64
+DEFAULT_BANDS = 16
+
+# 文字n-gramの長さ
+DEFAULT_SHINGLE_SIZE = 3
+
+# 似ているとみなす推定Jaccard係数
+DEFAULT_THRESHOLD = 0.7
+
+# 署名の計算に使う素数（2^61 - 1）と、ハッシュ関数の係数を決める乱数の種
+MERSENNE_PRIME = (1 << 61) - 1
+PERMUTATION_SEED = 1
+
+# 比較の前に除くURLとハッシュタグ
+URL_PATTERN = re.compile(r"https?://\S+")
+HASHTAG_PATTERN = re.compile(r"#\S+")
+
+
+def normalize_text(text):
+    """URL・ハッシュタグを除き、全角・半角をそろえて文字と数字だけを残す"""
+    text = URL_PATTERN.sub("", text or "")
+    text = HASHTAG_PATTERN.sub("", text)
+    text = unicodedata.normalize("NFKC", text)
+    return "".join(
+        char for char in text if unicodedata.category(char)[0] in ("L", "N")
+    ).lower()
+
+
+def shingles(text, size=DEFAULT_SHINGLE_SIZE):
+    """正規化したテキストの文字n-gramの集合を返す（n文字未満のテキストは全体を1つとする）"""
+    text = normalize_text(text)
+    if len(text) <= size:
+        return {text} if text else set()
+    return {text[i : i + size] for i in range(len(text) - size + 1)}
+
+
+def make_permutations(num_perm, seed=PERMUTATION_SEED):
+    """ハッシュ関数 (a * x + b) mod p の係数を、実行ごとに同じ値になるよう作る"""
+    permutations = []
+    state = seed
+    for _ in range(num_perm):
+        values = []
+        for _ in range(2):
+            # 線形合同法（randomモジュールの状態に左右されない）
+            state = (state * 6364136223846793005 + 1442695040888963407) % (1 << 64)
+            values.append(state % (MERSENNE_PRIME - 1) + 1)
+        permutations.append(tuple(values))
+    return permutations
+
+
+class SimilarTextIndex:
+    """
+    投稿テキストのMinHash署名を帯ごとのバケットに登録し、似たテキストを引く索引
+    threshold以上と推定された投稿のうち、最も似ているものを返す
+    """
+
+    def __init__(
+        self,
+        threshold=DEFAULT_THRESHOLD,
+        num_perm=DEFAULT_NUM_PERM,
+        bands=DEFAULT_BANDS,
+        shingle_size=DEFAULT_SHINGLE_SIZE,
+    ):
+        if num_perm % bands:
+            raise ValueError("num_permはbandsで割り切れる必要があります")
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.rows = num_perm // bands
+        self.bands = bands
+        self.shingle_size = shingle_size
+        self.permutations = make_permutations(num_perm)
+        self.signatures = []
+        self.values = []
+        self.buckets = {}
+
+    def __len__(self):
+        return len(self.values)
+
+    def signature(self, text):
+        """テキストのMinHash署名を返す（比べる文字がなければNone）"""
+        hashes = [
+            zlib.crc32(shingle.encode("utf-8"))
+            for shingle in shingles(text, self.shingle_size)
+        ]
+        if not hashes:
+            return None
+        return tuple(
+            min((a * value + b) % MERSENNE_PRIME for value in hashes)
+            for a, b in self.permutations
+        )
+
+    def band_keys(self, signature):
+        rows = self.rows
+        return [
+            (band, signature[band * rows : (band + 1) * rows])
+            for band in range(self.bands)
+        ]
+
+    def add(self, text, value=None):
+        """テキストを索引に追加する（valueは見つかったときに返す値、省略時はテキスト）"""
+        signature = self.signature(text)
+        if signature is None:
+            return
+        position = len(self.values)
+        self.signatures.append(signature)
+        self.values.append(text if value is None else value)
+        for key in self.band_keys(signature):
+            self.buckets.setdefault(key, []).append(position)
+
+    def find(self, text):
+        """
+        似ているテキストを探す
+        戻り値: (値, 推定Jaccard係数)（threshold以上のものがなければNone）
+        """
+        signature = self.signature(text)
+        if signature is None:
+            return None
+
+        candidates = set()
+        for key in self.band_keys(signature):
+            candidates.update(self.buckets.get(key, ()))
+
+        best = None
+        for position in candidates:
+            other = self.signatures[position]
+            similarity = (
+                sum(1 for x, y in zip(signature, other) if x == y) / self.num_perm
+            )
+            if similarity >= self.threshold and (best is None or similarity > best[1]):
+                best = (self.values[position], similarity)
+        return best